@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import cipher, FRAME_SEALED_CHUNK
+from network.session import AeadSession, CIPHERS, new_nonce
+
+
+def bench_fernet(chunk, count):
+    for _ in range(count):
+        cipher.decrypt(cipher.encrypt(chunk))
+
+
+def bench_session(name):
+    client_nonce, server_nonce = new_nonce(), new_nonce()
+    tx = AeadSession(name, client_nonce, server_nonce, is_client=True)
+    rx = AeadSession(name, client_nonce, server_nonce, is_client=False)
+
+    def run(chunk, count):
+        for _ in range(count):
+            # open() принимает кадр без 4-байтового префикса длины
+            rx.open(tx.seal(FRAME_SEALED_CHUNK, chunk)[4:])
+    return run
+
+
+def measure(func, chunk_size, total_bytes):
+    chunk = os.urandom(chunk_size)
+    count = max(1, total_bytes // chunk_size)
+    cpu_start = time.process_time()
+    func(chunk, count)
+    cpu = time.process_time() - cpu_start
+    return count * chunk_size / (1024 * 1024) / cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fernet против сессионных AEAD-шифров (encrypt+decrypt)")
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--chunk-kb', type=int, nargs='+',
+                        default=[1, 64, 1024])
+    args = parser.parse_args()
+
+    total = args.size_mb * 1024 * 1024
+    candidates = [('fernet', bench_fernet)]
+    candidates += [(name, bench_session(name)) for name in CIPHERS]
+
+    print(f"{'cipher':<20} {'chunk':>8} {'MB/s per core':>14}")
+    for chunk_kb in args.chunk_kb:
+        for name, func in candidates:
+            mbps = measure(func, chunk_kb * 1024, total)
+            print(f"{name:<20} {chunk_kb:>6}KB {mbps:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
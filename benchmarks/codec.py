@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network import codec
+from network.protocol import CHUNK_HEADER
+from network.session import HEADER_SIZE, TAG_SIZE
+from utils.constans import FILE_CHUNK_SIZE
+
+
+def packets(text_size, chunk_size):
+    # Типичные пакеты чата. file_chunk в пакете-словаре - для сравнения
+    # с бинарным кадром, которым куски файлов уходят сейчас.
+    return [
+        ('msg', {'type': 'msg', 'text': ('Привет, как дела? ' * 64)[
+            :text_size]}),
+        ('file_req', {'type': 'file_req', 'id': 3735928559,
+                      'name': 'отчет за квартал.pdf', 'size': 734003200,
+                      'chunk_size': FILE_CHUNK_SIZE, 'streams': 3}),
+        ('file_chunk', {'type': 'file_chunk', 'id': 3735928559,
+                        'offset': 5 * FILE_CHUNK_SIZE,
+                        'data': os.urandom(chunk_size)}),
+    ]
+
+
+def codecs():
+    result = [('json', codec.JsonCodec())]
+    if codec.orjson:
+        result.append(('orjson', codec.OrjsonCodec()))
+    if codec.msgpack:
+        result.append(('msgpack', codec.MsgpackCodec()))
+    return result
+
+
+def timed(function, arg, repeat):
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function(arg)
+        elapsed = (time.perf_counter() - start) / repeat
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Кодеки пакетов: время encode/decode и размер на проводе")
+    parser.add_argument('--text-size', type=int, default=200)
+    parser.add_argument('--chunk-kb', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=2000,
+                        help="повторов на мелкие пакеты")
+    args = parser.parse_args()
+
+    chunk_size = args.chunk_kb * 1024
+    print(f"{'packet':<11} {'codec':<8} {'encode us':>10} {'decode us':>10} "
+          f"{'bytes':>9}")
+    for name, packet in packets(args.text_size, chunk_size):
+        # Куски файлов крупные: повторов меньше
+        repeat = max(10, args.repeat * 512 // max(512, chunk_size)) \
+            if name == 'file_chunk' else args.repeat
+        for codec_name, instance in codecs():
+            payload = instance.dumps(packet)
+            encode = timed(instance.dumps, packet, repeat)
+            decode = timed(instance.loads, payload, repeat)
+            print(f"{name:<11} {codec_name:<8} {encode * 1e6:>10.1f} "
+                  f"{decode * 1e6:>10.1f} {len(payload):>9}")
+        if name == 'file_chunk':
+            # Бинарный кадр: данные как есть плюс заголовок куска
+            print(f"{name:<11} {'frame':<8} {'-':>10} {'-':>10} "
+                  f"{len(packet['data']) + CHUNK_HEADER.size:>9}")
+    print(f"\nСессия добавляет к каждому кадру {HEADER_SIZE + TAG_SIZE} "
+          f"байт; согласованный кодек: {codec.PREFERRED_CODECS[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.compression import PREFERRED_COMPRESSION, get_compressor, \
+    compress
+from network.session import AeadSession, new_nonce
+from network.protocol import FRAME_SEALED_CHUNK
+
+LINK_SPEEDS_MBIT = [100, 1000]
+
+
+def make_log(size):
+    levels = ['INFO', 'WARN', 'DEBUG', 'ERROR']
+    lines = []
+    total = 0
+    while total < size:
+        line = (f"2026-10-18 12:{random.randint(0, 59):02d}:"
+                f"{random.randint(0, 59):02d} {random.choice(levels)} "
+                f"worker-{random.randint(1, 8)} request id="
+                f"{random.randint(0, 10 ** 6)} took "
+                f"{random.random() * 100:.2f}ms\n")
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode('utf-8')[:size]
+
+
+def make_csv(size):
+    rows = ["id,name,city,amount\n"]
+    total = len(rows[0])
+    while total < size:
+        row = (f"{random.randint(0, 10 ** 6)},user{random.randint(0, 999)},"
+               f"{random.choice(['Moscow', 'Kazan', 'Omsk'])},"
+               f"{random.randint(0, 10000)}.{random.randint(0, 99):02d}\n")
+        rows.append(row)
+        total += len(row)
+    return ''.join(rows).encode('utf-8')[:size]
+
+
+def make_json(size):
+    items = []
+    total = 0
+    while total < size:
+        item = {'user': f"user{random.randint(0, 999)}",
+                'online': random.random() > 0.5,
+                'tags': random.sample(['a', 'b', 'c', 'd', 'e'], 2)}
+        items.append(item)
+        total += 60
+    return json.dumps(items).encode('utf-8')[:size]
+
+
+def make_random(size):
+    return os.urandom(size)
+
+
+CORPORA = [('log', make_log), ('csv', make_csv), ('json', make_json),
+           ('random', make_random)]
+
+
+def run(compressor, corpus, chunk_size):
+    client_nonce, server_nonce = new_nonce(), new_nonce()
+    tx = AeadSession('aes-256-gcm', client_nonce, server_nonce, True)
+    rx = AeadSession('aes-256-gcm', client_nonce, server_nonce, False)
+
+    wire = 0
+    start = time.process_time()
+    for pos in range(0, len(corpus), chunk_size):
+        chunk = corpus[pos:pos + chunk_size]
+        packed = compress(compressor, chunk)
+        payload = chunk if packed is None else packed
+        frame = tx.seal(FRAME_SEALED_CHUNK, payload)
+        wire += len(frame)
+        plain = rx.open(frame[4:])
+        if packed is not None:
+            compressor.decompress(plain)
+    cpu = time.process_time() - start
+    return cpu, wire
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Эффективная скорость передачи со сжатием и без")
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--chunk-kb', type=int, default=1024)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    chunk_size = args.chunk_kb * 1024
+    codecs = [('none', None)] + [(name, get_compressor(name))
+                                 for name in PREFERRED_COMPRESSION]
+
+    header = f"{'corpus':<8} {'codec':<6} {'ratio':>6} {'CPU MB/s':>10}"
+    for speed in LINK_SPEEDS_MBIT:
+        header += f" {f'eff@{speed}Mb':>12}"
+    print(header)
+
+    for corpus_name, make in CORPORA:
+        corpus = make(size)
+        for codec_name, compressor in codecs:
+            cpu, wire = run(compressor, corpus, chunk_size)
+            mb = len(corpus) / (1024 * 1024)
+            line = (f"{corpus_name:<8} {codec_name:<6} "
+                    f"{wire / len(corpus):>6.2f} "
+                    f"{mb / cpu:>10.1f}")
+            # Эффективная скорость: упираемся либо в CPU, либо в канал
+            for speed in LINK_SPEEDS_MBIT:
+                link_time = wire * 8 / (speed * 1000 * 1000)
+                line += f" {mb / max(cpu, link_time):>12.1f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
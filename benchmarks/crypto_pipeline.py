@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.session import AeadSession, new_nonce
+from network.async_transport import EventLoopThread, AsyncConnection
+
+
+def make_sessions():
+    client_nonce, server_nonce = new_nonce(), new_nonce()
+    return (AeadSession('aes-256-gcm', client_nonce, server_nonce, True),
+            AeadSession('aes-256-gcm', client_nonce, server_nonce, False))
+
+
+def tcp_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    tx = socket.create_connection(listener.getsockname())
+    rx, _ = listener.accept()
+    listener.close()
+    return tx, rx
+
+
+def wrap(loop_thread, sock, session):
+    async def open_conn():
+        reader, writer = await asyncio.open_connection(sock=sock)
+        return AsyncConnection(reader, writer, loop_thread)
+    conn = loop_thread.call(open_conn())
+    conn.session = session
+    return conn
+
+
+def run(workers, peers, count, text):
+    # peers пар соединений в одном цикле; у каждой свой отправляющий
+    # поток (как поток GUI или передачи). Замер: общая скорость и время,
+    # которое send_json занимает у вызывающего потока.
+    loop_thread = EventLoopThread(workers)
+    pairs = []
+    remaining = [peers * count]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def on_packet(data):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    for _ in range(peers):
+        tx_sock, rx_sock = tcp_pair()
+        tx_session, rx_session = make_sessions()
+        tx = wrap(loop_thread, tx_sock, tx_session)
+        rx = wrap(loop_thread, rx_sock, rx_session)
+        rx.start_reading(on_packet)
+        pairs.append((tx, rx))
+
+    calls = []
+
+    def sender(conn):
+        own = []
+        for i in range(count):
+            start = time.perf_counter()
+            conn.send_json({'type': 'msg', 'text': text, 'n': i})
+            own.append(time.perf_counter() - start)
+        calls.extend(own)
+
+    threads = [threading.Thread(target=sender, args=(tx,))
+               for tx, _ in pairs]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.wait(120)
+    elapsed = time.perf_counter() - start
+
+    for tx, rx in pairs:
+        tx.close()
+        rx.close()
+    loop_thread.stop()
+    calls.sort()
+    total = peers * count
+    return (total / elapsed, total * len(text) / elapsed / (1024 * 1024),
+            calls[len(calls) // 2], calls[len(calls) * 99 // 100])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Шифрование в пуле потоков: скорость от числа потоков")
+    parser.add_argument('--peers', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=2000,
+                        help="сообщений на соединение")
+    parser.add_argument('--text-size', type=int, nargs='+',
+                        default=[64, 16 * 1024])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU, {args.peers} peers")
+    print(f"{'size':>7} {'workers':>8} {'msg/s':>10} {'MB/s':>8} "
+          f"{'send p50 us':>12} {'send p99 us':>12}")
+    for size in args.text_size:
+        text = 'x' * size
+        for workers in args.workers:
+            rate, mbps, p50, p99 = run(workers, args.peers, args.messages,
+                                       text)
+            print(f"{size:>7} {workers:>8} {rate:>10.0f} {mbps:>8.1f} "
+                  f"{p50 * 1e6:>12.1f} {p99 * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
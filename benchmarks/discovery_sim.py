@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.broadcast_discovery import BroadcastDiscovery, \
+    AnnounceSchedule, pack_announcement, NEW_PEER_REPLY_WINDOW, \
+    NEW_PEER_REPLY_FANOUT
+
+# Старый протокол: полный JSON каждые 3 секунды
+LEGACY_INTERVAL = 3
+
+
+class LegacyListener:
+    # Повторяет прежний _listen_worker: разбор JSON и перезапись записи
+    # на каждый пакет
+    def __init__(self):
+        self.known_users = {}
+        self.users_lock = threading.Lock()
+
+    def handle_packet(self, data, addr, now):
+        message = json.loads(data.decode('utf-8'))
+        if message.get('type') != 'chat_user':
+            return
+        user_key = f"{message['username']}_{message['ip']}"
+        with self.users_lock:
+            self.known_users[user_key] = {
+                'username': message['username'],
+                'ip': message['ip'],
+                'tcp_port': message['tcp_port'],
+                'last_seen': message['timestamp']
+            }
+
+    def get_online_users(self):
+        with self.users_lock:
+            return list(self.known_users.values())
+
+    def expire(self, now):
+        with self.users_lock:
+            for key, user in list(self.known_users.items()):
+                if now - user['last_seen'] > 120:
+                    del self.known_users[key]
+
+
+class VirtualPeer:
+    def __init__(self, index):
+        self.index = index
+        self.username = f"user{index:04d}"
+        self.ip = f"10.0.{index // 250}.{index % 250 + 1}"
+        self.addr = (self.ip, 40000 + index)
+        self.epoch = random.getrandbits(32)
+        self.seq = 0
+        self.schedule = AnnounceSchedule()
+        self.next_at = 0.0
+        self.joined = False
+
+
+def legacy_packets(peers, duration, start_window):
+    # (время, пир, пакет) для старого протокола
+    events = []
+    for peer in peers:
+        t = random.random() * start_window
+        while t < duration:
+            events.append((t, peer, None))
+            t += LEGACY_INTERVAL
+    events.sort(key=lambda e: e[0])
+    for t, peer, _ in events:
+        yield t, peer, json.dumps({
+            'type': 'chat_user', 'username': peer.username, 'ip': peer.ip,
+            'tcp_port': 5005, 'timestamp': t}).encode('utf-8')
+
+
+def adaptive_packets(peers, duration, start_window, churn_per_min):
+    # Дискретная модель: каждый узел живет по AnnounceSchedule, на
+    # появление нового узла часть сети отвечает досрочно, churn - доля
+    # узлов в минуту, меняющих свои данные (порт/имя)
+    heap = []
+    for peer in peers:
+        peer.next_at = random.random() * start_window
+        heapq.heappush(heap, (peer.next_at, peer.index))
+    changes = []
+    t = 0.0
+    while t < duration:
+        t += random.expovariate(churn_per_min * len(peers) / 60) \
+            if churn_per_min else duration
+        changes.append(t)
+
+    known = 0
+    while heap:
+        t, index = heapq.heappop(heap)
+        if t >= duration:
+            break
+        peer = peers[index]
+        if t != peer.next_at:
+            continue  # Устаревшая запись после досрочного объявления
+        while changes and changes[0] <= t:
+            changes.pop(0)
+            changed = random.choice(peers)
+            changed.seq += 1
+            changed.schedule.reset()
+            if changed.joined and changed.next_at > t:
+                changed.next_at = t
+                heapq.heappush(heap, (t, changed.index))
+
+        delay = peer.schedule.next_delay()
+        peer.next_at = t + delay
+        heapq.heappush(heap, (peer.next_at, index))
+        yield t, peer, pack_announcement(peer.username, peer.ip, 5005,
+                                         peer.epoch, peer.seq, delay)
+
+        if not peer.joined:
+            peer.joined = True
+            known += 1
+            # Досрочные ответы новому узлу (как _reply_soon)
+            chance = min(1.0, NEW_PEER_REPLY_FANOUT / max(known, 1))
+            for other in peers:
+                if other is peer or not other.joined or \
+                        random.random() > chance:
+                    continue
+                reply_at = t + random.random() * NEW_PEER_REPLY_WINDOW
+                if reply_at < other.next_at:
+                    other.next_at = reply_at
+                    heapq.heappush(heap, (reply_at, other.index))
+
+
+def simulate(name, listener, packets, duration, warmup):
+    # Один узел-получатель обрабатывает весь широковещательный поток
+    per_second = [0] * (int(duration) + 1)
+    total_bytes = 0
+    steady_packets = 0
+    last_expire = 0
+    cpu = 0.0
+    for t, peer, data in packets:
+        per_second[int(t)] += 1
+        total_bytes += len(data)
+        if t >= warmup:
+            steady_packets += 1
+        start = time.process_time()
+        listener.handle_packet(data, peer.addr, t)
+        if int(t) != last_expire:
+            last_expire = int(t)
+            listener.expire(t)
+        cpu += time.process_time() - start
+
+    steady = duration - warmup
+    print(f"{name:<18} {max(per_second):>9} {steady_packets / steady:>10.1f} "
+          f"{total_bytes / duration / 1024:>9.1f} "
+          f"{cpu / duration * 100:>8.3f} {len(listener.get_online_users()):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузка широковещательного обнаружения")
+    parser.add_argument('--peers', type=int, default=500)
+    parser.add_argument('--duration', type=int, default=600)
+    parser.add_argument('--start-window', type=float, default=30,
+                        help="за сколько секунд запускаются все узлы")
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help="доля узлов в минуту, меняющих данные")
+    args = parser.parse_args()
+
+    warmup = min(args.duration / 2, 120)
+    print(f"{args.peers} peers, {args.duration}s, steady after {warmup:.0f}s")
+    print(f"{'protocol':<18} {'peak pk/s':>9} {'steady pk/s':>10} "
+          f"{'KB/s':>9} {'CPU %':>8} {'peers':>6}")
+
+    random.seed(1)
+    peers = [VirtualPeer(i) for i in range(args.peers)]
+    simulate('json 3s (old)', LegacyListener(),
+             legacy_packets(peers, args.duration, args.start_window),
+             args.duration, warmup)
+
+    random.seed(1)
+    peers = [VirtualPeer(i) for i in range(args.peers)]
+    node = BroadcastDiscovery()
+    node.username = 'observer'
+    simulate('binary adaptive', node,
+             adaptive_packets(peers, args.duration, args.start_window,
+                              args.churn),
+             args.duration, warmup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import platform
+import resource
+import tempfile
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.node import ChatNode
+from models.user import User
+from network.async_transport import EventLoopThread
+from utils.constans import FILE_CHUNK_SIZE, FILE_STREAMS
+
+# Сквозной замер на loopback тем же путем, что cli.py: узел bench и N
+# узлов ChatNode без GUI, каждый со своим сетевым циклом, как отдельные
+# процессы. Сообщения идут через Conversation.send_text, файлы - через
+# send_file/accept_file. Результат - плоский JSON {метрика: значение};
+# --baseline сравнивает с прошлым прогоном.
+
+# Насколько метрика может ухудшиться без сообщения о регрессии
+TOLERANCE = 0.10
+# Сколько ждать приема одного файла, с
+FILE_TIMEOUT = 300
+# Сколько ждать ответа на ping или подтверждения потока msg, с
+REPLY_TIMEOUT = 60
+# Сообщения с этим префиксом узел возвращает обратно, остальные считает
+PING = 'ping:'
+
+
+def make_node(name, **kwargs):
+    node = ChatNode(name, 0, '127.0.0.1', history=False, peers=False,
+                    **kwargs)
+    node.start()
+    return node
+
+
+class Endpoint:
+    # Узел-собеседник: отвечает эхом на ping, считает msg и принимает
+    # файлы во временный каталог
+    def __init__(self, name, tmp):
+        self.tmp = tmp
+        self.node = make_node(name, discovery=False)
+        self.node.on_conversation = self.on_conversation
+
+    def on_conversation(self, conversation):
+        received = [0]
+
+        def on_message(text):
+            if text.startswith(PING):
+                conversation.send_text(text)
+            else:
+                received[0] += 1
+
+        def on_packet(pkg):
+            if pkg.get('type') == 'end':
+                conversation.conn.send_json({'type': 'done',
+                                             'count': received[0]})
+                received[0] = 0
+
+        def on_file_request(request):
+            path = os.path.join(self.tmp, f"rx_{request['id']}.bin")
+            try:
+                conversation.accept_file(request, path)
+            except OSError as e:
+                print(f"Не удалось создать файл: {e}")
+
+        def on_transfer_done(direction, path):
+            # file_done - когда файл записан целиком
+            os.remove(path)
+            conversation.conn.send_json({'type': 'file_done'})
+
+        def on_transfer_error(direction, e):
+            conversation.conn.send_json({'type': 'file_error',
+                                         'error': str(e)})
+
+        conversation.on_message = on_message
+        conversation.on_packet = on_packet
+        conversation.on_file_request = on_file_request
+        conversation.on_transfer_done = on_transfer_done
+        conversation.on_transfer_error = on_transfer_error
+        conversation.start()
+
+    def close(self):
+        self.node.stop()
+
+
+class Client:
+    # Переписка узла bench с одним собеседником: ответы - в очередь
+    def __init__(self, conversation):
+        self.conversation = conversation
+        self.replies = queue.Queue()
+        conversation.on_message = self.replies.put
+        conversation.on_packet = self.replies.put
+        conversation.on_transfer_error = \
+            lambda direction, e: self.replies.put(e)
+        conversation.start()
+
+    def wait(self, timeout=REPLY_TIMEOUT):
+        try:
+            reply = self.replies.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет ответа") from None
+        if isinstance(reply, Exception):
+            raise reply
+        if isinstance(reply, dict) and reply.get('type') == 'file_error':
+            raise OSError(reply.get('error'))
+        return reply
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def run_parallel(function, items):
+    results = [None] * len(items)
+
+    def worker(index, item):
+        results[index] = function(item)
+
+    threads = [threading.Thread(target=worker, args=(i, item))
+               for i, item in enumerate(items)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def bench_latency(clients, pings, text):
+    # Все клиенты одновременно: ping -> эхо, время полного круга
+    def ping(client):
+        rtts = []
+        for _ in range(pings):
+            start = time.perf_counter()
+            client.conversation.send_text(PING + text)
+            client.wait()
+            rtts.append(time.perf_counter() - start)
+        return rtts
+
+    rtts = sorted(rtt for result in run_parallel(ping, clients)
+                  for rtt in result)
+    return {
+        'latency_p50_ms': percentile(rtts, 50) * 1000,
+        'latency_p90_ms': percentile(rtts, 90) * 1000,
+        'latency_p99_ms': percentile(rtts, 99) * 1000,
+        'latency_max_ms': rtts[-1] * 1000,
+    }
+
+
+def bench_throughput(clients, messages, text):
+    # Поток msg во все узлы сразу; узел подтверждает число принятых
+    def stream(client):
+        for _ in range(messages):
+            client.conversation.send_text(text)
+        # end идет в той же очереди соединения, что и сообщения
+        client.conversation.conn.send_json({'type': 'end'})
+        return client.wait()['count']
+
+    start = time.perf_counter()
+    received = sum(run_parallel(stream, clients))
+    elapsed = time.perf_counter() - start
+    return {'messages_per_s': received / elapsed,
+            'messages_lost': len(clients) * messages - received}
+
+
+def bench_file(client, src, chunk_size, streams):
+    size = os.path.getsize(src)
+    start = time.perf_counter()
+    client.conversation.send_file(src, chunk_size, streams)
+    reply = client.wait(FILE_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    if reply.get('type') != 'file_done':
+        raise RuntimeError(f"Неожиданный ответ: {reply}")
+    return size / (1024 * 1024) / elapsed
+
+
+def free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def bench_discovery(count, timeout, multicast_group=None):
+    # Время, за которое каждый из count узлов увидел всех остальных.
+    # Узлы в одном цикле: он нужен только их TCP-серверам
+    port = free_udp_port()
+    loop_thread = EventLoopThread()
+    nodes = [make_node(f"bench{i:03d}", loop_thread=loop_thread,
+                       broadcast_port=port, multicast_group=multicast_group,
+                       seeds=[])
+             for i in range(count)]
+    start = time.perf_counter()
+    converged = None
+    while time.perf_counter() - start < timeout:
+        if all(len(node.online_users()) >= count - 1 for node in nodes):
+            converged = time.perf_counter() - start
+            break
+        time.sleep(0.005)
+    for node in nodes:
+        node.stop()
+    loop_thread.stop()
+    return {'discovery_convergence_s': converged}
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def higher_is_better(name):
+    return name.endswith(('_per_s', '_mb_s'))
+
+
+def compare(results, baseline, tolerance):
+    # Возвращает список регрессий; отсутствующие метрики пропускаются
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not isinstance(value, (int, float)) or \
+                not isinstance(old, (int, float)) or not old:
+            continue
+        change = (value - old) / old
+        worse = -change if higher_is_better(name) else change
+        mark = ''
+        if worse > tolerance:
+            regressions.append(name)
+            mark = '  REGRESSION'
+        print(f"  {name:<28} {old:>12.3f} -> {value:>12.3f} "
+              f"({change * 100:+.1f}%){mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сквозной замер протокола на узлах в loopback")
+    parser.add_argument('--peers', type=int, default=8,
+                        help="узлов-собеседников")
+    parser.add_argument('--pings', type=int, default=2000,
+                        help="ping на узел для задержки")
+    parser.add_argument('--messages', type=int, default=20000,
+                        help="сообщений на узел для пропускной способности")
+    parser.add_argument('--text-size', type=int, default=64)
+    parser.add_argument('--file-mb', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--streams', type=int, default=FILE_STREAMS,
+                        help="дополнительных соединений на передачу файла")
+    parser.add_argument('--chunk-kb', type=int,
+                        default=FILE_CHUNK_SIZE // 1024)
+    parser.add_argument('--discovery-peers', type=int, default=20)
+    parser.add_argument('--discovery-timeout', type=float, default=30)
+    parser.add_argument('--multicast', metavar='GROUP',
+                        help="обнаружение через группу, а не broadcast")
+    parser.add_argument('--output', help="записать результат в JSON")
+    parser.add_argument('--baseline', help="JSON прошлого прогона")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = {}
+    text = 'x' * args.text_size
+    with tempfile.TemporaryDirectory() as tmp:
+        endpoints = [Endpoint(f"peer{i:03d}", tmp)
+                     for i in range(args.peers)]
+        bench = make_node('bench', discovery=False)
+        clients = [Client(bench.connect(User(
+            '127.0.0.1', e.node.port, e.node.username, 0)).result())
+            for e in endpoints]
+
+        results.update(bench_latency(clients, args.pings, text))
+        results.update(bench_throughput(clients, args.messages, text))
+
+        for size_mb in args.file_mb:
+            src = os.path.join(tmp, f'src_{size_mb}.bin')
+            with open(src, 'wb') as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+            results[f'file_{size_mb}mb_mb_s'] = bench_file(
+                clients[0], src, args.chunk_kb * 1024, args.streams)
+            os.remove(src)
+
+        bench.stop()
+        for endpoint in endpoints:
+            endpoint.close()
+
+    results.update(bench_discovery(args.discovery_peers,
+                                   args.discovery_timeout, args.multicast))
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    print()
+    for name, value in results.items():
+        print(f"  {name:<28} {value if value is None else round(value, 3)}")
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print(f"\nСравнение с {args.baseline}:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
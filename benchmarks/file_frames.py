@@ -0,0 +1,71 @@
+import os
+import sys
+import socket
+import threading
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import send_json, recv_json, send_file_chunk, \
+    encode_file_data, decode_file_data
+
+
+def send_legacy(sock, chunk):
+    send_json(sock, {'type': 'file_chunk', 'data': encode_file_data(chunk)})
+
+
+def send_binary(sock, chunk):
+    send_file_chunk(sock, chunk)
+
+
+def run(send_func, total_bytes, chunk_size):
+    tx, rx = socket.socketpair()
+    chunk = os.urandom(chunk_size)
+    count = total_bytes // chunk_size
+    received = [0]
+
+    def reader():
+        for _ in range(count):
+            pkg = recv_json(rx)
+            data = pkg['data']
+            if isinstance(data, str):
+                data = decode_file_data(data)
+            received[0] += len(data)
+
+    t = threading.Thread(target=reader)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    t.start()
+    for _ in range(count):
+        send_func(tx, chunk)
+    t.join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    tx.close()
+    rx.close()
+
+    mb = received[0] / (1024 * 1024)
+    return mb / wall, cpu / mb
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="base64+JSON против бинарных кадров file_chunk")
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--chunk-kb', type=int, nargs='+',
+                        default=[12, 64, 256])
+    args = parser.parse_args()
+
+    total = args.size_mb * 1024 * 1024
+    print(f"{'path':<8} {'chunk':>8} {'MB/s':>10} {'CPU s/MB':>10}")
+    for chunk_kb in args.chunk_kb:
+        for name, func in (('legacy', send_legacy), ('binary', send_binary)):
+            mbps, cpu_per_mb = run(func, total, chunk_kb * 1024)
+            print(f"{name:<8} {chunk_kb:>6}KB {mbps:>10.1f} "
+                  f"{cpu_per_mb:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
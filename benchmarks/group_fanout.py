@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.node import ChatNode
+from models.user import User
+from network.async_transport import EventLoopThread
+
+# Групповой чат на loopback: один отправитель и members узлов в одном
+# процессе. Сравнивается рассылка группой (сериализация и шифрование один
+# раз) с отправкой каждому участнику в его переписку, а затем та же
+# рассылка с участниками, которые не читают сокет.
+
+# Сколько ждать доставки всех сообщений, с
+DELIVERY_TIMEOUT = 300
+# Сколько сообщений группы может ждать отправки: дальше send ждет самое
+# старое, как ждал бы отправитель с очередью в интерфейсе
+SEND_WINDOW = 256
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+        self.expected = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def expect(self, expected):
+        with self._lock:
+            self.count = 0
+            self.expected = expected
+            self.done.clear()
+
+    def add(self, *_):
+        with self._lock:
+            self.count += 1
+            if self.count == self.expected:
+                self.done.set()
+
+
+def make_node(name, loop_thread):
+    node = ChatNode(name, 0, '127.0.0.1', discovery=False,
+                    loop_thread=loop_thread, history=False, peers=False)
+    node.start()
+    return node
+
+
+def slow_member(name):
+    # Принимает соединение, но ничего не читает: маленький буфер приема
+    # быстро заполняется, дальше упирается очередь участника
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    accepted = []
+
+    def accept():
+        sock, _ = listener.accept()
+        accepted.append(sock)
+
+    threading.Thread(target=accept, daemon=True).start()
+    return User('127.0.0.1', listener.getsockname()[1], name, 0), \
+        (listener, accepted)
+
+
+def group_sender(group):
+    pending = collections.deque()
+
+    def send(text):
+        pending.append(group.send_text(text))
+        if len(pending) > SEND_WINDOW:
+            pending.popleft().result()
+    return send
+
+
+def send_all(send, count, text):
+    calls = []
+    start = time.perf_counter()
+    for _ in range(count):
+        call = time.perf_counter()
+        send(text)
+        calls.append(time.perf_counter() - call)
+    return start, sorted(calls)
+
+
+def report(label, members, count, start, calls, counter):
+    delivered = counter.done.wait(DELIVERY_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {count / elapsed:>9.0f} "
+          f"{counter.count / elapsed:>13.0f} "
+          f"{calls[len(calls) // 2] * 1e6:>9.1f} "
+          f"{calls[len(calls) * 99 // 100] * 1e6:>9.1f}"
+          f"{'' if delivered else '  НЕ ДОСТАВЛЕНО: ' + str(counter.count)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Рассылка в группу: шифрование один раз против N раз")
+    parser.add_argument('--members', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--text-size', type=int, default=64)
+    parser.add_argument('--slow', type=int, default=1,
+                        help="участников, которые не читают сокет")
+    parser.add_argument('--slow-text-size', type=int, default=4096)
+    parser.add_argument('--slow-messages', type=int, default=3000,
+                        help="больше, чем поместится в буфер записи и "
+                             "очередь медленного участника")
+    args = parser.parse_args()
+
+    # Отправитель - в своем цикле, как отдельный процесс
+    sender_loop = EventLoopThread()
+    members_loop = EventLoopThread()
+    sender = make_node('sender', sender_loop)
+    nodes = [make_node(f"m{i:03d}", members_loop)
+             for i in range(args.members)]
+    users = [User('127.0.0.1', node.port, node.username, 0)
+             for node in nodes]
+    counter = Counter()
+
+    def on_group(group):
+        group.on_message = counter.add
+        group.start()
+
+    def on_conversation(conversation):
+        conversation.on_message = counter.add
+        conversation.start()
+
+    for node in nodes:
+        node.on_group = on_group
+        node.on_conversation = on_conversation
+
+    text = 'x' * args.text_size
+    group = sender.create_group('bench', users)
+    # Как открытое окно группы: соединения участников не простаивают
+    group.start()
+    # Приглашения и подключения - до замера
+    counter.expect(args.members)
+    group.send_text(text).result()
+    counter.done.wait(DELIVERY_TIMEOUT)
+
+    print(f"{args.members} участников, {args.messages} сообщений по "
+          f"{args.text_size} байт")
+    print(f"{'':<22} {'msg/s':>9} {'deliveries/s':>13} {'send p50':>9} "
+          f"{'send p99':>9}  (send - мкс у вызывающего)")
+
+    counter.expect(args.members * args.messages)
+    start, calls = send_all(group_sender(group), args.messages, text)
+    report('группа', args.members, args.messages, start, calls, counter)
+
+    conversations = [sender.connect(user).result() for user in users]
+
+    def send_each(text):
+        for conversation in conversations:
+            conversation.send_text(text)
+
+    counter.expect(args.members * args.messages)
+    start, calls = send_all(send_each, args.messages, text)
+    report('каждому отдельно', args.members, args.messages, start, calls,
+           counter)
+
+    if args.slow:
+        # Те же сообщения без медленных участников - для сравнения
+        text = 'x' * args.slow_text_size
+        counter.expect(args.members * args.slow_messages)
+        start, calls = send_all(group_sender(group), args.slow_messages,
+                                text)
+        report(f"группа, {args.slow_text_size} байт", args.members,
+               args.slow_messages, start, calls, counter)
+
+        slow = [slow_member(f"slow{i}") for i in range(args.slow)]
+        group.add([user for user, _ in slow])
+        counter.expect(args.members * args.slow_messages)
+        start, calls = send_all(group_sender(group), args.slow_messages,
+                                text)
+        report(f"группа +{args.slow} медленных", args.members,
+               args.slow_messages, start, calls, counter)
+        dropped = sum(group.members[user.username].dropped
+                      for user, _ in slow)
+        print(f"{args.slow_messages} сообщений по {args.slow_text_size} "
+              f"байт: для медленных отброшено {dropped}, у остальных "
+              f"потерь {args.members * args.slow_messages - counter.count}")
+        for _, (listener, accepted) in slow:
+            listener.close()
+            for sock in accepted:
+                sock.close()
+
+    sender.stop()
+    for node in nodes:
+        node.stop()
+    sender_loop.stop()
+    members_loop.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.history import HistoryStore, SCHEMA, INSERT_MESSAGE
+
+WORDS = ("привет как дела файл отправил получил сеть пакет окно чат "
+         "сервер клиент ключ шифр поток очередь").split()
+
+
+def make_text(rand):
+    return " ".join(rand.choice(WORDS) for _ in range(rand.randint(3, 12)))
+
+
+def naive(path, count):
+    # Как в database.py: соединение и коммит на каждую вставку
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.close()
+    rand = random.Random(1)
+    start = time.perf_counter()
+    for i in range(count):
+        connection = sqlite3.connect(path)
+        connection.execute(INSERT_MESSAGE, (None, 'peer0', time.time(), 'in',
+                                            'peer0', make_text(rand)))
+        connection.commit()
+        connection.close()
+    return count / (time.perf_counter() - start)
+
+
+def store_inserts(store, count, producers, peers):
+    # Несколько потоков (как сетевой цикл и потоки передачи) пишут разом
+    def produce(index):
+        rand = random.Random(index)
+        for i in range(count // producers):
+            peer = f"peer{rand.randrange(peers)}"
+            call = time.perf_counter()
+            store.add_message(peer, 'in', peer, make_text(rand))
+            calls.append(time.perf_counter() - call)
+
+    calls = []
+    threads = [threading.Thread(target=produce, args=(i,))
+               for i in range(producers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.flush()
+    elapsed = time.perf_counter() - start
+    calls.sort()
+    return count / elapsed, calls[len(calls) // 2], calls[-1]
+
+
+def timed(function, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Запись и чтение истории сообщений")
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--peers', type=int, default=100)
+    parser.add_argument('--naive', type=int, default=2000,
+                        help="вставок для варианта с коммитом на каждую")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rate = naive(os.path.join(tmp, 'naive.db'), args.naive)
+        print(f"connect+commit per insert: {rate:>10.0f} msg/s")
+
+        store = HistoryStore(os.path.join(tmp, 'history.db')).open()
+        rate, p50, worst = store_inserts(store, args.messages,
+                                         args.producers, args.peers)
+        print(f"HistoryStore ({args.producers} threads): {rate:>10.0f} msg/s, "
+              f"add_message p50 {p50 * 1e6:.1f} us, max {worst * 1e3:.2f} ms")
+
+        seconds, rows = timed(lambda: store.recent('peer7', 100))
+        print(f"recent(100):          {seconds * 1000:>8.3f} ms")
+        oldest = rows[0]
+        seconds, _ = timed(lambda: store.page('peer7', oldest['ts'],
+                                              oldest['id'], 100))
+        print(f"page(100):            {seconds * 1000:>8.3f} ms")
+        seconds, rows = timed(lambda: store.search('файл AND ключ'))
+        print(f"search (FTS5={store.has_fts}):  {seconds * 1000:>8.3f} ms, "
+              f"{len(rows)} rows")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
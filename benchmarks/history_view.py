@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+import resource
+import tkinter as tk
+from tkinter import scrolledtext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gui.history_view import HistoryView
+
+# Нужен дисплей (на сервере - xvfb-run python benchmarks/history_view.py)
+
+
+def make_text(root):
+    window = tk.Toplevel(root)
+    window.geometry("500x450")
+    text = scrolledtext.ScrolledText(window, state='disabled', wrap=tk.WORD,
+                                     font=("Arial", 10))
+    text.pack(fill=tk.BOTH, expand=True)
+    text.tag_config('them', foreground='green')
+    return window, text
+
+
+def legacy(text):
+    # Как было: вставка, see(END) и переключение state на каждое сообщение
+    def add(line):
+        text.configure(state='normal')
+        text.insert(tk.END, line + "\n", 'them')
+        text.see(tk.END)
+        text.configure(state='disabled')
+    return add
+
+
+def virtualized(text):
+    view = HistoryView(text)
+    return lambda line: view.append(line, 'them')
+
+
+def run(root, name, factory, messages, per_frame):
+    window, text = make_text(root)
+    add = factory(text)
+    root.update()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    frames = []
+    sent = 0
+    start = time.perf_counter()
+    while sent < messages:
+        frame_start = time.perf_counter()
+        for _ in range(min(per_frame, messages - sent)):
+            add(f"[12:00] peer: message number {sent} " + "x" * 40)
+            sent += 1
+        root.update()
+        frames.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+
+    lines = int(text.index('end-1c').split('.')[0])
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+    window.destroy()
+    frames.sort()
+    print(f"{name:<12} {messages:>8} "
+          f"{frames[len(frames) // 2] * 1000:>8.2f} "
+          f"{frames[min(len(frames) - 1, len(frames) * 99 // 100)] * 1000:>8.2f} "
+          f"{frames[-1] * 1000:>8.2f} {messages / elapsed:>9.0f} "
+          f"{lines:>8} {grown:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Время UI-потока на кадр при большой истории чата")
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--per-frame', type=int, default=100,
+                        help="сколько сообщений приходит за один кадр")
+    parser.add_argument('--legacy-messages', type=int, default=100000,
+                        help="старый вариант замедляется с ростом истории")
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    root.withdraw()
+    print(f"{'view':<12} {'messages':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'msg/s':>9} {'lines':>8} {'+RSS MB':>8}")
+    run(root, 'legacy', legacy, args.legacy_messages, args.per_frame)
+    run(root, 'virtualized', virtualized, args.messages, args.per_frame)
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
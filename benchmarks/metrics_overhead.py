@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import encode_json, decode_frame
+from network.session import AeadSession, new_nonce
+from utils import metrics
+
+
+def roundtrip(count, text):
+    # encode_json + decode_frame одного сообщения в сессии, с/сообщение
+    client_nonce, server_nonce = new_nonce(), new_nonce()
+    tx = AeadSession('aes-256-gcm', client_nonce, server_nonce, True)
+    rx = AeadSession('aes-256-gcm', client_nonce, server_nonce, False)
+    packet = {'type': 'msg', 'text': text}
+    start = time.perf_counter()
+    for _ in range(count):
+        frame = encode_json(packet, tx)
+        decode_frame(frame[4:], rx)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Цена метрик на кодировании и разборе кадра")
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--text-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    text = 'x' * args.text_size
+    for name, on in (("disabled", False), ("enabled", True),
+                     ("disabled", False), ("enabled", True)):
+        metrics.enable(on)
+        best = min(roundtrip(args.messages, text) for _ in range(args.repeat))
+        print(f"metrics {name:<9} {best * 1e6:>7.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
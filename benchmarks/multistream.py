@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.tcp_srv import TCPServer
+from network.tcp_client import TCPClient
+from network.connection import Connection
+from network.file_transfer import TransferManager, clamp_chunk_size
+from utils.constans import FILE_CHUNK_SIZE
+
+
+def rx_loop(conn, transfers, on_other):
+    while True:
+        data = conn.recv_json()
+        if data is None:
+            break
+        if not transfers.handle_packet(data):
+            on_other(data)
+
+
+def run(src, dst, streams, chunk_size):
+    server = TCPServer(host='127.0.0.1', port=0)
+    port = server.sock.getsockname()[1]
+    receiver = {}
+    ready = threading.Event()
+
+    def accept_loop():
+        while True:
+            try:
+                sock, _ = server.sock.accept()
+            except OSError:
+                break
+            conn = Connection(sock)
+            hello = conn.recv_json()
+            conn.accept_handshake(hello)
+            if 'stream' in hello:
+                receiver['tm'].attach_stream(conn, hello['stream'])
+                continue
+            receiver['tm'] = TransferManager(conn)
+            threading.Thread(target=rx_loop, args=(
+                conn, receiver['tm'], lambda d: None), daemon=True).start()
+            ready.set()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+    client = TCPClient('127.0.0.1', port)
+    client.handshake('bench')
+    sender = TransferManager(client.conn, ('127.0.0.1', port), 'bench')
+    done = threading.Event()
+
+    def on_other(data):
+        if data.get('type') == 'file_resp':
+            sender.send_file(1, src, chunk_size, data.get('manifest'),
+                             data.get('streams', 0), data.get('token'),
+                             on_error=print)
+
+    threading.Thread(target=rx_loop, args=(client.conn, sender, on_other),
+                     daemon=True).start()
+    ready.wait()
+
+    size = os.path.getsize(src)
+    start = time.perf_counter()
+    receiver['tm'].receive_file(1, dst, size, chunk_size, None, streams,
+                                on_done=lambda _: done.set(),
+                                on_error=print)
+    done.wait()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    server.close()
+    return size / (1024 * 1024) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Скорость передачи файла по loopback от числа потоков")
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--chunk-kb', type=int, default=FILE_CHUNK_SIZE // 1024)
+    parser.add_argument('--streams', type=int, nargs='+', default=[0, 1, 2, 4])
+    args = parser.parse_args()
+
+    chunk_size = clamp_chunk_size(args.chunk_kb * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'src.bin')
+        with open(src, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        print(f"{'streams':>8} {'MB/s':>10}")
+        for streams in args.streams:
+            dst = os.path.join(tmp, f'dst_{streams}.bin')
+            mbps = run(src, dst, streams, chunk_size)
+            print(f"{streams:>8} {mbps:>10.1f}")
+            os.remove(dst)
+
+
+if __name__ == "__main__":
+    main()
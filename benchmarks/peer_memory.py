@@ -0,0 +1,98 @@
+import os
+import sys
+import gc
+import time
+import heapq
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.presence import PresenceRegistry, user_key
+
+
+def announcements(count):
+    # Как из сети: каждая строка - новый объект, декодированный из пакета
+    for i in range(count):
+        yield (f"user{i:06d}".encode().decode(),
+               f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}".encode().decode(),
+               40000 + i % 20000, (i, 1))
+
+
+def legacy(count, now):
+    # Прежние записи PresenceRegistry: dict на собеседника, ключ "имя_ip",
+    # индексы по имени (dict в dict) и по (ip, порт)
+    by_key, by_name, by_addr, heap = {}, {}, {}, []
+    for username, ip, tcp_port, version in announcements(count):
+        key = f"{username}_{ip}"
+        entry = {'key': key, 'username': username, 'ip': ip,
+                 'tcp_port': tcp_port, 'version': version, 'last_seen': now,
+                 'timeout': 30.0, 'expires': now + 30.0, 'addr': (ip, 50000),
+                 'gossip': False}
+        by_key[key] = entry
+        by_name.setdefault(username, {})[key] = entry
+        by_addr[(ip, tcp_port)] = entry
+        heapq.heappush(heap, (entry['expires'], key))
+    return by_key, by_name, by_addr, heap
+
+
+def legacy_shared(count, now):
+    # Плюс то, что держали подписчики: users() и события давали копию
+    # dict на каждого (список в GUI, очередь сохранения в базу)
+    tables = legacy(count, now)
+    gui = {key: {'username': e['username'], 'ip': e['ip'],
+                 'tcp_port': e['tcp_port'], 'last_seen': e['last_seen']}
+           for key, e in tables[0].items()}
+    return tables, gui
+
+
+def compact(count, now):
+    presence = PresenceRegistry()
+    for username, ip, tcp_port, version in announcements(count):
+        peer = presence.update(user_key(username, ip), tcp_port, now, 30.0,
+                               version)
+        peer.source = (ip, 50000)
+    return presence
+
+
+def compact_shared(count, now):
+    # Подписчики держат те же записи Peer
+    presence = compact(count, now)
+    return presence, {peer.key: peer for peer in presence.users()}
+
+
+def measure(build, count):
+    # Время - отдельным прогоном: tracemalloc сильно замедляет выделения
+    gc.collect()
+    start = time.perf_counter()
+    kept = build(count, time.time())
+    elapsed = time.perf_counter() - start
+    del kept
+    gc.collect()
+    tracemalloc.start()
+    kept = build(count, time.time())
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Память на одного собеседника в таблице присутствия")
+    parser.add_argument('--peers', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{args.peers} peers:")
+    for name, build in (("dict entries", legacy),
+                        ("Peer (__slots__)", compact),
+                        ("dict + GUI copies", legacy_shared),
+                        ("Peer + GUI (shared)", compact_shared)):
+        per_peer, elapsed = measure(build, args.peers)
+        print(f"  {name:<20} {per_peer:>6.0f} bytes/peer, "
+              f"build {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
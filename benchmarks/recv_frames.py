@@ -0,0 +1,80 @@
+import os
+import sys
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import FrameReader
+
+SIZES = [('1KB', 1024), ('64KB', 64 * 1024), ('16MB', 16 * 1024 * 1024)]
+
+
+def legacy_read_frame(sock):
+    # Старый путь: _recv_all с data += packet
+    def recv_all(n):
+        data = b''
+        while len(data) < n:
+            packet = sock.recv(n - len(data))
+            if not packet:
+                return None
+            data += packet
+        return data
+
+    length = struct.unpack('>I', recv_all(4))[0]
+    return recv_all(length)
+
+
+def run(reader_factory, frame_size, count):
+    tx, rx = socket.socketpair()
+    frame = struct.pack('>I', frame_size) + os.urandom(frame_size)
+
+    def writer():
+        for _ in range(count):
+            tx.sendall(frame)
+
+    read_frame = reader_factory(rx)
+    t = threading.Thread(target=writer)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    t.start()
+    for _ in range(count):
+        read_frame()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t.join()
+    tx.close()
+    rx.close()
+    return elapsed / count, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Время и память на кадр: _recv_all против FrameReader")
+    parser.add_argument('--total-mb', type=int, default=64)
+    args = parser.parse_args()
+
+    readers = [
+        ('legacy', lambda sock: lambda: legacy_read_frame(sock)),
+        ('reader', lambda sock: FrameReader(sock).read_frame),
+    ]
+
+    print(f"{'path':<8} {'frame':>6} {'us/frame':>12} {'peak alloc':>12}")
+    for label, size in SIZES:
+        count = max(4, args.total_mb * 1024 * 1024 // size)
+        count = min(count, 20000)
+        for name, factory in readers:
+            per_frame, peak = run(factory, size, count)
+            print(f"{name:<8} {label:>6} {per_frame * 1e6:>12.1f} "
+                  f"{peak / 1024:>10.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import FrameReader, decode_frame
+from network.session import AeadSession, new_nonce
+from network.connection import Connection
+from network.async_transport import EventLoopThread, AsyncConnection
+
+BURSTS = [1, 10, 100, 1000]
+# Пауза между сериями: "печать" или вывод бота порциями
+BURST_PAUSE = 0.005
+
+
+def make_sessions():
+    client_nonce, server_nonce = new_nonce(), new_nonce()
+    return (AeadSession('aes-256-gcm', client_nonce, server_nonce, True),
+            AeadSession('aes-256-gcm', client_nonce, server_nonce, False))
+
+
+def tcp_pair():
+    # Настоящий TCP через loopback: на socketpair нет Нейгла и TCP_CORK
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    tx = socket.create_connection(listener.getsockname())
+    rx, _ = listener.accept()
+    listener.close()
+    return tx, rx
+
+
+def receiver(sock, session, count, latencies, done):
+    reader = FrameReader(sock)
+    for _ in range(count):
+        frame = reader.read_frame()
+        if frame is None:
+            break
+        pkg = decode_frame(frame, session)
+        latencies.append(time.perf_counter() - pkg['t'])
+    done.set()
+
+
+def sync_sender(loop_thread, sock, session):
+    # Как было до очереди записи: один sendall на сообщение
+    conn = Connection(sock)
+    conn.session = session
+    return conn
+
+
+def async_sender(delay):
+    def factory(loop_thread, sock, session):
+        async def wrap():
+            reader, writer = await asyncio.open_connection(sock=sock)
+            return AsyncConnection(reader, writer, loop_thread, delay)
+        conn = loop_thread.call(wrap())
+        conn.session = session
+        return conn
+    return factory
+
+
+MODES = [
+    ('sendall', sync_sender),
+    ('async', async_sender(None)),
+    ('coalesce 1ms', async_sender(0.001)),
+    ('coalesce 5ms', async_sender(0.005)),
+]
+
+
+def run(loop_thread, factory, burst, count, text):
+    tx_sock, rx_sock = tcp_pair()
+    tx, rx = make_sessions()
+    conn = factory(loop_thread, tx_sock, tx)
+
+    latencies = []
+    done = threading.Event()
+    threading.Thread(target=receiver,
+                     args=(rx_sock, rx, count, latencies, done),
+                     daemon=True).start()
+
+    start = time.perf_counter()
+    sent = 0
+    while sent < count:
+        for _ in range(min(burst, count - sent)):
+            conn.send_json({'type': 'msg', 'text': text,
+                            't': time.perf_counter()})
+            sent += 1
+        if sent < count:
+            time.sleep(BURST_PAUSE)
+    done.wait(60)
+    elapsed = time.perf_counter() - start
+    pauses = (count - 1) // burst * BURST_PAUSE
+
+    conn.close()
+    rx_sock.close()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+    return p50, p99, count / max(elapsed - pauses, 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Задержка и пропускная способность мелких сообщений")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--text-size', type=int, default=64)
+    args = parser.parse_args()
+
+    loop_thread = EventLoopThread()
+    text = 'x' * args.text_size
+
+    print(f"{'mode':<14} {'burst':>6} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'msg/s':>10}")
+    for burst in BURSTS:
+        count = max(burst, min(args.messages, burst * 200))
+        for name, factory in MODES:
+            p50, p99, rate = run(loop_thread, factory, burst, count, text)
+            print(f"{name:<14} {burst:>6} {p50 * 1000:>8.3f} "
+                  f"{p99 * 1000:>8.3f} {rate:>10.0f}")
+    loop_thread.stop()
+
+
+if __name__ == "__main__":
+    main()
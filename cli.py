@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import argparse
+
+from core.node import ChatNode
+from models.user import User
+from utils import metrics
+from utils.constans import TCP_PORT, MULTICAST_GROUP, MULTICAST_TTL, \
+    METRICS_DUMP_INTERVAL
+
+HELP = """Команды:
+  /peers            - пользователи в сети
+  /connect NAME     - открыть чат с пользователем из /peers
+  /connect HOST:PORT
+  /file PATH        - отправить файл в текущий чат
+  /group NAME USER...  - создать группу из пользователей /peers
+  /group NAME       - писать в существующую группу
+  /groups           - ваши группы
+  /quit             - выход
+Любая другая строка отправляется в текущий чат."""
+
+
+class ConsoleClient:
+    # Чат без GUI: читает команды из stdin и печатает события в stdout.
+    # С --echo работает как бот, который повторяет сообщения обратно.
+    def __init__(self, node, accept_dir=None, echo=False):
+        self.node = node
+        self.accept_dir = accept_dir
+        self.echo = echo
+        self.current = None
+        node.on_conversation = self.on_conversation
+        node.on_group = self.on_group
+
+    def on_conversation(self, conversation):
+        print(f"* Входящий чат: {conversation.user.username}")
+        self.bind(conversation)
+        conversation.start()
+
+    def on_group(self, group):
+        print(f"* Группа {group.name}: {', '.join(group.usernames())}")
+        self.bind_group(group)
+        group.start()
+
+    def bind_group(self, group):
+        group.on_message = lambda sender, text: print(
+            f"[{group.name}] {sender}: {text}")
+        group.on_members = lambda: print(
+            f"* Группа {group.name}: {', '.join(group.usernames())}")
+
+    def group(self, name, usernames):
+        if not usernames:
+            for group in self.node.groups.groups():
+                if group.name == name:
+                    self.current = group
+                    return
+            print(f"* Группа {name} не найдена")
+            return
+        users = []
+        for username in usernames:
+            user = self.node.find_user(username)
+            if not user:
+                print(f"* Пользователь {username} не найден")
+                return
+            users.append(user)
+        group = self.node.create_group(name, users)
+        self.bind_group(group)
+        group.start()
+        self.current = group
+        print(f"* Группа {name} создана")
+
+    def bind(self, conversation):
+        name = conversation.user.username
+
+        def on_message(text):
+            print(f"{name}: {text}")
+            if self.echo:
+                conversation.send_text(text)
+
+        def on_file_request(request):
+            if not self.accept_dir:
+                print(f"* {name} предлагает файл {request['name']}, "
+                      f"отклонено (нет --accept-dir)")
+                conversation.decline_file(request)
+                return
+            resume_state = conversation.find_resumable(request)
+            path = resume_state['path'] if resume_state else os.path.join(
+                self.accept_dir, os.path.basename(request['name']))
+            print(f"* Прием {request['name']} ({request['size']} байт) "
+                  f"в {path}")
+            try:
+                conversation.accept_file(request, path, resume_state)
+            except OSError as e:
+                print(f"* Не удалось создать файл: {e}")
+
+        conversation.on_message = on_message
+        conversation.on_file_request = on_file_request
+        conversation.on_file_response = lambda transfer_id, ok, offset: print(
+            f"* {name} {'принял' if ok else 'отклонил'} файл")
+        conversation.on_transfer_done = lambda direction, path: print(
+            f"* Передача завершена ({direction}): {path}")
+        conversation.on_transfer_error = lambda direction, e: print(
+            f"* Ошибка передачи ({direction}): {e}")
+        conversation.on_disconnect = lambda: print(f"* {name} отключился")
+        self.current = conversation
+
+    def connect(self, target):
+        if ':' in target:
+            host, port = target.rsplit(':', 1)
+            user = User(host, int(port), target, 0)
+        else:
+            user = self.node.find_user(target)
+            if not user:
+                print(f"* Пользователь {target} не найден")
+                return
+        try:
+            conversation = self.node.connect(user).result()
+        except Exception as e:
+            print(f"* Ошибка подключения: {e}")
+            return
+        self.bind(conversation)
+        conversation.start()
+        print(f"* Подключено к {user.username}")
+
+    def handle_line(self, line):
+        if line.startswith('/'):
+            command, _, arg = line.partition(' ')
+            arg = arg.strip()
+            if command == '/quit':
+                return False
+            if command == '/peers':
+                for u in self.node.online_users():
+                    print(f"  {u.username} [{u.ip}:{u.tcp_port}]")
+            elif command == '/connect' and arg:
+                self.connect(arg)
+            elif command == '/file' and arg:
+                if self._check_chat():
+                    if not hasattr(self.current, 'send_file'):
+                        print("* Файлы в группу не отправляются")
+                    else:
+                        try:
+                            self.current.send_file(arg)
+                        except OSError as e:
+                            print(f"* Ошибка отправки файла: {e}")
+            elif command == '/group' and arg:
+                name, *usernames = arg.split()
+                self.group(name, usernames)
+            elif command == '/groups':
+                for group in self.node.groups.groups():
+                    print(f"  {group.name}: {', '.join(group.usernames())}")
+            else:
+                print(HELP)
+            return True
+
+        if self._check_chat():
+            try:
+                result = self.current.send_text(line)
+            except OSError as e:
+                print(f"* Ошибка отправки: {e}")
+                return True
+            if result is not None:
+                # Группа отправляет в сетевом цикле и возвращает Future
+                result.add_done_callback(_report_send)
+        return True
+
+    def _check_chat(self):
+        if not self.current or not self.current.is_alive:
+            print("* Нет открытого чата, используйте /connect")
+            return False
+        return True
+
+    def run(self, interactive=True):
+        if not interactive:
+            # Режим службы: только отвечаем на входящие
+            while True:
+                time.sleep(1)
+        print(HELP)
+        for line in sys.stdin:
+            line = line.strip()
+            if line and not self.handle_line(line):
+                break
+
+
+def _report_send(future):
+    error = None if future.cancelled() else future.exception()
+    if error:
+        print(f"* Ошибка отправки: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure LAN Chat без GUI")
+    parser.add_argument('--name', required=True)
+    parser.add_argument('--port', type=int, default=TCP_PORT)
+    parser.add_argument('--host', default="")
+    parser.add_argument('--no-discovery', action='store_true',
+                        help="не участвовать в широковещательном поиске")
+    parser.add_argument('--multicast', nargs='?', const=MULTICAST_GROUP,
+                        help="объявления в multicast-группу (по умолчанию "
+                             f"{MULTICAST_GROUP})")
+    parser.add_argument('--ttl', type=int, default=MULTICAST_TTL,
+                        help="TTL multicast: больше 1 - через маршрутизаторы")
+    parser.add_argument('--seed', action='append',
+                        help="опорный узел HOST[:PORT] (можно несколько)")
+    parser.add_argument('--no-history', action='store_true',
+                        help="не сохранять историю сообщений")
+    parser.add_argument('--no-peer-cache', action='store_true',
+                        help="не запоминать собеседников между запусками")
+    parser.add_argument('--connect', help="NAME или HOST:PORT")
+    parser.add_argument('--accept-dir',
+                        help="принимать входящие файлы в этот каталог")
+    parser.add_argument('--echo', action='store_true',
+                        help="бот: отвечать на сообщения тем же текстом")
+    parser.add_argument('--daemon', action='store_true',
+                        help="не читать stdin")
+    parser.add_argument('--metrics-port', type=int,
+                        help="метрики Prometheus на http://127.0.0.1:PORT/"
+                             "metrics")
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help="снимок метрик в JSON раз в "
+                             f"{METRICS_DUMP_INTERVAL} с")
+    parser.add_argument('--profile', action='store_true',
+                        help="выборочный профилировщик (топ функций в "
+                             "JSON-снимке метрик)")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    if args.metrics_json:
+        metrics.start_json_dump(args.metrics_json, METRICS_DUMP_INTERVAL)
+    if args.profile:
+        metrics.start_sampler()
+
+    node = ChatNode(args.name, args.port, args.host,
+                    discovery=not args.no_discovery,
+                    multicast_group=args.multicast, multicast_ttl=args.ttl,
+                    seeds=args.seed, history=not args.no_history,
+                    peers=not args.no_peer_cache)
+    client = ConsoleClient(node, args.accept_dir, args.echo)
+    node.start()
+    try:
+        if args.connect:
+            client.connect(args.connect)
+        client.run(interactive=not args.daemon)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import os
+import time
+import threading
+
+from network.file_transfer import TransferManager, transfer_id_for, \
+    clamp_chunk_size
+from utils.constans import FILE_CHUNK_SIZE, FILE_STREAMS
+
+
+class Conversation:
+    # Переписка с одним собеседником поверх одного соединения.
+    # Все on_* вызываются из сетевого цикла или потоков передачи, поэтому
+    # GUI должен перекладывать их в свой поток. До start() (и после
+    # release()) пакеты копятся и отдаются обработчикам при start().
+    def __init__(self, node, user, conn, outgoing=False):
+        self.node = node
+        self.user = user
+        self.conn = conn
+        self.outgoing = outgoing
+        # Адрес TCP-сервера собеседника нужен для дополнительных соединений
+        self.transfers = TransferManager(conn, self.key,
+                                         node.username,
+                                         node.loop_thread.connect)
+        self.pending_files = {}
+        self.is_alive = True
+
+        self._lock = threading.Lock()
+        self._started = False
+        self._waking = False
+        self._backlog = []
+        # Время первого пакета в _backlog: история до него уже не покажется
+        # повторно при start()
+        self.backlog_since = None
+
+        self.on_message = None  # (text)
+        self.on_file_request = None  # (request) -> accept_file/decline_file
+        self.on_file_response = None  # (transfer_id, accepted, offset)
+        self.on_transfer_progress = None  # (direction, done, total)
+        self.on_transfer_done = None  # (direction, path)
+        self.on_transfer_error = None  # (direction, error)
+        self.on_packet = None  # (pkg) - пакеты неизвестных типов
+        self.on_disconnect = None  # ()
+
+    @property
+    def key(self):
+        # Ключ в пуле соединений; None, если порт собеседника неизвестен
+        if self.user.port:
+            return self.user.addr, self.user.port
+        return None
+
+    def _emit(self, name, *args):
+        callback = getattr(self, name)
+        if callback:
+            callback(*args)
+
+    def open(self):
+        # Вызывает ChatNode сразу после рукопожатия
+        self.conn.start_reading(self._handle_packet, self._handle_close)
+
+    def start(self):
+        # Обработчики назначены: отдаем накопленные пакеты
+        with self._lock:
+            self._started = True
+            self._waking = False
+            backlog, self._backlog = self._backlog, []
+            self.backlog_since = None
+            for pkg in backlog:
+                self._dispatch(pkg)
+        self.node.pool.acquire(self)
+
+    def release(self):
+        # Окно чата закрыто, но соединение остается в пуле
+        with self._lock:
+            self._started = False
+            self._waking = False
+            for name in ('on_message', 'on_file_request', 'on_file_response',
+                         'on_transfer_progress', 'on_transfer_done',
+                         'on_transfer_error', 'on_packet', 'on_disconnect'):
+                setattr(self, name, None)
+        self.node.pool.release(self)
+
+    def wake(self):
+        # Просим владельца узла открыть чат (один раз до start())
+        with self._lock:
+            if self._started or self._waking:
+                return
+            self._waking = True
+        # Пока владелец открывает чат, sweep() не должен его закрыть
+        self.node.pool.acquire(self)
+        self.node.announce(self)
+
+    def send_text(self, text):
+        self.conn.send_json({'type': 'msg', 'text': text})
+        self._record('add_message', 'out', self.node.username, text)
+
+    def _record(self, method, *args, **kwargs):
+        # Запись в историю только ставится в очередь потока записи
+        if self.node.history:
+            getattr(self.node.history, method)(self.user.username, *args,
+                                               **kwargs)
+
+    def send_file(self, path, chunk_size=FILE_CHUNK_SIZE,
+                  streams=FILE_STREAMS):
+        # Запрос на передачу; отправка начнется после file_resp
+        size = os.path.getsize(path)
+        transfer_id = transfer_id_for(path)
+        chunk_size = clamp_chunk_size(chunk_size)
+        self.conn.send_json({
+            'type': 'file_req',
+            'id': transfer_id,
+            'name': os.path.basename(path),
+            'size': size,
+            'chunk_size': chunk_size,
+            'streams': streams if self.transfers.peer_addr else 0
+        })
+        self.pending_files[transfer_id] = path, chunk_size
+        return transfer_id
+
+    def find_resumable(self, request):
+        return self.transfers.find_resumable(request.get('id', 0),
+                                             request['size'],
+                                             request.get('chunk_size'))
+
+    def accept_file(self, request, path, resume_state=None):
+        # Ответ 'ok' со смещением для докачки отправит сам TransferManager
+        try:
+            self.transfers.receive_file(
+                request.get('id', 0), path, request['size'],
+                request.get('chunk_size'), resume_state,
+                request.get('streams', 0),
+                on_progress=self._transfer_callback('on_transfer_progress',
+                                                    'recv'),
+                on_done=self._transfer_callback('on_transfer_done', 'recv'),
+                on_error=self._transfer_callback('on_transfer_error',
+                                                 'recv'))
+        except OSError:
+            self.decline_file(request)
+            raise
+
+    def decline_file(self, request):
+        self.conn.send_json({'type': 'file_resp', 'status': 'no',
+                             'id': request.get('id', 0)})
+
+    def _transfer_callback(self, name, direction):
+        def callback(*args):
+            if name == 'on_transfer_done':
+                path = args[0]
+                size = os.path.getsize(path) if os.path.exists(path) \
+                    else None
+                self._record('add_transfer', direction, path, size)
+            elif name == 'on_transfer_error':
+                self._record('add_transfer', direction, None,
+                             status='error', error=args[0])
+            self._emit(name, direction, *args)
+        return callback
+
+    def _handle_packet(self, pkg):
+        # Куски файлов и подтверждения обрабатывает TransferManager,
+        # пакеты групп - GroupManager узла
+        if self.transfers.handle_packet(pkg) or \
+                self.node.groups.handle_packet(self, pkg):
+            return
+        now = time.time()
+        if pkg.get('type') == 'msg':
+            self._record('add_message', 'in', self.user.username,
+                         pkg.get('text'), ts=now)
+
+        with self._lock:
+            if self._started:
+                self._dispatch(pkg)
+                return
+            if not self._backlog:
+                self.backlog_since = now
+            self._backlog.append(pkg)
+        # Сообщение в соединение без открытого чата: просим его открыть
+        self.wake()
+
+    def _dispatch(self, pkg):
+        ptype = pkg.get('type')
+        if ptype == 'msg':
+            self._emit('on_message', pkg['text'])
+        elif ptype == 'file_req':
+            if self.on_file_request:
+                self.on_file_request(pkg)
+            else:
+                self.decline_file(pkg)
+        elif ptype == 'file_resp':
+            self._handle_file_resp(pkg)
+        else:
+            self._emit('on_packet', pkg)
+
+    def _handle_file_resp(self, pkg):
+        # Старый клиент не возвращает ID - берем последний запрос
+        transfer_id = pkg.get('id', next(reversed(self.pending_files), None))
+        path, chunk_size = self.pending_files.pop(transfer_id, (None, None))
+        if not path:
+            return
+
+        accepted = pkg['status'] == 'ok'
+        self._emit('on_file_response', transfer_id, accepted,
+                   pkg.get('offset', 0))
+        if accepted:
+            self.transfers.send_file(
+                transfer_id, path, chunk_size, pkg.get('manifest'),
+                pkg.get('streams', 0), pkg.get('token'),
+                on_progress=self._transfer_callback('on_transfer_progress',
+                                                    'send'),
+                on_done=self._transfer_callback('on_transfer_done', 'send'),
+                on_error=self._transfer_callback('on_transfer_error',
+                                                 'send'))
+
+    def _handle_close(self):
+        self.transfers.close()
+        self.node.pool.remove(self)
+        if self.is_alive:
+            self.is_alive = False
+            self._emit('on_disconnect')
+
+    def close(self):
+        self.is_alive = False
+        self.transfers.close()
+        self.conn.close()
+        self.node.pool.remove(self)
@@ -0,0 +1,449 @@
+import os
+import hmac
+import time
+import asyncio
+import threading
+import collections
+
+from cryptography.exceptions import InvalidTag
+
+from network.async_transport import SerialLane
+from network.codec import JSON, as_bytes
+from network.session import GroupSession, GROUP_KEY_SIZE, ROOM_ID_SIZE
+from models.user import User
+from utils.constans import GROUP_QUEUE_SIZE, GROUP_SEND_TIMEOUT
+from utils import metrics
+
+# Столько кадров одного участника уходит одной задачей очереди соединения
+SEND_BATCH = 64
+# Доля GROUP_QUEUE_SIZE: если большинство участников отстало больше,
+# отправка ждет (не дольше GROUP_SEND_TIMEOUT)
+HIGH_WATER = 0.5
+
+
+class Member:
+    # Участник группы со своей ограниченной очередью. Очередь разбирает
+    # своя задача в сетевом цикле: медленный участник задерживает только
+    # себя, а переполнение его очереди отбрасывает кадры только для него.
+    def __init__(self, group, user):
+        self.group = group
+        self.user = user
+        self.queue = collections.deque()
+        self.dropped = 0
+        # Сколько кадров группы участник уже прошел (отправил или отбросил)
+        self.done = group._pushed
+        # Переписка из пула, по которой уходят кадры участнику
+        self.conversation = None
+        self._task = None
+
+    def push(self, item):
+        # В потоке цикла. item - готовый групповой кадр (bytes) или
+        # служебный пакет (dict), который уйдет через сессию соединения.
+        # Отбрасываются только кадры: без приглашения участник не получит
+        # ключ группы, а без group_leave - не узнает о выходе.
+        if isinstance(item, bytes) and \
+                len(self.queue) >= self.group.queue_size:
+            self.dropped += 1
+            self._advance(1)
+            if metrics.enabled:
+                metrics.GROUP_DROPPED.inc(1, self.user.username)
+            self.group._lagging(self)
+            return
+        self.queue.append(item)
+        if self._task is None:
+            self._task = self.group.node.loop_thread.loop.create_task(
+                self._run())
+
+    async def _run(self):
+        try:
+            conversation = await asyncio.wrap_future(
+                self.group.node.connect(self.user, group=True,
+                                        holder=self.group))
+            await self._send(conversation.conn)
+            self.group._hold(self, conversation)
+        except Exception as e:
+            print(f"Группа {self.group.name}: {self.user.username} "
+                  f"недоступен: {e}")
+            # Следующий кадр попробует подключиться заново
+            self._advance(len(self.queue))
+            self.queue.clear()
+        finally:
+            self._task = None
+
+    async def _send(self, conn):
+        while self.queue:
+            if isinstance(self.queue[0], dict):
+                # send_json встает в ту же очередь соединения, что и кадры
+                conn.send_json(self.queue.popleft())
+                self._advance(1)
+                continue
+            frames = []
+            while self.queue and len(frames) < SEND_BATCH and \
+                    not isinstance(self.queue[0], dict):
+                frames.append(self.queue.popleft())
+            await conn.write_frames(frames)
+            self._advance(len(frames))
+
+    def _advance(self, count):
+        self.done += count
+        # Отправитель проверит отставание заново
+        self.group._wake_writer()
+
+
+class Group:
+    # Групповой чат: сообщение сериализуется и шифруется ключом группы
+    # один раз, и тот же кадр уходит всем участникам по их соединениям из
+    # пула. Ключ раздает создатель в group_invite через сессии соединений.
+    # Как и у Conversation, on_* вызываются из сетевого цикла или пула, а
+    # до start() сообщения копятся.
+    def __init__(self, node, room_id, name, key, owner, users=()):
+        self.node = node
+        self.room_id = room_id
+        self.id = room_id.hex()
+        self.name = name
+        self.key = key
+        self.owner = owner
+        self.session = GroupSession(room_id, key, node.username)
+        self.queue_size = GROUP_QUEUE_SIZE
+        self.members = {}  # username -> Member
+        self.is_alive = True
+        # Кадров, разосланных всем участникам. Если отстает большинство,
+        # то слишком быстр сам отправитель: ждет он, а не очереди
+        self._pushed = 0
+        # Ожидание отстающих - в сетевом цикле, шифрование - в очереди
+        # группы на пуле
+        self._lane = SerialLane(node.loop_thread.executor)
+        self._send_lock = None
+        self._writable = None
+
+        # Обработчики вызываются под блокировкой (порядок сообщений) и
+        # могут читать состав группы
+        self._lock = threading.RLock()
+        self._started = False
+        self._waking = False
+        self._backlog = []
+        # Время первого сообщения в _backlog (как у Conversation)
+        self.backlog_since = None
+
+        self.on_message = None  # (sender, text)
+        self.on_members = None  # () - изменился состав
+        self.on_member_lag = None  # (username, dropped)
+        self.set_members(users)
+
+    @property
+    def history_key(self):
+        # Под этим именем собеседника сообщения группы лежат в истории
+        return f"group:{self.id}"
+
+    def usernames(self):
+        with self._lock:
+            return sorted(self.members)
+
+    def set_members(self, users):
+        # Очереди оставшихся участников сохраняются
+        with self._lock:
+            members = {}
+            for user in users:
+                if user.username == self.node.username:
+                    continue
+                member = self.members.get(user.username)
+                if member is None or (member.user.addr, member.user.port) \
+                        != (user.addr, user.port):
+                    member = Member(self, user)
+                members[user.username] = member
+            for member in self.members.values():
+                if members.get(member.user.username) is not member:
+                    self._unhold(member)
+            self.members = members
+
+    def _hold(self, member, conversation):
+        # Открытая группа - владелец соединений участников в пуле, как
+        # окно чата: пул не закроет их по простою. Пока участнику
+        # отправляется очередь, группа владеет соединением в любом случае,
+        # иначе при подключении к многим участникам сразу пул вытеснит
+        # новые соединения вместе с неотправленными кадрами.
+        with self._lock:
+            member.conversation = conversation
+            if self._started and \
+                    self.members.get(member.user.username) is member:
+                self.node.pool.acquire(conversation, self)
+            else:
+                self.node.pool.release(conversation, self)
+
+    def _unhold(self, member):
+        # Под self._lock
+        if self._started and member.conversation:
+            self.node.pool.release(member.conversation, self)
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                for member in self.members.values():
+                    if member.conversation:
+                        self.node.pool.acquire(member.conversation, self)
+            self._started = True
+            self._waking = False
+            backlog, self._backlog = self._backlog, []
+            self.backlog_since = None
+            for sender, text in backlog:
+                self._emit('on_message', sender, text)
+
+    def release(self):
+        # Окно группы закрыто: новые сообщения снова откроют его
+        with self._lock:
+            for member in self.members.values():
+                self._unhold(member)
+            self._started = False
+            self._waking = False
+            for name in ('on_message', 'on_members', 'on_member_lag'):
+                setattr(self, name, None)
+
+    def wake(self):
+        with self._lock:
+            if self._started or self._waking:
+                return
+            self._waking = True
+        self.node.announce_group(self)
+
+    def _emit(self, name, *args):
+        callback = getattr(self, name)
+        if callback:
+            callback(*args)
+
+    def send_text(self, text):
+        # Не блокирует (в том числе поток GUI): возвращает
+        # concurrent.futures.Future, ошибка отправки - в нем
+        if not self.is_alive:
+            raise ConnectionError("Вы вышли из группы")
+        return self.node.loop_thread.run(self._send_text(text))
+
+    async def _send_text(self, text):
+        if self._send_lock is None:
+            self._send_lock = asyncio.Lock()
+        # Ждут отстающих по очереди; шифрование и рассылка идут в очереди
+        # группы в том же порядке и не держат следующие сообщения
+        async with self._send_lock:
+            await self._wait_writable()
+            if not self.is_alive:
+                raise ConnectionError("Вы вышли из группы")
+            with self._lock:
+                self._pushed += 1
+            future = self._lane.submit(self._seal_and_push, text)
+        await asyncio.wrap_future(future)
+
+    def _seal_and_push(self, text):
+        # В очереди группы на пуле шифрования
+        try:
+            frame = self.session.seal(JSON.dumps({'type': 'msg',
+                                                  'text': text}))
+        except Exception:
+            with self._lock:
+                self._pushed -= 1
+            raise
+        self.node.loop_thread.loop.call_soon_threadsafe(self._push_all,
+                                                        frame)
+        self._record('out', self.node.username, text)
+
+    def add(self, users):
+        # Новым участникам - приглашение, остальным - новый состав
+        with self._lock:
+            current = [member.user for member in self.members.values()]
+        self.set_members(current + list(users))
+        self._fanout(self.invite_packet())
+        self._emit('on_members')
+
+    def leave(self):
+        if not self.is_alive:
+            return
+        self.is_alive = False
+        self._fanout({'type': 'group_leave', 'room': self.id})
+        self.node.groups.remove(self)
+        self._wake_writer()
+        # group_leave уйдет и так, а держать соединения больше незачем
+        with self._lock:
+            for member in self.members.values():
+                self._unhold(member)
+            self._started = False
+
+    def invite_packet(self):
+        with self._lock:
+            users = [member.user for member in self.members.values()]
+        # Свой адрес собеседник знает по соединению
+        members = [[self.node.username, None, self.node.port]]
+        members += [[user.username, user.addr, user.port] for user in users]
+        return {'type': 'group_invite', 'room': self.id, 'name': self.name,
+                'owner': self.owner, 'key': self.key, 'members': members}
+
+    def _lag(self):
+        # Отставание медианного участника: медленное меньшинство его не
+        # увеличит
+        with self._lock:
+            done = sorted(member.done for member in self.members.values())
+            return self._pushed - done[len(done) // 2] if done else 0
+
+    async def _wait_writable(self):
+        # В потоке цикла: там же участники продвигают свои очереди
+        loop = self.node.loop_thread.loop
+        limit = self.queue_size * HIGH_WATER
+        deadline = loop.time() + GROUP_SEND_TIMEOUT
+        while self.is_alive and self._lag() >= limit:
+            self._writable = loop.create_future()
+            try:
+                await asyncio.wait_for(self._writable,
+                                       deadline - loop.time())
+            except asyncio.TimeoutError:
+                raise TimeoutError("Участники группы не успевают получать "
+                                   "сообщения") from None
+            finally:
+                self._writable = None
+
+    def _wake_writer(self):
+        # Из любого потока: отправитель проверит отставание заново
+        if self.node.loop_thread.in_loop():
+            waiter = self._writable
+            if waiter and not waiter.done():
+                waiter.set_result(None)
+        else:
+            self.node.loop_thread.loop.call_soon_threadsafe(
+                self._wake_writer)
+
+    def _fanout(self, item):
+        # Один переход в цикл на всех участников
+        with self._lock:
+            self._pushed += 1
+        self.node.loop_thread.loop.call_soon_threadsafe(self._push_all, item)
+
+    def _push_all(self, item):
+        with self._lock:
+            members = list(self.members.values())
+        for member in members:
+            member.push(item)
+
+    def _lagging(self, member):
+        # Первое отброшенное сообщение и дальше каждое GROUP_QUEUE_SIZE-е
+        if member.dropped % self.queue_size == 1 or self.queue_size == 1:
+            print(f"Группа {self.name}: {member.user.username} не успевает, "
+                  f"пропущено {member.dropped}")
+            self._emit('on_member_lag', member.user.username, member.dropped)
+
+    def receive(self, sender, frame):
+        # В очереди соединения отправителя на пуле шифрования
+        if sender not in self.members or not self.is_alive:
+            return
+        try:
+            packet = JSON.loads(self.session.open(frame, sender))
+        except InvalidTag:
+            print(f"Группа {self.name}: неверная подпись кадра от {sender}")
+            return
+        except ValueError as e:
+            print(f"Группа {self.name}: ошибка кадра от {sender}: {e}")
+            return
+        if packet.get('type') != 'msg':
+            return
+        now = time.time()
+        text = packet.get('text')
+        self._record('in', sender, text, now)
+        with self._lock:
+            if self._started:
+                self._emit('on_message', sender, text)
+                return
+            if not self._backlog:
+                self.backlog_since = now
+            self._backlog.append((sender, text))
+        self.wake()
+
+    def remove_member(self, username):
+        with self._lock:
+            removed = self.members.pop(username, None)
+            if removed:
+                self._unhold(removed)
+        if removed:
+            self._wake_writer()
+            self._emit('on_members')
+
+    def _record(self, direction, sender, text, ts=None):
+        if self.node.history:
+            self.node.history.add_message(self.history_key, direction,
+                                          sender, text, ts=ts)
+
+
+class GroupManager:
+    # Группы узла по id. Пакеты групп приходят через Conversation любого
+    # участника: handle_packet() разбирает их до пакетов переписки.
+    def __init__(self, node):
+        self.node = node
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def groups(self):
+        with self._lock:
+            return list(self._groups.values())
+
+    def get(self, group_id):
+        with self._lock:
+            return self._groups.get(group_id)
+
+    def create(self, name, users):
+        group = Group(self.node, os.urandom(ROOM_ID_SIZE), name,
+                      os.urandom(GROUP_KEY_SIZE), self.node.username, users)
+        with self._lock:
+            self._groups[group.id] = group
+        group._fanout(group.invite_packet())
+        return group
+
+    def remove(self, group):
+        with self._lock:
+            if self._groups.get(group.id) is group:
+                del self._groups[group.id]
+
+    def handle_packet(self, conversation, pkg):
+        # Возвращает True, если пакет относится к группам
+        ptype = pkg.get('type')
+        if ptype == 'group_frame':
+            group = self.get(pkg['room'].hex())
+            if group:
+                group.receive(conversation.user.username, pkg['frame'])
+            return True
+        if ptype == 'group_invite':
+            try:
+                self._handle_invite(conversation, pkg)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Ошибка приглашения в группу: {e}")
+            return True
+        if ptype == 'group_leave':
+            group = self.get(pkg.get('room'))
+            if group:
+                group.remove_member(conversation.user.username)
+            return True
+        return False
+
+    def _handle_invite(self, conversation, pkg):
+        sender = conversation.user
+        users = []
+        for username, addr, port in pkg['members']:
+            if username == sender.username:
+                users.append(sender)
+            elif username != self.node.username:
+                users.append(User(addr, int(port), username, 0))
+
+        with self._lock:
+            group = self._groups.get(pkg['room'])
+            created = group is None
+            if created:
+                group = Group(self.node, bytes.fromhex(pkg['room']),
+                              pkg['name'], as_bytes(pkg['key']),
+                              pkg.get('owner'), users)
+                self._groups[group.id] = group
+        if created:
+            group.wake()
+            return
+        # Состав меняет только создатель или участник группы, знающий ее
+        # ключ: иначе любой знающий id комнаты подменил бы список
+        if sender.username != group.owner and \
+                sender.username not in group.usernames() or \
+                not hmac.compare_digest(as_bytes(pkg['key']), group.key):
+            print(f"Группа {group.name}: приглашение от {sender.username} "
+                  f"отклонено")
+            return
+        group.set_members(users)
+        group._emit('on_members')
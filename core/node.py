@@ -0,0 +1,266 @@
+import socket
+import threading
+
+from network.async_transport import EventLoopThread, AsyncTCPServer, \
+    open_connection
+from network.broadcast_discovery import BroadcastDiscovery
+from network.presence import PresenceRegistry, LEAVE
+from models.user import User
+from core.conversation import Conversation
+from core.group import GroupManager
+from core.pool import ConnectionPool, SWEEP_INTERVAL
+from database.history import HistoryStore
+from database.database import UserRepository
+from utils.constans import BROADCAST_PORT, TCP_PORT, USE_MULTICAST, \
+    MULTICAST_GROUP, MULTICAST_TTL, DISCOVERY_SEEDS, DISCOVERY_PROBE_LIMIT, \
+    PEER_SAVE_INTERVAL
+from utils import metrics
+
+
+def get_local_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('8.8.8.8', 1))
+        ip = s.getsockname()[0]
+    except:
+        ip = '127.0.0.1'
+    finally:
+        s.close()
+    return ip
+
+
+class ChatNode:
+    # Сетевое ядро чата без GUI: сервер, обнаружение, переписки и файлы.
+    # Tk-приложение и cli.py - только клиенты этого класса.
+    def __init__(self, username, port=TCP_PORT, host="", discovery=True,
+                 loop_thread=None, multicast_group=None,
+                 multicast_ttl=MULTICAST_TTL, seeds=None, history=True,
+                 peers=True, broadcast_port=BROADCAST_PORT):
+        self.username = username
+        self.host = host
+        self.port = port
+        self.use_discovery = discovery
+        self.broadcast_port = broadcast_port
+        # Без явных параметров - настройки из utils/constans.py
+        if multicast_group is None and USE_MULTICAST:
+            multicast_group = MULTICAST_GROUP
+        self.multicast_group = multicast_group
+        self.multicast_ttl = multicast_ttl
+        self.seeds = DISCOVERY_SEEDS if seeds is None else seeds
+        self._own_loop = loop_thread is None
+        self.loop_thread = loop_thread or EventLoopThread()
+
+        self.tcp_server = None
+        self.broadcast_discovery = None
+        # Кто в сети: события join/leave/change - presence.subscribe()
+        self.presence = PresenceRegistry()
+        self.pool = ConnectionPool(username)
+        self.groups = GroupManager(self)
+        # История сообщений и передач (None - не сохранять)
+        self.history = HistoryStore(owner=username) if history is True \
+            else history or None
+        # Собеседники прошлых запусков (UserRepository, None - не хранить)
+        self.peers = None
+        self._use_peers = peers
+        self.known_peers = {}  # username -> User
+        self._unsaved = {}
+        self._unsaved_lock = threading.Lock()
+        self._sweeper = None
+        self._saver = None
+        # Число переписок считается только при выгрузке метрик
+        self._untrack = metrics.CONNECTIONS.track(
+            lambda: len(self.pool.conversations()), username)
+
+        # (conversation) - входящая переписка или сообщение в соединение
+        # из пула; вызывается в сетевом цикле, обработчик должен назначить
+        # on_* и вызвать conversation.start()
+        self.on_conversation = None
+        # (group) - приглашение в новую группу; обработчик назначает on_*
+        # и вызывает group.start()
+        self.on_group = None
+
+    def start(self):
+        if self.history:
+            self.history.open()
+        if self._use_peers:
+            self.peers = UserRepository() if self._use_peers is True \
+                else self._use_peers
+            for user in self.peers.iter_users():
+                self.known_peers[user.username] = user
+            self.presence.subscribe(self._remember_peer)
+        self.tcp_server = AsyncTCPServer(self.loop_thread,
+                                         self._handle_incoming,
+                                         self.host, self.port)
+        self.port = self.tcp_server.port
+        if self.use_discovery:
+            self.broadcast_discovery = BroadcastDiscovery(
+                self.broadcast_port, self.presence, self.multicast_group,
+                self.multicast_ttl, self.seeds)
+            if self.peers:
+                # Живые из них ответят сразу, не дожидаясь объявлений
+                self.broadcast_discovery.probe_addrs = [
+                    (user.addr, self.broadcast_port)
+                    for user in self.peers.recent(DISCOVERY_PROBE_LIMIT)]
+            self.broadcast_discovery.start_discovery(self.username,
+                                                     get_local_ip(),
+                                                     self.port)
+        self.loop_thread.loop.call_soon_threadsafe(self._schedule_sweep)
+        if self.peers:
+            self.loop_thread.loop.call_soon_threadsafe(self._schedule_save)
+
+    def _schedule_sweep(self):
+        self._sweeper = self.loop_thread.loop.call_later(SWEEP_INTERVAL,
+                                                         self._sweep)
+
+    def _remember_peer(self, event, peer):
+        # Поток обнаружения: только копим, в базу пишет _save_peers пачкой
+        if event == LEAVE:
+            return
+        with self._unsaved_lock:
+            self._unsaved[(peer.key, peer.tcp_port)] = peer
+
+    def _schedule_save(self):
+        self._saver = self.loop_thread.loop.call_later(
+            PEER_SAVE_INTERVAL, self._save_tick)
+
+    def _save_tick(self):
+        self.loop_thread.loop.run_in_executor(None, self._save_peers)
+        self._schedule_save()
+
+    def _save_peers(self):
+        with self._unsaved_lock:
+            users, self._unsaved = list(self._unsaved.values()), {}
+        if not users or not self.peers:
+            return
+        try:
+            self.peers.upsert_many(users)
+        except Exception as e:
+            print(f"Ошибка сохранения собеседников: {e}")
+        for peer in users:
+            self.known_peers[peer.username] = peer.to_user()
+
+    def _sweep(self):
+        # Закрытие соединений не должно задерживать цикл
+        self.loop_thread.loop.run_in_executor(None, self.pool.sweep)
+        self._schedule_sweep()
+
+    def stop(self):
+        if self.broadcast_discovery: self.broadcast_discovery.stop()
+        if self.tcp_server: self.tcp_server.close()
+        if self._sweeper:
+            self.loop_thread.loop.call_soon_threadsafe(self._sweeper.cancel)
+        if self._saver:
+            self.loop_thread.loop.call_soon_threadsafe(self._saver.cancel)
+        if self.peers:
+            self._save_peers()
+            self.peers.close()
+            self.peers = None
+        self._saver = None
+        self.broadcast_discovery = None
+        self.tcp_server = None
+        self._sweeper = None
+        self.pool.close_all()
+        self._untrack()
+        if self.history:
+            self.history.close()
+        if self._own_loop:
+            self.loop_thread.stop()
+
+    def online_users(self):
+        return self.presence.users()
+
+    def find_user(self, username, ip=None):
+        peer = self.presence.find(username, ip)
+        if peer:
+            return peer.to_user()
+        # Не в сети по объявлениям (например, в другой подсети): последний
+        # известный адрес
+        user = self.known_peers.get(username)
+        if user and ip in (None, user.addr):
+            return user
+        return None
+
+    def connect(self, user, group=False, holder=None):
+        # Возвращает concurrent.futures.Future с Conversation. Живое
+        # соединение из пула (в том числе входящее) используется повторно.
+        # group=True - соединение для группы: у собеседника оно не
+        # открывает окно чата. holder сразу становится владельцем
+        # переписки в пуле, чтобы ее не вытеснили до pool.acquire().
+        conversation = self.pool.get((user.addr, user.port), holder)
+        if conversation:
+            return self.loop_thread.run(_ready(conversation))
+        return self.loop_thread.run(self._connect(user, group, holder))
+
+    async def _connect(self, user, group=False, holder=None):
+        # Свой порт в рукопожатии позволяет собеседнику найти это
+        # соединение в своем пуле
+        extra = {'group': True} if group else {}
+        conn = await open_connection(self.loop_thread, user.addr, user.port,
+                                     self.username, tcp_port=self.port,
+                                     **extra)
+        return self._add(Conversation(self, user, conn, outgoing=True),
+                         holder)
+
+    def _add(self, conversation, holder=None):
+        result = self.pool.add(conversation, holder)
+        if result is conversation:
+            conversation.open()
+        return result
+
+    def announce(self, conversation):
+        # Входящая переписка или пакет в соединение без открытого чата
+        if self.on_conversation:
+            self.on_conversation(conversation)
+        else:
+            conversation.close()
+
+    def announce_group(self, group):
+        if self.on_group:
+            self.on_group(group)
+        else:
+            group.start()
+
+    def create_group(self, name, users):
+        # Приглашения уходят участникам сразу; возвращает Group
+        return self.groups.create(name, users)
+
+    async def _handle_incoming(self, connection, address):
+        try:
+            data = await connection.read_packet()
+            if not data or data.get('type') != 'handshake':
+                connection.close()
+                return
+
+            await connection.accept_handshake(data)
+            if 'stream' in data:
+                self._attach_data_stream(connection, data['stream'])
+                return
+
+            username = data.get('username', 'Unknown')
+            if data.get('tcp_port'):
+                target_user = User(address[0], int(data['tcp_port']),
+                                   username, 0)
+            else:
+                target_user = self.find_user(username, address[0]) or \
+                    User(address[0], 0, username, 0)
+
+            conversation = Conversation(self, target_user, connection)
+            # Соединение участника группы: чат откроет только его
+            # собственное сообщение
+            if self._add(conversation) is conversation and \
+                    not data.get('group'):
+                conversation.wake()
+        except Exception as e:
+            print(f"Ошибка рукопожатия: {e}")
+            connection.close()
+
+    def _attach_data_stream(self, connection, stream):
+        # Дополнительное соединение для передачи файла из открытой переписки
+        for conversation in self.pool.conversations():
+            if conversation.transfers.attach_stream(connection, stream):
+                return
+        connection.close()
+
+
+async def _ready(conversation):
+    return conversation
@@ -0,0 +1,154 @@
+import time
+import threading
+from collections import OrderedDict
+
+from utils.constans import MAX_IDLE_CONNECTIONS, IDLE_TIMEOUT
+
+# Как часто закрываются простаивающие дольше IDLE_TIMEOUT соединения, с
+SWEEP_INTERVAL = 30
+
+
+class ConnectionPool:
+    # Переписки по ключу собеседника (ip, tcp_port). Закрытое окно чата
+    # не рвет соединение, а возвращает его в пул: повторное открытие чата
+    # обходится без TCP и рукопожатия. Переписка без владельцев (окна
+    # чата, открытой группы) простаивает с момента создания: такие
+    # соединения живут не дольше IDLE_TIMEOUT после последнего кадра, и
+    # их не больше MAX_IDLE_CONNECTIONS (вытесняются самые давние).
+    def __init__(self, username, max_idle=MAX_IDLE_CONNECTIONS,
+                 idle_timeout=IDLE_TIMEOUT):
+        self.username = username
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._by_key = {}
+        self._all = {}  # упорядоченное множество всех переписок
+        # conversation -> время, с которого у нее нет владельцев
+        self._idle = OrderedDict()
+        self._holders = {}  # conversation -> set владельцев
+        self._lock = threading.Lock()
+
+    def conversations(self):
+        with self._lock:
+            return list(self._all)
+
+    def get(self, key, holder=None):
+        with self._lock:
+            conversation = self._by_key.get(key)
+            if conversation and conversation.is_alive:
+                self._touch(conversation)
+                if holder:
+                    self._hold(conversation, holder)
+                return conversation
+        return None
+
+    def acquire(self, conversation, holder=None):
+        # У переписки есть владелец (окно чата - сама переписка, открытая
+        # группа): sweep() и вытеснение ее не закроют до release()
+        with self._lock:
+            if conversation in self._all:
+                self._hold(conversation, holder or conversation)
+
+    def _hold(self, conversation, holder):
+        self._holders.setdefault(conversation, set()).add(holder)
+        self._idle.pop(conversation, None)
+
+    def _touch(self, conversation):
+        # Переписку только что взяли из пула: простой считается заново
+        if conversation in self._idle:
+            self._idle[conversation] = time.monotonic()
+            self._idle.move_to_end(conversation)
+
+    def add(self, conversation, holder=None):
+        # Возвращает переписку, которую надо использовать: при встречных
+        # подключениях одна из двух закрывается. Владелец holder берет
+        # ее до вытеснения лишних простаивающих.
+        loser = None
+        key = conversation.key
+        with self._lock:
+            existing = self._by_key.get(key) if key else None
+            if existing and existing.is_alive and \
+                    self._keep_existing(existing, conversation):
+                self._touch(existing)
+                loser, conversation = conversation, existing
+            else:
+                loser = existing
+                self._all[conversation] = None
+                if key:
+                    self._by_key[key] = conversation
+                # Пока владельца нет, переписка простаивает
+                self._idle[conversation] = time.monotonic()
+            if holder:
+                self._hold(conversation, holder)
+            evicted = self._evict()
+
+        if loser:
+            self.remove(loser)
+            loser.close()
+        for idle in evicted:
+            idle.close()
+        return conversation
+
+    def _keep_existing(self, existing, new):
+        # Если оба соединения открыты в одну сторону, старое скорее всего
+        # уже мертво. Если навстречу друг другу - обе стороны оставляют
+        # соединение, открытое участником с меньшим именем.
+        if existing.outgoing == new.outgoing:
+            return False
+        if existing.outgoing:
+            initiator = self.username
+        else:
+            initiator = existing.user.username
+        other = existing.user.username \
+            if initiator == self.username else self.username
+        return initiator < other
+
+    def release(self, conversation, holder=None):
+        with self._lock:
+            if conversation not in self._all:
+                return
+            holders = self._holders.get(conversation)
+            if holders is not None:
+                holders.discard(holder or conversation)
+                if holders:
+                    return
+                del self._holders[conversation]
+            self._idle[conversation] = time.monotonic()
+            self._idle.move_to_end(conversation)
+            evicted = self._evict()
+        for conversation in evicted:
+            conversation.close()
+
+    def _evict(self):
+        # Под блокировкой. Сверх max_idle закрываются переписки с самым
+        # давним кадром: у соединений групп нет владельца, пока окно
+        # группы закрыто, но по ним могут идти сообщения.
+        evicted = []
+        while len(self._idle) > self.max_idle:
+            oldest = min(self._idle, key=self._last_used)
+            del self._idle[oldest]
+            evicted.append(oldest)
+        return evicted
+
+    def _last_used(self, conversation):
+        return max(self._idle[conversation],
+                   getattr(conversation.conn, 'last_activity', 0.0))
+
+    def remove(self, conversation):
+        with self._lock:
+            self._all.pop(conversation, None)
+            key = conversation.key
+            if key and self._by_key.get(key) is conversation:
+                del self._by_key[key]
+            self._idle.pop(conversation, None)
+            self._holders.pop(conversation, None)
+
+    def sweep(self):
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            expired = [c for c in self._idle if self._last_used(c) < deadline]
+        for conversation in expired:
+            conversation.close()
+
+    def close_all(self):
+        for conversation in self.conversations():
+            conversation.close()
@@ -1,8 +1,12 @@
 import sqlite3
 import os
+import time
+import threading
 
+from models.user import User
 
-def get_db_path():
+
+def get_db_path(filename='users_table.db'):
     current_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_dir)
     data_dir = os.path.join(project_root, 'data')
@@ -10,51 +14,132 @@ def get_db_path():
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
-    return os.path.join(data_dir, 'users_table.db')
-
-
-def get_connection():
-    db_path = get_db_path()
-    return sqlite3.connect(db_path)
+    return os.path.join(data_dir, filename)
+
+
+def get_connection(path=None):
+    return sqlite3.connect(path or get_db_path())
+
+
+CREATE_USERS = '''
+    CREATE TABLE IF NOT EXISTS Users (
+        id_key INTEGER PRIMARY KEY AUTOINCREMENT,
+        id INTEGER,
+        username TEXT,
+        addr TEXT,
+        port INTEGER)
+    '''
+# Старые базы могли накопить повторы: оставляем последнюю запись
+DEDUPE_USERS = '''
+    DELETE FROM Users WHERE id_key NOT IN (
+        SELECT max(id_key) FROM Users GROUP BY username, addr, port)
+    '''
+UNIQUE_USERS = ('CREATE UNIQUE INDEX IF NOT EXISTS users_peer '
+                'ON Users (username, addr, port)')
+UPSERT_USER = '''
+    INSERT INTO Users (id, username, addr, port, last_seen)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (username, addr, port) DO UPDATE SET
+        id = excluded.id,
+        last_seen = max(coalesce(last_seen, 0), excluded.last_seen)
+    '''
+SELECT_USERS = 'SELECT id, username, addr, port FROM Users'
+SELECT_RECENT = ('SELECT id, username, addr, port FROM Users '
+                 'ORDER BY last_seen DESC LIMIT ?')
+
+# Сколько строк читается из курсора за раз при обходе
+FETCH_SIZE = 500
+
+
+class UserRepository:
+    # Известные собеседники. Одно соединение на все время работы (sqlite3
+    # кэширует подготовленные запросы соединения), запись пачками через
+    # executemany и UPSERT по (username, addr, port) - без повторов.
+    def __init__(self, path=None):
+        self.path = path or get_db_path()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._connection:
+            self._connection.execute(CREATE_USERS)
+            columns = [row[1] for row in
+                       self._connection.execute('PRAGMA table_info(Users)')]
+            if 'last_seen' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE Users ADD COLUMN last_seen REAL')
+            self._connection.execute(DEDUPE_USERS)
+            self._connection.execute(UNIQUE_USERS)
+
+    def upsert(self, user, last_seen=None):
+        self.upsert_many([user], last_seen)
+
+    def upsert_many(self, users, last_seen=None):
+        # users - User или Peer из PresenceRegistry
+        now = last_seen or time.time()
+        rows = []
+        for user in users:
+            if isinstance(user, User):
+                rows.append((user.id, user.username, user.addr, user.port,
+                             now))
+            else:
+                rows.append((0, user.username, user.ip, user.tcp_port,
+                             user.last_seen or now))
+        with self._lock, self._connection:
+            self._connection.executemany(UPSERT_USER, rows)
+
+    def iter_users(self, fetch_size=FETCH_SIZE):
+        # Потоковый обход: в памяти не больше fetch_size строк. Курсор
+        # свой, поэтому обход не мешает записи из других потоков.
+        connection = sqlite3.connect(self.path)
+        try:
+            cursor = connection.execute(SELECT_USERS)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for id, username, addr, port in rows:
+                    yield User(addr, port, username, id)
+        finally:
+            connection.close()
+
+    def recent(self, limit):
+        # Последние замеченные собеседники
+        with self._lock:
+            rows = self._connection.execute(SELECT_RECENT,
+                                            (limit,)).fetchall()
+        return [User(addr, port, username, id)
+                for id, username, addr, port in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    # Общий репозиторий для функций ниже
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            _repository = UserRepository()
+        return _repository
 
 
 def create_table():
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Users (
-            id_key INTEGER PRIMARY KEY AUTOINCREMENT,
-            id INTEGER,
-            username TEXT,
-            addr TEXT,
-            port INTEGER)
-        ''')
-
-    connection.commit()
-    connection.close()
+    get_repository()
 
 
 def add_user(id, username, addr, port):
-    connection = get_connection()
-    cursor = connection.cursor()
-    cursor.execute(
-        'INSERT INTO Users (id, username, addr, port) VALUES (?, ?, ?, ?)',
-        (id, username, addr, port))
-    connection.commit()
-    connection.close()
+    get_repository().upsert(User(addr, port, username, id))
 
 
 def get_all_users():
-    connection = get_connection()
-    cursor = connection.cursor()
-    cursor.execute('SELECT * FROM Users')
-    users = cursor.fetchall()
-
-    users_list = []
-    for user in users:
-        from models.user import User
-        users_list.append(User(user[2], user[4], user[3], user[1]))
-
-    connection.close()
-    return users_list
\ No newline at end of file
+    return list(get_repository().iter_users())
@@ -0,0 +1,223 @@
+import time
+import queue
+import sqlite3
+import threading
+from urllib.parse import quote
+
+from database.database import get_db_path
+from utils.constans import HISTORY_BATCH_SIZE
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS Messages (
+        id INTEGER PRIMARY KEY,
+        peer TEXT NOT NULL,
+        ts REAL NOT NULL,
+        direction TEXT NOT NULL,
+        sender TEXT,
+        text TEXT);
+    CREATE INDEX IF NOT EXISTS messages_peer_ts ON Messages (peer, ts, id);
+    CREATE TABLE IF NOT EXISTS Transfers (
+        id INTEGER PRIMARY KEY,
+        peer TEXT NOT NULL,
+        ts REAL NOT NULL,
+        direction TEXT NOT NULL,
+        path TEXT,
+        size INTEGER,
+        status TEXT,
+        error TEXT);
+    CREATE INDEX IF NOT EXISTS transfers_peer_ts ON Transfers (peer, ts, id);
+'''
+
+# Полнотекстовый индекс по тексту сообщений. Заполняется потоком записи
+# пачкой (executemany) - втрое быстрее, чем триггером на каждую строку.
+FTS_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS MessagesFts USING fts5(
+        text, content='Messages', content_rowid='id');
+'''
+
+INSERT_MESSAGE = ('INSERT INTO Messages (id, peer, ts, direction, sender, '
+                  'text) VALUES (?, ?, ?, ?, ?, ?)')
+INSERT_FTS = 'INSERT INTO MessagesFts (rowid, text) VALUES (?, ?)'
+INSERT_TRANSFER = ('INSERT INTO Transfers (peer, ts, direction, path, size, '
+                   'status, error) VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+_STOP = object()
+
+
+def history_filename(owner=None):
+    if not owner:
+        return 'history.db'
+    # Имя кодируется без потерь: разные имена - разные файлы
+    return f"history_{quote(owner, safe='')}.db"
+
+
+def _connect(path, **kwargs):
+    connection = sqlite3.connect(path, **kwargs)
+    # WAL: чтение не ждет записи; NORMAL - fsync только на контрольных точках
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('PRAGMA cache_size=-65536')
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+class HistoryStore:
+    # История сообщений и передач файлов. Запись - только в своем потоке с
+    # одним долгоживущим соединением: add_*() кладут строку в очередь и
+    # сразу возвращаются, а поток пишет накопившееся одной транзакцией
+    # (групповой коммит). Чтение - через отдельное соединение: в режиме
+    # WAL оно не ждет записи.
+    def __init__(self, path=None, batch_size=HISTORY_BATCH_SIZE, owner=None):
+        # Строки хранятся только по собеседнику, поэтому у каждого
+        # локального пользователя (owner) свой файл: экземпляры на одной
+        # машине не видят чужих сообщений как свои
+        self.path = path or get_db_path(history_filename(owner))
+        self.batch_size = batch_size
+        self.has_fts = False
+        self._queue = queue.Queue()
+        self._thread = None
+        self._reader = None
+        self._read_lock = threading.Lock()
+
+    def open(self):
+        connection = _connect(self.path)
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 недоступен, поиск без индекса: {e}")
+        connection.close()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+        self._reader = _connect(self.path, check_same_thread=False)
+        self._reader.execute('PRAGMA query_only=1')
+        return self
+
+    def add_message(self, peer, direction, sender, text, ts=None):
+        # direction: 'in' / 'out'
+        self._queue.put((INSERT_MESSAGE, (peer, ts or time.time(), direction,
+                                          sender, text)))
+
+    def add_transfer(self, peer, direction, path, size=None, status='done',
+                     error=None, ts=None):
+        self._queue.put((INSERT_TRANSFER, (peer, ts or time.time(),
+                                           direction, path, size, status,
+                                           error and str(error))))
+
+    def _writer(self):
+        connection = _connect(self.path)
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            # Все, что накопилось, пока шла прошлая транзакция
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = {}
+            waiters = []
+            for item in batch:
+                if item is _STOP:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    rows.setdefault(item[0], []).append(item[1])
+            try:
+                if rows:
+                    self._write_rows(connection, rows)
+            except sqlite3.Error as e:
+                print(f"Ошибка записи истории: {e}")
+            for event in waiters:
+                event.set()
+        connection.close()
+
+    def _write_rows(self, connection, rows):
+        # id сообщений нужны для полнотекстового индекса до вставки, поэтому
+        # поток выдает их сам. Та же база может быть открыта другим
+        # процессом чата: BEGIN IMMEDIATE берет блокировку записи до чтения
+        # max(id), и id не пересекаются.
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            messages = rows.get(INSERT_MESSAGE)
+            if messages:
+                next_id = connection.execute(
+                    'SELECT coalesce(max(id), 0) + 1 FROM Messages'
+                ).fetchone()[0]
+                rows[INSERT_MESSAGE] = [(next_id + i,) + row
+                                        for i, row in enumerate(messages)]
+                if self.has_fts:
+                    rows[INSERT_FTS] = [(row[0], row[5])
+                                        for row in rows[INSERT_MESSAGE]]
+            for sql, params in rows.items():
+                connection.executemany(sql, params)
+
+    def flush(self, timeout=None):
+        # Ждет, пока записано все, что добавлено до вызова
+        event = threading.Event()
+        self._queue.put(event)
+        return event.wait(timeout)
+
+    def _query(self, sql, params=()):
+        with self._read_lock:
+            return [dict(row) for row in self._reader.execute(sql, params)]
+
+    def recent(self, peer, limit=100):
+        # Последние сообщения, от старых к новым
+        rows = self._query(
+            'SELECT * FROM Messages WHERE peer = ? '
+            'ORDER BY ts DESC, id DESC LIMIT ?', (peer, limit))
+        rows.reverse()
+        return rows
+
+    def page(self, peer, before_ts, before_id, limit=100):
+        # Страница перед сообщением (before_ts, before_id): по индексу, без
+        # OFFSET, поэтому глубина прокрутки не влияет на скорость
+        rows = self._query(
+            'SELECT * FROM Messages WHERE peer = ? AND (ts, id) < (?, ?) '
+            'ORDER BY ts DESC, id DESC LIMIT ?',
+            (peer, before_ts, before_id, limit))
+        rows.reverse()
+        return rows
+
+    def search(self, text, peer=None, limit=50):
+        # Новые совпадения первыми; без FTS5 - медленный LIKE
+        if self.has_fts:
+            sql = ('SELECT Messages.* FROM MessagesFts '
+                   'JOIN Messages ON Messages.id = MessagesFts.rowid '
+                   'WHERE MessagesFts MATCH ?')
+            params = [text]
+        else:
+            sql = 'SELECT * FROM Messages WHERE text LIKE ?'
+            params = [f'%{text}%']
+        if peer is not None:
+            sql += ' AND peer = ?'
+            params.append(peer)
+        # id растут вместе со временем: FTS5 отдает rowid по убыванию без
+        # сортировки всех совпадений
+        sql += ' ORDER BY MessagesFts.rowid DESC LIMIT ?' if self.has_fts \
+            else ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        try:
+            return self._query(sql, params)
+        except sqlite3.OperationalError as e:
+            print(f"Ошибка поиска: {e}")
+            return []
+
+    def transfers(self, peer, limit=100):
+        return self._query(
+            'SELECT * FROM Transfers WHERE peer = ? '
+            'ORDER BY ts DESC, id DESC LIMIT ?', (peer, limit))
+
+    def close(self):
+        if self._thread:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self._reader:
+            with self._read_lock:
+                self._reader.close()
+            self._reader = None
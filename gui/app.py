@@ -1,14 +1,16 @@
-from tkinter import messagebox
-import tkinter as tk
+from tkinter import messagebox, simpledialog
 import threading
-import socket
+import tkinter as tk
 
-from network.tcp_srv import TCPServer
-from network.broadcast_discovery import BroadcastDiscovery
-from network.protocol import recv_json
+from network.async_transport import EventLoopThread
+from core.node import ChatNode
 from models.user import User
 from gui.chat_window import ChatWindow
-from utils.constans import BROADCAST_PORT, TCP_PORT
+from gui.group_window import GroupWindow
+from gui.tk_bridge import TkBridge
+from gui.user_list import UserListView
+from network.presence import LEAVE
+from utils.constans import TCP_PORT
 
 
 class ChatApp:
@@ -18,17 +20,30 @@ class ChatApp:
         self.root.geometry("400x500")
 
         self.current_user = None
-        self.tcp_server = None
-        self.broadcast_discovery = None
+        self.node = None
         self.is_running = True
+        self._unsubscribe = None
+        self.users_view = None
+        # События присутствия копятся здесь и применяются пачкой в потоке Tk
+        self._presence_events = []
+        self._presence_lock = threading.Lock()
+
+        # Все сетевые соединения обслуживает один цикл asyncio
+        self.loop_thread = EventLoopThread()
+        self.bridge = TkBridge(self.root)
 
         self.open_chats = {}
+        self.open_groups = {}  # id группы -> GroupWindow
         self.show_nickname_screen()
 
     def show_nickname_screen(self):
         self.clear_screen()
-        if self.broadcast_discovery: self.broadcast_discovery.stop()
-        if self.tcp_server: self.tcp_server.close()
+        if self.users_view: self.users_view.cancel()
+        self.users_view = None
+        if self._unsubscribe: self._unsubscribe()
+        self._unsubscribe = None
+        if self.node: self.node.stop()
+        self.node = None
 
         tk.Label(self.root, text="Введите ваш ник:", font=("Arial", 14)).pack(
             pady=40)
@@ -52,76 +67,54 @@ class ChatApp:
         self.root.update()
 
         try:
-            self.start_tcp_server()
-            threading.Thread(target=self.accept_connections_loop,
-                             daemon=True).start()
-            self.start_broadcast_discovery()
+            self.node = ChatNode(nickname, TCP_PORT,
+                                 loop_thread=self.loop_thread)
+            self.node.on_conversation = self.on_conversation
+            self.node.on_group = self.on_group
+            self._unsubscribe = self.node.presence.subscribe(
+                self.on_presence)
+            self.node.start()
             self.show_users_list()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Сбой: {e}")
             self.show_nickname_screen()
 
-    def start_tcp_server(self):
-        self.tcp_server = TCPServer(port=TCP_PORT)
+    def on_conversation(self, conversation):
+        # Вызывается в сетевом цикле: окно открываем через bridge
+        self.bridge.post(self.open_chat_window, conversation.user,
+                         conversation)
 
-    def accept_connections_loop(self):
-        if not self.tcp_server: return
-        while self.is_running:
-            try:
-                conn, addr = self.tcp_server.sock.accept()
-                threading.Thread(target=self.handle_incoming_client,
-                                 args=(conn, addr), daemon=True).start()
-            except:
-                break
+    def on_group(self, group):
+        # Приглашение или сообщение в группу без открытого окна
+        self.bridge.post(self.open_group_window, group)
 
-    def handle_incoming_client(self, connection, address):
-        try:
-            data = recv_json(connection)
-            if not data or data.get('type') != 'handshake':
-                connection.close()
+    def on_presence(self, event, user):
+        # Поток обнаружения: один вызов в Tk на пачку событий
+        with self._presence_lock:
+            self._presence_events.append((event, user))
+            if len(self._presence_events) > 1:
                 return
-
-            username = data.get('username', 'Unknown')
-
-            target_user = User(address[0], 0, username, 0)
-            if self.broadcast_discovery:
-                for u in self.broadcast_discovery.get_online_users():
-                    if u['username'] == username and u['ip'] == address[0]:
-                        target_user = User(u['ip'], u['tcp_port'],
-                                           u['username'], 0)
-                        break
-
-            self.root.after(0, lambda: self.open_chat_window(target_user,
-                                                             connection))
-        except Exception as e:
-            print(f"Ошибка рукопожатия: {e}")
-            connection.close()
-
-    def start_broadcast_discovery(self):
-        self.broadcast_discovery = BroadcastDiscovery(BROADCAST_PORT)
-        self.broadcast_discovery.start_discovery(self.current_user.username,
-                                                 self.get_local_ip(),
-                                                 self.tcp_server.port)
-
-    @staticmethod
-    def get_local_ip():
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            s.connect(('8.8.8.8', 1))
-            ip = s.getsockname()[0]
-        except:
-            ip = '127.0.0.1'
-        finally:
-            s.close()
-        return ip
+        self.bridge.post(self._apply_presence)
+
+    def _apply_presence(self):
+        with self._presence_lock:
+            events, self._presence_events = self._presence_events, []
+        if not self.users_view:
+            return
+        for event, user in events:
+            if event == LEAVE:
+                self.users_view.remove(user)
+            else:
+                self.users_view.upsert(user)
 
     def show_users_list(self):
         self.clear_screen()
 
         title_frame = tk.Frame(self.root)
         title_frame.pack(fill=tk.X, padx=10, pady=5)
-        tk.Label(title_frame, text="Онлайн:",
-                 font=("Arial", 12, "bold")).pack(side=tk.LEFT)
+        self.online_label = tk.Label(title_frame, text="Онлайн:",
+                                     font=("Arial", 12, "bold"))
+        self.online_label.pack(side=tk.LEFT)
         tk.Label(title_frame, text=f"Вы: {self.current_user.username}",
                  fg="blue").pack(side=tk.RIGHT)
 
@@ -136,10 +129,20 @@ class ChatApp:
         tk.Button(button_frame, text="Чат", command=self.start_chat,
                   bg="#90EE90").pack(side=tk.LEFT, fill=tk.X, expand=True,
                                      padx=2)
+        tk.Button(button_frame, text="Группа", command=self.start_group,
+                  bg="#ADD8E6").pack(side=tk.LEFT, fill=tk.X, expand=True,
+                                     padx=2)
         tk.Button(button_frame, text="Выход",
                   command=self.show_nickname_screen, bg="#FFB6C1").pack(
             side=tk.LEFT, fill=tk.X, expand=True, padx=2)
 
+        self.search_var = tk.StringVar()
+        search = tk.Entry(self.root, textvariable=self.search_var)
+        search.pack(side=tk.TOP, fill=tk.X, padx=10)
+        self.search_var.trace_add(
+            'write', lambda *_: self.users_view.set_filter(
+                self.search_var.get()))
+
         list_frame = tk.Frame(self.root)
         list_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10,
                         pady=5)
@@ -147,67 +150,92 @@ class ChatApp:
         sb = tk.Scrollbar(list_frame)
         sb.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # Несколько выделенных - участники новой группы
         self.users_listbox = tk.Listbox(list_frame, font=("Arial", 11),
+                                        selectmode=tk.EXTENDED,
                                         yscrollcommand=sb.set)
         self.users_listbox.pack(fill=tk.BOTH, expand=True)
         sb.config(command=self.users_listbox.yview)
         self.users_listbox.bind("<Double-Button-1>",
                                 lambda e: self.start_chat())
 
+        # Список меняется по событиям presence: только вставки и удаления
+        self.users_view = UserListView(self.root, self.users_listbox,
+                                       on_change=self.update_online_label)
         self.update_users_list()
 
     def update_users_list_manual(self):
-        if hasattr(self, 'update_timer'): self.root.after_cancel(
-            self.update_timer)
         self.update_users_list()
 
     def update_users_list(self):
-        try:
-            self.users_listbox.delete(0, tk.END)
-            users = self.broadcast_discovery.get_online_users() if self.broadcast_discovery else []
-
-            if not users:
-                self.users_listbox.insert(tk.END, "Нет пользователей")
-            else:
-                for user in users:
-                    display = f"{user['username']} [{user['ip']}]"
-                    self.users_listbox.insert(tk.END, display)
-
-            if self.is_running:
-                self.update_timer = self.root.after(3000,
-                                                    self.update_users_list)
-        except Exception:
-            pass
+        if self.users_view and self.node:
+            self.users_view.set_users(self.node.online_users())
+            self.update_online_label()
+
+    def update_online_label(self):
+        model = self.users_view.model
+        if not model.total():
+            text = "Онлайн: нет пользователей"
+        elif model.filter_text:
+            text = f"Онлайн: {len(model)} из {model.total()}"
+        else:
+            text = f"Онлайн: {model.total()}"
+        self.online_label.config(text=text)
 
     def start_chat(self):
-        sel = self.users_listbox.curselection()
-        if not sel: return
-        text = self.users_listbox.get(sel[0])
-        if "Нет пользователей" in text: return
-
-        try:
-            username = text.split(" [")[0]
-            full_data = next(
-                (u for u in self.broadcast_discovery.get_online_users()
-                 if u['username'] == username), None)
-            if full_data:
-                target = User(full_data['ip'], full_data['tcp_port'],
-                              username, 0)
-                self.open_chat_window(target)
-        except Exception as e:
-            print(f"Err parsing user: {e}")
-
-    def open_chat_window(self, target_user, incoming_connection=None):
+        # Строка списка сразу отображается на собеседника, без разбора
+        user = self.users_view.selected_user() if self.users_view else None
+        if user:
+            self.open_chat_window(user.to_user())
+
+    def start_group(self):
+        users = self.users_view.selected_users() if self.users_view else []
+        if not users or not self.node:
+            messagebox.showinfo("Группа", "Выделите участников в списке")
+            return
+        name = simpledialog.askstring("Группа", "Название группы:",
+                                      parent=self.root)
+        if not name:
+            return
+        group = self.node.create_group(name.strip(),
+                                       [peer.to_user() for peer in users])
+        self.open_group_window(group)
+
+    def open_group_window(self, group):
+        gw = self.open_groups.get(group.id)
+        if gw:
+            gw.window.deiconify()
+            gw.window.lift()
+            return
+        if not self.node:
+            return
+        gw = GroupWindow(self.root, self.node, self.bridge, group)
+        self.open_groups[group.id] = gw
+        gw.window.protocol("WM_DELETE_WINDOW",
+                           lambda: self.on_group_window_close(group.id))
+
+    def on_group_window_close(self, group_id):
+        gw = self.open_groups.pop(group_id, None)
+        if gw:
+            gw.close()
+
+    def open_chat_window(self, target_user, conversation=None):
         if target_user.username in self.open_chats:
             try:
-                self.open_chats[target_user.username].window.deiconify()
-                self.open_chats[target_user.username].window.lift()
+                cw = self.open_chats[target_user.username]
+                cw.window.deiconify()
+                cw.window.lift()
+                if conversation:
+                    cw.attach(conversation)
                 return
             except:
                 del self.open_chats[target_user.username]
 
-        cw = ChatWindow(self.root, self.current_user, target_user,
-                        incoming_connection)
+        if not self.node:
+            if conversation: conversation.close()
+            return
+        cw = ChatWindow(self.root, self.node, self.bridge, target_user,
+                        conversation)
         self.open_chats[target_user.username] = cw
         cw.window.protocol("WM_DELETE_WINDOW",
                            lambda: self.on_chat_window_close(
@@ -223,8 +251,9 @@ class ChatApp:
 
     def on_closing(self):
         self.is_running = False
-        if self.broadcast_discovery: self.broadcast_discovery.stop()
-        if self.tcp_server: self.tcp_server.close()
+        if self.node: self.node.stop()
+        self.loop_thread.stop()
+        self.bridge.close()
         self.root.destroy()
         import os;
         os._exit(0)  # Принудительное завершение потоков
@@ -1,24 +1,22 @@
 import tkinter as tk
 from tkinter import scrolledtext, filedialog, messagebox
-import threading
-import queue
 import os
+import time
 from datetime import datetime
 
-from network.tcp_client import TCPClient
-from network.protocol import send_json, recv_json, encode_file_data, \
-    decode_file_data
+from gui.history_view import HistoryView, read_history
 
 
 class ChatWindow:
-    def __init__(self, parent, current_user, target_user,
-                 incoming_connection=None):
-        self.current_user = current_user
+    def __init__(self, parent, node, bridge, target_user,
+                 conversation=None):
+        self.node = node
+        self.bridge = bridge
         self.target_user = target_user
-        self.incoming_conn = incoming_connection
-        self.tcp_client = None
+        self.conversation = None
+        # Входящая переписка ждет загрузки истории
+        self._pending = conversation
 
-        self.msg_queue = queue.Queue()
         self.is_alive = True
 
         self.window = tk.Toplevel(parent)
@@ -26,16 +24,21 @@ class ChatWindow:
         self.window.geometry("500x450")
 
         self.create_widgets()
-
-        if self.incoming_conn:
-            self.add_sys_msg(
-                f"Входящее подключение от {target_user.username}")
-            threading.Thread(target=self.rx_loop, args=(self.incoming_conn,),
-                             daemon=True).start()
+        # Переписка подключается после истории: история всегда выше
+        # новых сообщений, а до start() они копятся в переписке
+        if conversation:
+            self.load_history(conversation,
+                              lambda: self._open_incoming(conversation))
         else:
-            self.connect_init()
+            self.load_history(None, self.connect_init)
 
-        self.window.after(100, self.process_queue)
+    def _open_incoming(self, conversation):
+        # attach() из приложения мог успеть раньше с новым соединением
+        if self._pending is not conversation:
+            return
+        self.add_sys_msg(
+            f"Входящее подключение от {self.target_user.username}")
+        self.attach(conversation)
 
     def create_widgets(self):
         self.chat_area = scrolledtext.ScrolledText(self.window,
@@ -48,6 +51,8 @@ class ChatWindow:
         self.chat_area.tag_config('them', foreground='green')
         self.chat_area.tag_config('sys', foreground='gray',
                                   font=("Arial", 9, "italic"))
+        # В виджете только видимая часть истории, остальное - в хранилище
+        self.history = HistoryView(self.chat_area)
 
         # Зона ввода
         frame = tk.Frame(self.window)
@@ -72,175 +77,188 @@ class ChatWindow:
         self.status_lbl.pack(side=tk.BOTTOM, fill=tk.X)
 
     def connect_init(self):
-        def connector():
-            try:
-                client = TCPClient(self.target_user.addr,
-                                   self.target_user.port)
-                client.send_data({'type': 'handshake',
-                                  'username': self.current_user.username})
-
-                self.tcp_client = client
-                self.msg_queue.put(('sys', "Подключено!"))
-                threading.Thread(target=self.rx_loop, args=(client.sock,),
-                                 daemon=True).start()
-            except Exception as e:
-                self.msg_queue.put(('sys', f"Ошибка подключения: {e}"))
-
-        threading.Thread(target=connector, daemon=True).start()
+        future = self.node.connect(self.target_user)
+        future.add_done_callback(
+            lambda f: self._post(self._on_connected, f))
+
+    def _on_connected(self, future):
+        try:
+            conversation = future.result()
+        except Exception as e:
+            self.add_sys_msg(f"Ошибка подключения: {e}")
+            return
+        self.attach(conversation)
+        self.add_sys_msg("Подключено!")
+
+    def attach(self, conversation):
+        # Новое соединение от того же собеседника заменяет старое
+        if conversation is self.conversation:
+            return
+        if self._pending and self._pending is not conversation:
+            self._pending.close()
+        self._pending = None
+        if self.conversation:
+            self.conversation.close()
+        self.conversation = conversation
+
+        # Все события приходят из сетевого цикла и потоков передачи
+        conversation.on_message = lambda text: self._post(
+            self.add_msg, self.target_user.username, text, 'them')
+        conversation.on_file_request = lambda request: self._post(
+            self.handle_file_req, request)
+        conversation.on_file_response = lambda *args: self._post(
+            self.handle_file_resp, *args)
+        conversation.on_transfer_progress = self._on_progress
+        conversation.on_transfer_done = lambda direction, path: self._post(
+            self._transfer_finished, direction, None, path)
+        conversation.on_transfer_error = lambda direction, e: self._post(
+            self._transfer_finished, direction, e, None)
+        conversation.on_disconnect = lambda: self._post(
+            self.add_sys_msg, "Собеседник отключился")
+        conversation.start()
+
+    def _post(self, callback, *args):
+        # После закрытия окна вызовы отбрасываются
+        def call():
+            if self.is_alive:
+                callback(*args)
+        self.bridge.post(call)
 
     def send_text(self, event=None):
         text = self.entry_var.get().strip()
         if not text: return
 
-        payload = {'type': 'msg', 'text': text}
-        if self._send_packet(payload):
+        if self._send('send_text', text):
             self.add_msg("Я", text, 'me')
             self.entry_var.set("")
 
     def req_send_file(self):
+        if not self.conversation or not self.conversation.is_alive:
+            self.add_sys_msg("Нет соединения")
+            return
         path = filedialog.askopenfilename()
         if not path: return
 
-        size = os.path.getsize(path)
-        name = os.path.basename(path)
-
-        payload = {
-            'type': 'file_req',
-            'name': name,
-            'size': size
-        }
-        if self._send_packet(payload):
+        if self._send('send_file', path):
             self.add_sys_msg(
-                f"Ожидание принятия файла: {name} ({size} байт)...")
-            self.pending_file = path
+                f"Ожидание принятия файла: {os.path.basename(path)} "
+                f"({os.path.getsize(path)} байт)...")
 
-    def _send_packet(self, payload):
-        conn = self.incoming_conn or (
-            self.tcp_client.sock if self.tcp_client else None)
-        if not conn:
+    def _send(self, method, *args):
+        if not self.conversation or not self.conversation.is_alive:
             self.add_sys_msg("Нет соединения")
             return False
         try:
-            send_json(conn, payload)
+            getattr(self.conversation, method)(*args)
             return True
         except Exception as e:
             self.add_sys_msg(f"Ошибка отправки: {e}")
-            self.close()
+            self.disconnect()
             return False
 
-    def rx_loop(self, sock):
-        while self.is_alive:
-            try:
-                data = recv_json(sock)  # Используем наш secure protocol
-                if data is None: break
-                self.msg_queue.put(('protocol', data))
-            except:
-                break
-        self.msg_queue.put(('sys', "Собеседник отключился"))
-        self.disconnect()
-
-    def process_queue(self):
-        if not self.is_alive: return
-        try:
-            while True:
-                kind, content = self.msg_queue.get_nowait()
-                if kind == 'sys':
-                    self.add_sys_msg(content)
-                elif kind == 'protocol':
-                    self.handle_packet(content)
-        except queue.Empty:
-            pass
-        self.window.after(100, self.process_queue)
-
-    def handle_packet(self, pkg):
-        ptype = pkg.get('type')
-
-        if ptype == 'msg':
-            self.add_msg(self.target_user.username, pkg['text'], 'them')
-
-        elif ptype == 'file_req':
-            name = pkg['name']
-            size = pkg['size']
+    def handle_file_resp(self, transfer_id, accepted, offset):
+        if not accepted:
+            self.add_sys_msg("Собеседник отклонил передачу файла.")
+        elif offset:
+            self.add_sys_msg(f"Продолжаю отправку с {offset} байт...")
+        else:
+            self.add_sys_msg("Файл принят. Начинаю отправку...")
+
+    def handle_file_req(self, pkg):
+        name = pkg['name']
+        size = pkg['size']
+        chunk_size = pkg.get('chunk_size')
+
+        save_path = None
+        resume_state = self.conversation.find_resumable(pkg)
+        if resume_state:
+            done = min(len(resume_state['hashes']) * chunk_size, size)
+            percent = done * 100 // size if size else 100
+            msg = f"Файл {name} уже получен на {percent}%.\nПродолжить прием?"
+            if messagebox.askyesno("Докачка файла", msg, parent=self.window):
+                save_path = resume_state['path']
+            else:
+                resume_state = None
+
+        if not save_path:
             msg = f"Вам отправляют файл:\n{name}\nРазмер: {size} байт.\nПринять?"
             if messagebox.askyesno("Входящий файл", msg, parent=self.window):
                 save_path = filedialog.asksaveasfilename(initialfile=name)
-                if save_path:
-                    self._send_packet({'type': 'file_resp', 'status': 'ok'})
-                    self.incoming_file_path = save_path
-                    self.incoming_file_size = size
-                    self.received_bytes = 0
-                    self.status_lbl.config(text=f"Прием файла: 0/{size}")
-                else:
-                    self._send_packet({'type': 'file_resp', 'status': 'no'})
-            else:
-                self._send_packet({'type': 'file_resp', 'status': 'no'})
-
-        elif ptype == 'file_resp':
-            if pkg['status'] == 'ok':
-                self.add_sys_msg("Файл принят. Начинаю отправку...")
-                threading.Thread(target=self.worker_send_file,
-                                 args=(self.pending_file,),
-                                 daemon=True).start()
-            else:
-                self.add_sys_msg("Собеседник отклонил передачу файла.")
-
-        elif ptype == 'file_chunk':
-            if hasattr(self, 'incoming_file_path'):
-                chunk = decode_file_data(pkg['data'])
-                with open(self.incoming_file_path, 'ab') as f:
-                    f.write(chunk)
-
-                self.received_bytes += len(chunk)
-                percent = int(
-                    (self.received_bytes / self.incoming_file_size) * 100)
-                self.status_lbl.config(text=f"Загрузка: {percent}%")
-
-                if self.received_bytes >= self.incoming_file_size:
-                    self.status_lbl.config(text="Файл получен!")
-                    self.add_sys_msg(
-                        f"Файл сохранен: {self.incoming_file_path}")
-                    del self.incoming_file_path
-
-    def worker_send_file(self, filepath):
-        try:
-            with open(filepath, 'rb') as f:
-                while True:
-                    chunk = f.read(
-                        4096 * 3)
-                    if not chunk: break
 
-                    b64_chunk = encode_file_data(chunk)
-                    self._send_packet(
-                        {'type': 'file_chunk', 'data': b64_chunk})
+        if not save_path:
+            self._send('decline_file', pkg)
+            return
 
-            self.msg_queue.put(('sys', "Отправка файла завершена"))
-        except Exception as e:
-            self.msg_queue.put(('sys', f"Ошибка чтения/отправки файла: {e}"))
+        try:
+            self.conversation.accept_file(pkg, save_path, resume_state)
+        except OSError as e:
+            self.add_sys_msg(f"Не удалось создать файл: {e}")
+            return
+        self.status_lbl.config(text=f"Прием файла: 0/{size}")
+
+    def _on_progress(self, direction, done, total):
+        label = "Отправка" if direction == 'send' else "Загрузка"
+        percent = done * 100 // total if total else 100
+        self._post(self.set_status, f"{label}: {percent}%")
+
+    def _transfer_finished(self, direction, error, path):
+        if direction == 'send':
+            if error:
+                self.set_status("Ошибка")
+                self.add_sys_msg(f"Ошибка чтения/отправки файла: {error}")
+            else:
+                self.set_status("Готов")
+                self.add_sys_msg("Отправка файла завершена")
+        elif error:
+            self.set_status("Ошибка")
+            self.add_sys_msg(f"Ошибка приема файла: {error}")
+        else:
+            self.set_status("Файл получен!")
+            self.add_sys_msg(f"Файл сохранен: {path}")
+
+    def set_status(self, text):
+        self.status_lbl.config(text=text)
+
+    def load_history(self, conversation=None, on_loaded=None):
+        # Последние сообщения из базы узла. Накопленные переписки до
+        # открытия окна сообщения покажет attach() - их не берем.
+        if not self.node.history:
+            if on_loaded: on_loaded()
+            return
+        before = time.time()
+        if conversation and conversation.backlog_since:
+            before = conversation.backlog_since
+        read_history(self.node.history, self.target_user.username, before,
+                     lambda rows: self._post(self._show_history, rows,
+                                             on_loaded))
+
+    def _show_history(self, rows, on_loaded=None):
+        for row in rows:
+            t = datetime.fromtimestamp(row['ts']).strftime("%H:%M")
+            if row['direction'] == 'out':
+                self.history.append(f"[{t}] Я: {row['text']}", 'me')
+            else:
+                self.history.append(f"[{t}] {row['sender']}: {row['text']}",
+                                    'them')
+        if on_loaded: on_loaded()
 
     def add_msg(self, sender, text, tag):
-        self.chat_area.configure(state='normal')
         t = datetime.now().strftime("%H:%M")
-        self.chat_area.insert(tk.END, f"[{t}] {sender}: {text}\n", tag)
-        self.chat_area.see(tk.END)
-        self.chat_area.configure(state='disabled')
+        self.history.append(f"[{t}] {sender}: {text}", tag)
 
     def add_sys_msg(self, text):
-        self.chat_area.configure(state='normal')
-        self.chat_area.insert(tk.END, f"SYSTEM: {text}\n", 'sys')
-        self.chat_area.see(tk.END)
-        self.chat_area.configure(state='disabled')
+        self.history.append(f"SYSTEM: {text}", 'sys')
 
     def disconnect(self):
-        if self.tcp_client: self.tcp_client.close()
-        if self.incoming_conn:
-            try:
-                self.incoming_conn.close()
-            except:
-                pass
-        self.tcp_client = None
-        self.incoming_conn = None
+        if self.conversation: self.conversation.close()
+        self.conversation = None
 
     def close(self):
+        # Соединение остается в пуле узла для повторного открытия чата
         self.is_alive = False
-        self.disconnect()
+        if self.conversation: self.conversation.release()
+        # Окно закрыто до загрузки истории: переписка снова сможет его открыть
+        elif self._pending: self._pending.release()
+        self.conversation = self._pending = None
+        self.history.close()
         self.window.destroy()
\ No newline at end of file
@@ -0,0 +1,132 @@
+import tkinter as tk
+from tkinter import scrolledtext
+import time
+from datetime import datetime
+
+from gui.history_view import HistoryView, read_history
+
+
+class GroupWindow:
+    # Окно группового чата. Как и у ChatWindow, события группы приходят
+    # из сетевого цикла и пула и перекладываются в поток Tk через bridge.
+    def __init__(self, parent, node, bridge, group):
+        self.node = node
+        self.bridge = bridge
+        self.group = group
+        self.is_alive = True
+
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"Группа {group.name} (Encrypted)")
+        self.window.geometry("500x450")
+
+        self.create_widgets()
+        self.update_members()
+        # Как у ChatWindow: сообщения группы - после истории
+        self.load_history(self.attach)
+
+    def attach(self):
+        group = self.group
+        group.on_message = lambda sender, text: self._post(
+            self.add_msg, sender, text, 'them')
+        group.on_members = lambda: self._post(self.update_members)
+        group.on_member_lag = lambda username, dropped: self._post(
+            self.add_sys_msg,
+            f"{username} не успевает получать сообщения "
+            f"(пропущено {dropped})")
+        group.start()
+
+    def create_widgets(self):
+        self.members_lbl = tk.Label(self.window, anchor=tk.W, fg="gray")
+        self.members_lbl.pack(fill=tk.X, padx=5)
+
+        self.chat_area = scrolledtext.ScrolledText(self.window,
+                                                   state='disabled',
+                                                   wrap=tk.WORD,
+                                                   font=("Arial", 10))
+        self.chat_area.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        self.chat_area.tag_config('me', foreground='blue')
+        self.chat_area.tag_config('them', foreground='green')
+        self.chat_area.tag_config('sys', foreground='gray',
+                                  font=("Arial", 9, "italic"))
+        self.history = HistoryView(self.chat_area)
+
+        frame = tk.Frame(self.window)
+        frame.pack(fill=tk.X, padx=5, pady=5)
+
+        self.entry_var = tk.StringVar()
+        entry = tk.Entry(frame, textvariable=self.entry_var,
+                         font=("Arial", 11))
+        entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        entry.bind("<Return>", self.send_text)
+
+        tk.Button(frame, text="Отпр.", command=self.send_text,
+                  bg="#DDDDDD").pack(side=tk.LEFT, padx=5)
+        tk.Button(frame, text="Выйти", command=self.leave,
+                  bg="#FFB6C1").pack(side=tk.LEFT)
+
+    def _post(self, callback, *args):
+        def call():
+            if self.is_alive:
+                callback(*args)
+        self.bridge.post(call)
+
+    def send_text(self, event=None):
+        text = self.entry_var.get().strip()
+        if not text: return
+        try:
+            future = self.group.send_text(text)
+        except Exception as e:
+            self.add_sys_msg(f"Ошибка отправки: {e}")
+            return
+        # Шифрование и ожидание отстающих - не в потоке Tk
+        future.add_done_callback(self._on_sent)
+        self.add_msg("Я", text, 'me')
+        self.entry_var.set("")
+
+    def _on_sent(self, future):
+        error = None if future.cancelled() else future.exception()
+        if error:
+            self._post(self.add_sys_msg, f"Ошибка отправки: {error}")
+
+    def leave(self):
+        self.group.leave()
+        self.add_sys_msg("Вы вышли из группы")
+
+    def update_members(self):
+        names = ', '.join(self.group.usernames()) or "никого"
+        self.members_lbl.config(text=f"Участники: {names}")
+
+    def load_history(self, on_loaded):
+        # Как у ChatWindow: накопленное до открытия окна покажет start()
+        if not self.node.history:
+            on_loaded()
+            return
+        before = self.group.backlog_since or time.time()
+        read_history(self.node.history, self.group.history_key, before,
+                     lambda rows: self._post(self._show_history, rows,
+                                             on_loaded))
+
+    def _show_history(self, rows, on_loaded):
+        for row in rows:
+            t = datetime.fromtimestamp(row['ts']).strftime("%H:%M")
+            if row['direction'] == 'out':
+                self.history.append(f"[{t}] Я: {row['text']}", 'me')
+            else:
+                self.history.append(f"[{t}] {row['sender']}: {row['text']}",
+                                    'them')
+        on_loaded()
+
+    def add_msg(self, sender, text, tag):
+        t = datetime.now().strftime("%H:%M")
+        self.history.append(f"[{t}] {sender}: {text}", tag)
+
+    def add_sys_msg(self, text):
+        self.history.append(f"SYSTEM: {text}", 'sys')
+
+    def close(self):
+        # Группа остается: новое сообщение снова откроет окно
+        self.is_alive = False
+        self.group.release()
+        self.history.close()
+        self.window.destroy()
@@ -0,0 +1,176 @@
+import threading
+import tkinter as tk
+from collections import deque
+
+from utils.constans import HISTORY_PRELOAD
+
+# Сколько строк истории держит виджет и сколько подгружается за раз при
+# прокрутке. Остальное - только в хранилище.
+HISTORY_WINDOW = 500
+HISTORY_PAGE = 200
+# Сколько последних сообщений окна чата помнится в памяти
+HISTORY_MEMORY_LIMIT = 100000
+# Доля прокрутки у края, после которой подгружается следующая страница
+EDGE = 0.05
+
+
+class MemoryHistory:
+    # Хранилище строк окна чата: (текст, тег) с номерами от начала
+    # переписки. Старые строки сверх limit забываются.
+    def __init__(self, limit=HISTORY_MEMORY_LIMIT):
+        self._lines = deque(maxlen=limit)
+        self._count = 0
+
+    def append(self, text, tag):
+        self._lines.append((text, tag))
+        self._count += 1
+        return self._count - 1
+
+    def count(self):
+        return self._count
+
+    def first_index(self):
+        # Номер самой старой строки, которая еще хранится
+        return self._count - len(self._lines)
+
+    def range(self, start, stop):
+        offset = self.first_index()
+        start = max(start, offset)
+        return [self._lines[i - offset] for i in range(start, stop)]
+
+
+class HistoryView:
+    # Виртуализированная история поверх Text: в виджете только окно из
+    # HISTORY_WINDOW строк (плюс страница запаса), остальное подгружается
+    # из хранилища при прокрутке к краю. Новые строки копятся и
+    # вставляются одним вызовом за тик цикла Tk.
+    def __init__(self, text, store=None, window=HISTORY_WINDOW,
+                 page=HISTORY_PAGE):
+        self.text = text
+        self.store = store or MemoryHistory()
+        self.window = window
+        self.page = page
+        # Строки хранилища [first, last) сейчас в виджете
+        self.first = self.last = self.store.count()
+        self._pending = 0
+        self._flush_id = None
+        self._check_id = None
+
+        self._scroll_set = text.cget('yscrollcommand')
+        text.configure(yscrollcommand=self._on_scroll)
+
+    def append(self, line, tag):
+        self.store.append(line, tag)
+        self._pending += 1
+        if self._flush_id is None:
+            self._flush_id = self.text.after_idle(self.flush)
+
+    def flush(self):
+        self._flush_id = None
+        count, self._pending = self._pending, 0
+        if not count:
+            return
+        # Пользователь читает старые сообщения: не двигаем окно, новые
+        # подгрузятся при прокрутке вниз
+        if self.last + count < self.store.count() or not self._at_bottom():
+            return
+        stop = self.store.count()
+        if stop - self.last > self.window:
+            # Поток сообщений больше окна: промежуточные в виджет не идут
+            self.text.configure(state='normal')
+            self.text.delete('1.0', tk.END)
+            self.text.configure(state='disabled')
+            self.first = self.last = stop - self.window
+        self._insert_end(stop)
+        self._trim_top()
+        self.text.see(tk.END)
+
+    def _at_bottom(self):
+        return self.text.yview()[1] >= 1.0 - 1e-6
+
+    def _insert_end(self, stop):
+        lines = self.store.range(self.last, stop)
+        if not lines:
+            return
+        args = []
+        for line, tag in lines:
+            args += (line + "\n", tag)
+        self.text.configure(state='normal')
+        self.text.insert(tk.END + '-1c', *args)
+        self.text.configure(state='disabled')
+        self.last = stop
+
+    def _insert_start(self, start):
+        start = max(start, self.store.first_index())
+        lines = self.store.range(start, self.first)
+        if not lines:
+            return 0
+        args = []
+        for line, tag in lines:
+            args += (line + "\n", tag)
+        self.text.configure(state='normal')
+        self.text.insert('1.0', *args)
+        self.text.configure(state='disabled')
+        self.first = start
+        return len(lines)
+
+    def _trim_top(self):
+        extra = self.last - self.first - self.window - self.page
+        if extra > 0:
+            self.text.configure(state='normal')
+            self.text.delete('1.0', f'{extra + 1}.0')
+            self.text.configure(state='disabled')
+            self.first += extra
+
+    def _trim_bottom(self):
+        extra = self.last - self.first - self.window - self.page
+        if extra > 0:
+            keep = self.last - self.first - extra
+            self.text.configure(state='normal')
+            self.text.delete(f'{keep + 1}.0', tk.END + '-1c')
+            self.text.configure(state='disabled')
+            self.last -= extra
+
+    def _on_scroll(self, top, bottom):
+        if self._scroll_set:
+            self.text.tk.call(self._scroll_set, top, bottom)
+        # Подгрузка меняет виджет и снова вызывает yscrollcommand
+        if self._check_id is None:
+            self._check_id = self.text.after_idle(self._check_edges)
+
+    def _check_edges(self):
+        self._check_id = None
+        top, bottom = self.text.yview()
+        if top <= EDGE and self.first > self.store.first_index():
+            # Видимая строка остается на месте после вставки сверху
+            line = int(self.text.index('@0,0').split('.')[0])
+            added = self._insert_start(self.first - self.page)
+            self._trim_bottom()
+            self.text.yview(f'{line + added}.0')
+        elif bottom >= 1.0 - EDGE and self.last < self.store.count():
+            line = int(self.text.index('@0,0').split('.')[0])
+            before = self.first
+            self._insert_end(min(self.last + self.page, self.store.count()))
+            self._trim_top()
+            self.text.yview(f'{line - (self.first - before)}.0')
+
+    def close(self):
+        for after_id in (self._flush_id, self._check_id):
+            if after_id is not None:
+                self.text.after_cancel(after_id)
+        self._flush_id = self._check_id = None
+
+
+def read_history(store, peer, before, on_rows):
+    # Последние HISTORY_PRELOAD сообщений до before - в отдельном потоке:
+    # flush() ждет записи до секунды, а поток Tk ждать не должен.
+    # on_rows(rows) вызывается в этом потоке, передавать в Tk - вызывающему.
+    def read():
+        try:
+            store.flush(1.0)
+            rows = store.page(peer, before, 0, HISTORY_PRELOAD)
+        except Exception as e:
+            print(f"Ошибка чтения истории: {e}")
+            rows = []
+        on_rows(rows)
+    threading.Thread(target=read, daemon=True).start()
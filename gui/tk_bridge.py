@@ -0,0 +1,118 @@
+import os
+import time
+import queue
+import threading
+import tkinter as tk
+
+from utils import metrics
+
+# Запасной опрос очереди, если разбудить Tk из другого потока нечем, мс
+POLL_INTERVAL = 50
+# Сколько времени поток Tk может выполнять вызовы подряд, не давая
+# перерисовать окна, с. Остаток очереди - после перерисовки.
+DRAIN_BUDGET = 0.010
+WAKE_EVENT = '<<BridgeWake>>'
+
+
+class TkBridge:
+    # Tk можно трогать только из его потока: цикл asyncio и рабочие потоки
+    # кладут сюда вызовы, а Tk выполняет их у себя. Tk будится сразу:
+    # байтом в self-pipe, за которым следит createfilehandler (POSIX), или
+    # виртуальным событием (Windows). Пока Tk не забрал очередь, повторные
+    # post() его не будят.
+    def __init__(self, root, budget=DRAIN_BUDGET):
+        self.root = root
+        self.budget = budget
+        self._calls = queue.Queue()
+        self._signaled = False
+        self._signal_lock = threading.Lock()
+        self._drain_id = None
+        self._pipe = None
+        self._untrack = metrics.UI_QUEUE.track(self._calls.qsize)
+
+        if hasattr(root.tk, 'createfilehandler'):
+            self._pipe = os.pipe()
+            os.set_blocking(self._pipe[0], False)
+            os.set_blocking(self._pipe[1], False)
+            root.tk.createfilehandler(self._pipe[0], tk.READABLE,
+                                      self._on_pipe)
+            self._wake = self._wake_pipe
+        else:
+            root.bind(WAKE_EVENT, lambda e: self._schedule())
+            self._wake = self._wake_event
+            # event_generate из чужого потока не работает, пока не запущен
+            # mainloop: на этот случай остается и редкий опрос
+            self.root.after(POLL_INTERVAL, self._poll)
+
+    def post(self, callback, *args):
+        # Потокобезопасно и не блокирует вызывающий поток
+        self._calls.put((callback, args))
+        with self._signal_lock:
+            if self._signaled:
+                return
+            self._signaled = True
+        self._wake()
+
+    def _wake_pipe(self):
+        pipe = self._pipe
+        if pipe is None:
+            return
+        try:
+            os.write(pipe[1], b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Канал полон (Tk и так разбужен) или уже закрыт
+
+    def _wake_event(self):
+        try:
+            self.root.event_generate(WAKE_EVENT, when='tail')
+        except (RuntimeError, tk.TclError):
+            pass  # mainloop еще не запущен или окно закрыто
+
+    def _on_pipe(self, fd, mask):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        self._schedule()
+
+    def _poll(self):
+        self._schedule()
+        self.root.after(POLL_INTERVAL, self._poll)
+
+    def _schedule(self):
+        if self._drain_id is None:
+            self._drain_id = self.root.after_idle(self._drain)
+
+    def _drain(self):
+        self._drain_id = None
+        with self._signal_lock:
+            self._signaled = False
+        start = time.perf_counter()
+        deadline = start + self.budget
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    callback, args = self._calls.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Ошибка обработчика GUI: {e}")
+            # Бюджет кадра исчерпан: остаток после перерисовки
+            self._drain_id = self.root.after(1, self._drain)
+        finally:
+            if metrics.enabled:
+                metrics.UI_DRAIN.observe(time.perf_counter() - start)
+
+    def close(self):
+        self._untrack()
+        if self._drain_id is not None:
+            self.root.after_cancel(self._drain_id)
+            self._drain_id = None
+        if self._pipe:
+            self.root.tk.deletefilehandler(self._pipe[0])
+            for fd in self._pipe:
+                os.close(fd)
+            self._pipe = None
@@ -0,0 +1,192 @@
+import time
+import bisect
+import tkinter as tk
+from collections import deque
+
+# Сколько времени UI-поток может тратить на список за один кадр, с
+FRAME_BUDGET = 0.016
+
+
+def _sort_key(peer):
+    return peer.username.lower(), peer.ip, peer.key
+
+
+def display(peer):
+    return f"{peer.username} [{peer.ip}]"
+
+
+class UserListModel:
+    # Модель списка собеседников без Tk: хранит всех известных и видимые
+    # строки (с учетом поиска) в порядке сортировки. Каждое изменение
+    # возвращает операции ('delete', индекс) / ('insert', индекс, текст),
+    # которые переводят прежний список в новый; применять их по порядку.
+    def __init__(self):
+        self._users = {}  # ключ -> Peer
+        self._rows = []  # видимые: отсортированные _sort_key
+        self.filter_text = ""
+
+    def matches(self, user):
+        return not self.filter_text or \
+            self.filter_text in display(user).lower()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def total(self):
+        return len(self._users)
+
+    def user_at(self, index):
+        if 0 <= index < len(self._rows):
+            return self._users[self._rows[index][2]]
+        return None
+
+    def index_of(self, key):
+        user = self._users.get(key)
+        if user is None:
+            return None
+        row = _sort_key(user)
+        index = bisect.bisect_left(self._rows, row)
+        if index < len(self._rows) and self._rows[index] == row:
+            return index
+        return None
+
+    def upsert(self, user):
+        key = user.key
+        if key in self._users:
+            # Текст строки зависит только от ключа: меняем данные на месте
+            self._users[key] = user
+            return []
+        ops = []
+        self._users[key] = user
+        if self.matches(user):
+            row = _sort_key(user)
+            index = bisect.bisect_left(self._rows, row)
+            self._rows.insert(index, row)
+            ops.append(('insert', index, display(user)))
+        return ops
+
+    def remove(self, key):
+        index = self.index_of(key)
+        self._users.pop(key, None)
+        if index is None:
+            return []
+        del self._rows[index]
+        return [('delete', index)]
+
+    def set_users(self, users):
+        # Полный список (кнопка "Обновить"): только разница
+        fresh = {u.key: u for u in users}
+        ops = []
+        for key in [k for k in self._users if k not in fresh]:
+            ops += self.remove(key)
+        for user in fresh.values():
+            ops += self.upsert(user)
+        return ops
+
+    def set_filter(self, text):
+        # Слияние двух отсортированных списков: удаления и вставки только
+        # там, где строки различаются
+        self.filter_text = text.strip().lower()
+        new_rows = sorted(_sort_key(u) for u in self._users.values()
+                          if self.matches(u))
+        ops = []
+        index = old_pos = new_pos = 0
+        old_rows = self._rows
+        while old_pos < len(old_rows) or new_pos < len(new_rows):
+            old = old_rows[old_pos] if old_pos < len(old_rows) else None
+            new = new_rows[new_pos] if new_pos < len(new_rows) else None
+            if old == new:
+                index += 1
+                old_pos += 1
+                new_pos += 1
+            elif new is None or (old is not None and old < new):
+                ops.append(('delete', index))
+                old_pos += 1
+            else:
+                ops.append(('insert', index,
+                            display(self._users[new[2]])))
+                index += 1
+                new_pos += 1
+        self._rows = new_rows
+        return ops
+
+
+class UserListView:
+    # Применяет операции модели к Listbox не дольше FRAME_BUDGET за кадр;
+    # остаток - в следующем кадре. Выделение Listbox привязано к строке,
+    # поэтому вставки и удаления вокруг него его не сбрасывают.
+    def __init__(self, root, listbox, model=None, on_change=None):
+        self.root = root
+        self.listbox = listbox
+        self.model = model if model is not None else UserListModel()
+        self.on_change = on_change
+        self._ops = deque()
+        self._scheduled = None
+
+    def apply(self, ops):
+        if not ops:
+            if not self._ops and self.on_change:
+                self.on_change()
+            return
+        self._ops.extend(ops)
+        if self._scheduled is None:
+            self._scheduled = self.root.after_idle(self._drain)
+
+    def _drain(self, budget=FRAME_BUDGET):
+        self._scheduled = None
+        deadline = time.perf_counter() + budget
+        ops = self._ops
+        try:
+            while ops and time.perf_counter() < deadline:
+                # Подряд идущие вставки - одним вызовом Tcl
+                op = ops.popleft()
+                if op[0] == 'delete':
+                    self.listbox.delete(op[1])
+                    continue
+                index, items = op[1], [op[2]]
+                while ops and ops[0][0] == 'insert' and \
+                        ops[0][1] == index + len(items) and len(items) < 256:
+                    items.append(ops.popleft()[2])
+                self.listbox.insert(index, *items)
+        except tk.TclError:
+            ops.clear()  # Список уже уничтожен
+            return
+        if ops:
+            self._scheduled = self.root.after(1, self._drain)
+        elif self.on_change:
+            self.on_change()
+
+    def _sync(self):
+        # Пока очередь не применена, индексы Listbox и модели расходятся
+        if self._ops:
+            if self._scheduled is not None:
+                self.root.after_cancel(self._scheduled)
+            self._drain(budget=float('inf'))
+
+    def selected_user(self):
+        self._sync()
+        sel = self.listbox.curselection()
+        return self.model.user_at(sel[0]) if sel else None
+
+    def selected_users(self):
+        self._sync()
+        return [self.model.user_at(index)
+                for index in self.listbox.curselection()]
+
+    def upsert(self, user):
+        self.apply(self.model.upsert(user))
+
+    def remove(self, user):
+        self.apply(self.model.remove(user.key))
+
+    def set_users(self, users):
+        self.apply(self.model.set_users(users))
+
+    def set_filter(self, text):
+        self.apply(self.model.set_filter(text))
+
+    def cancel(self):
+        if self._scheduled is not None:
+            self.root.after_cancel(self._scheduled)
+            self._scheduled = None
+        self._ops.clear()
@@ -1,5 +1,9 @@
 from gui.app import ChatApp
+from utils import metrics
+from utils.constans import METRICS_PORT
 
 if __name__ == "__main__":
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
     app = ChatApp()
     app.run()
\ No newline at end of file
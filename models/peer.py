@@ -0,0 +1,72 @@
+import sys
+import socket
+import struct
+
+from models.user import User
+
+_IPV4 = struct.Struct('>I')
+
+
+def pack_ip(ip):
+    # IPv4 - одно int вместо строки; остальное (имя хоста) - как есть
+    try:
+        return _IPV4.unpack(socket.inet_aton(ip))[0]
+    except (OSError, TypeError):
+        return ip
+
+
+def unpack_ip(packed):
+    if isinstance(packed, int):
+        return socket.inet_ntoa(_IPV4.pack(packed))
+    return packed
+
+
+def peer_key(username, ip):
+    # Ключ собеседника: (имя, упакованный IP); имена интернированы, так
+    # что одинаковые имена из разных пакетов - один объект
+    return sys.intern(username), pack_ip(ip)
+
+
+def addr_key(packed_ip, tcp_port):
+    # (ip, порт) TCP-сервера одним int
+    if isinstance(packed_ip, int):
+        return packed_ip << 16 | tcp_port
+    return packed_ip, tcp_port
+
+
+class Peer:
+    # Запись о собеседнике в сети: без __dict__, имя интернировано, IPv4
+    # хранится числом. Одна и та же запись идет из обнаружения в
+    # подписчики presence, GUI и базу - без промежуточных dict.
+    __slots__ = ('key', 'tcp_port', 'version', 'last_seen', 'timeout',
+                 'expires', 'gossip', 'source', 'heap_id', 'queued')
+
+    def __init__(self, key, tcp_port, version=None):
+        self.key = key
+        self.tcp_port = tcp_port
+        self.version = version
+        self.last_seen = 0.0
+        self.timeout = 0.0
+        self.expires = 0.0
+        self.gossip = False  # известен только со слов опорного узла
+        self.source = None  # адрес последнего объявления
+        self.heap_id = None  # номер записи в куче сроков PresenceRegistry
+        self.queued = 0.0  # срок, с которым запись стоит в этой куче
+
+    @property
+    def username(self):
+        return self.key[0]
+
+    @property
+    def ip(self):
+        return unpack_ip(self.key[1])
+
+    @property
+    def addr_key(self):
+        return addr_key(self.key[1], self.tcp_port)
+
+    def to_user(self):
+        return User(self.ip, self.tcp_port, self.username, 0)
+
+    def __repr__(self):
+        return f"Peer({self.username}, {self.ip}:{self.tcp_port})"
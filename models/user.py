@@ -1,4 +1,6 @@
 class User:
+    __slots__ = ('id', 'username', 'addr', 'port')
+
     def __init__(self, addr: str, port: int, username: str, id: int):
         self.id = id
         self.username = username
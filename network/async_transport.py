@@ -0,0 +1,663 @@
+import time
+import socket
+import struct
+import asyncio
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from network.protocol import encode_json, encode_file_chunk, decode_frame
+from network.connection import make_handshake, make_handshake_ack, \
+    session_from_ack
+from utils.constans import TCP_PORT, TCP_BACKLOG, CRYPTO_WORKERS, \
+    MAX_FRAME_SIZE, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_COUNT, \
+    WRITE_COALESCE_DELAY
+from utils import metrics
+
+# Сколько кадров одного соединения может ждать пула шифрования. При
+# отправке дальше ждет вызывающий поток, при приеме - чтение из сокета.
+PIPELINE_DEPTH = 256
+# Столько задач подряд выполняет одна очередь, прежде чем уступить поток
+# пула другим соединениям
+LANE_BATCH = 64
+# Буфер StreamReader: меньше пауз чтения на кусках файлов
+READ_LIMIT = 1024 * 1024
+CONNECT_TIMEOUT = 10
+# Накопленные кадры отправляются сразу, не дожидаясь задержки
+COALESCE_MAX_BYTES = 64 * 1024
+# Выше этого объема в очереди send_json ждет разгрузки сокета
+WRITE_BUFFER_LIMIT = 1024 * 1024
+
+
+class EventLoopThread:
+    # Один цикл asyncio на все соединения. Потоки остаются только в пуле
+    # для шифрования и у передачи файлов (диск).
+    def __init__(self, workers=CRYPTO_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='crypto')
+        self.loop.set_default_executor(self.executor)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self):
+        return threading.current_thread() is self._thread
+
+    def run(self, coro):
+        # Из любого потока; возвращает concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro, timeout=None):
+        return self.run(coro).result(timeout)
+
+    def connect(self, host, port, username, wait_ack=True, **extra):
+        # Блокирующее подключение для рабочих потоков (потоки данных файлов)
+        return self.call(open_connection(self, host, port, username,
+                                         wait_ack, **extra),
+                         CONNECT_TIMEOUT)
+
+    def stop(self):
+        try:
+            self.call(self._cancel_tasks(), timeout=1)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1)
+        self.executor.shutdown(wait=False)
+
+    async def _cancel_tasks(self):
+        # Циклы чтения закрывают свои соединения в finally
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_worker = threading.local()
+
+
+class SerialLane:
+    # Очередь задач одного соединения на общем пуле потоков: задачи идут
+    # строго по порядку и не больше одной сразу, а разные соединения
+    # шифруют параллельно (cryptography отпускает GIL).
+    def __init__(self, executor, on_error=None):
+        self._executor = executor
+        # on_error(e) - исключение задачи из post(): очередь идет дальше,
+        # а владелец решает, жить ли соединению
+        self.on_error = on_error
+        self._tasks = collections.deque()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        # Результат или исключение задачи - в возвращаемом Future
+        future = Future()
+        self._push(future, function, args)
+        return future
+
+    def post(self, function, *args):
+        # Без Future: ошибки функции уходят в on_error
+        self._push(None, function, args)
+
+    def _push(self, future, function, args):
+        with self._lock:
+            self._tasks.append((future, function, args))
+            if self._running:
+                return
+            self._running = True
+        try:
+            self._executor.submit(self._run)
+        except RuntimeError:  # Пул уже остановлен
+            with self._lock:
+                self._running = False
+            raise
+
+    def _run(self):
+        _worker.active = True
+        try:
+            for _ in range(LANE_BATCH):
+                with self._lock:
+                    if not self._tasks:
+                        self._running = False
+                        return
+                    future, function, args = self._tasks.popleft()
+                if future is None:
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        self._failed(e)
+                    continue
+                try:
+                    future.set_result(function(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            _worker.active = False
+        # Очередь не пуста: продолжим после задач других соединений
+        try:
+            self._executor.submit(self._run)
+        except RuntimeError:
+            with self._lock:
+                self._running = False
+
+
+    def _failed(self, error):
+        print(f"Ошибка в очереди соединения: {error!r}")
+        if self.on_error:
+            try:
+                self.on_error(error)
+            except Exception as e:
+                print(f"Ошибка в очереди соединения: {e!r}")
+
+
+def _in_worker():
+    return getattr(_worker, 'active', False)
+
+
+class AsyncConnection:
+    # Интерфейс совпадает с Connection: send_* можно вызывать из любого
+    # потока, входящие пакеты приходят в on_packet из start_reading.
+    def __init__(self, reader, writer, loop_thread,
+                 coalesce_delay=WRITE_COALESCE_DELAY):
+        self.reader = reader
+        self.writer = writer
+        self.loop_thread = loop_thread
+        self.session = None
+        self.compression = None
+        self.codec = None
+        # Порядок кадров важен для счетчика сессии: кодируем и ставим
+        # в очередь записи под одной блокировкой
+        self.send_lock = threading.Lock()
+        self._client_nonce = None
+        self._task = None
+        # Сериализация и шифрование (и обратно) - в пуле цикла, по порядку
+        # кадров этого соединения; вызывающий поток только ставит задачу
+        self._lane = SerialLane(loop_thread.executor, self._lane_failed)
+        self._send_slots = threading.Semaphore(PIPELINE_DEPTH)
+        self._broken = False
+        # Ошибка кодирования или записи в очереди: send_json узнает о ней
+        # при следующем вызове
+        self._send_error = None
+        # Принятые кадры: _posted меняет только цикл, _handled - только
+        # очередь, поэтому разность читается без блокировки
+        self._posted = 0
+        self._handled = 0
+        self._lane_waiter = None
+        # pause_reading(): обработчик не успевает (запись файла на диск),
+        # чтение сокета ждет resume_reading(), а TCP тормозит собеседника
+        self._read_paused = False
+        self._resume_waiter = None
+        # time.monotonic() последнего принятого или отправленного кадра:
+        # по нему пул закрывает простаивающие соединения
+        self.last_activity = time.monotonic()
+
+        # Очередь записи: мелкие кадры, пришедшие в пределах
+        # coalesce_delay секунд, уходят одним системным вызовом.
+        # None - писать каждый кадр сразу.
+        self.coalesce_delay = coalesce_delay
+        # Кадры из других потоков: цикл будится один раз на пачку
+        self._outbox = collections.deque()
+        self._outbox_scheduled = False
+        self._pending = []
+        self._pending_size = 0
+        self._flush_handle = None
+        self._last_flush = 0.0
+        self._sock = writer.get_extra_info('socket')
+        _set_nodelay(self._sock)
+        peername = writer.get_extra_info('peername')
+        self._peer = peername[0] if peername else '?'
+
+    @property
+    def peername(self):
+        return self.writer.get_extra_info('peername')
+
+    def send_json(self, data_dict):
+        # data_dict нельзя менять после вызова: кодируется он позже
+        if self._send_error:
+            raise ConnectionError(
+                f"Ошибка отправки: {self._send_error}") from self._send_error
+        if self.writer.is_closing():
+            raise ConnectionError("Соединение закрыто")
+        # Цикл и потоки пула не ждут места: их задачи и освобождают его
+        wait = not self.loop_thread.in_loop() and not _in_worker()
+        if wait:
+            self._send_slots.acquire()
+        self._lane.post(self._encode_json, data_dict, wait)
+        # Сообщения не ждут отправки, пока очередь записи не переполнена
+        if self._buffered() > WRITE_BUFFER_LIMIT:
+            self._wait_drain()
+
+    def _encode_json(self, data_dict, release):
+        try:
+            with self.send_lock:
+                frame = encode_json(data_dict, self.session, self.compression,
+                                    self.codec)
+                self._write(frame)
+        except Exception as e:
+            print(f"Ошибка протокола (send): {e}")
+            # Кадр потерян: дальше соединению верить нельзя
+            if not self._send_error:
+                self._send_error = e
+                self.close()
+        finally:
+            if release:
+                self._send_slots.release()
+
+    def send_file_chunk(self, binary_data, transfer_id=0, offset=0,
+                        compress=True):
+        # Тоже через очередь соединения, чтобы не обогнать send_json.
+        # Ошибки (закрытое соединение) - вызывающему.
+        self._lane.submit(self._encode_chunk, binary_data, transfer_id,
+                          offset, compress).result()
+        # Поток передачи ждет, пока буфер сокета не разгрузится:
+        # так передача файла не раздувает память
+        self._wait_drain()
+
+    def _encode_chunk(self, binary_data, transfer_id, offset, compress):
+        with self.send_lock:
+            frame = encode_file_chunk(binary_data, self.session, transfer_id,
+                                      offset,
+                                      self.compression if compress else None)
+            self._write(frame)
+
+    async def write_frames(self, frames):
+        # Готовые кадры (групповые уже зашифрованы) - из цикла, в общей
+        # очереди соединения после отправленных раньше пакетов. Ждет,
+        # пока сокет не разгрузится: так медленный собеседник задерживает
+        # только свою очередь.
+        await asyncio.wrap_future(self._lane.submit(self._write_frames,
+                                                    frames))
+        if self._buffered() > WRITE_BUFFER_LIMIT:
+            await self._drain()
+
+    def _write_frames(self, frames):
+        with self.send_lock:
+            for frame in frames:
+                self._write(frame)
+
+    def _write(self, frame):
+        if self.writer.is_closing():
+            raise ConnectionError("Соединение закрыто")
+        # Вызывается под send_lock. Буфер сессии переиспользуется, поэтому
+        # в цикл уходит копия. Даже из потока цикла кадр идет через outbox:
+        # иначе он обгонит кадры, закодированные раньше в других потоках.
+        self._outbox.append(bytes(frame))
+        if not self._outbox_scheduled:
+            self._outbox_scheduled = True
+            self.loop_thread.loop.call_soon_threadsafe(self._take_outbox)
+
+    def _take_outbox(self):
+        # Флаг сбрасывается до разбора: кадр, добавленный во время разбора,
+        # либо попадет в эту пачку, либо запланирует следующую
+        self._outbox_scheduled = False
+        while self._outbox:
+            self._enqueue(self._outbox.popleft())
+
+    def _buffered(self):
+        # Приблизительно: читается без блокировки из чужого потока
+        return self._pending_size + \
+            self.writer.transport.get_write_buffer_size()
+
+    def _wait_drain(self):
+        if self.loop_thread.in_loop():
+            return
+        self.loop_thread.run(self._drain()).result()
+
+    async def _drain(self):
+        self._take_outbox()
+        self._flush()
+        if self.writer.is_closing():
+            raise ConnectionError("Соединение закрыто")
+        await self.writer.drain()
+
+    def _enqueue(self, frame):
+        # В потоке цикла
+        self.last_activity = time.monotonic()
+        self._pending.append(frame)
+        self._pending_size += len(frame)
+        if self.coalesce_delay is None or \
+                self._pending_size >= COALESCE_MAX_BYTES:
+            self._flush()
+            return
+        if self._flush_handle:
+            return
+
+        # Как алгоритм Нейгла, но с ограничением задержки: одиночное
+        # сообщение уходит сразу, а в серии ждет не дольше coalesce_delay
+        loop = self.loop_thread.loop
+        wait = self._last_flush + self.coalesce_delay - loop.time()
+        if wait > 0:
+            self._flush_handle = loop.call_later(wait, self._flush)
+        else:
+            self._flush_handle = loop.call_soon(self._flush)
+
+    def _flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        frames, self._pending = self._pending, []
+        self._pending_size = 0
+        self._last_flush = self.loop_thread.loop.time()
+        if self.writer.is_closing():
+            return
+        if metrics.enabled:
+            metrics.BYTES_OUT.inc(sum(map(len, frames)), self._peer)
+
+        if len(frames) == 1:
+            self.writer.write(frames[0])
+            return
+        # TCP_CORK не дает ядру отправить неполный сегмент посреди пачки
+        _set_cork(self._sock, True)
+        try:
+            self.writer.writelines(frames)
+        finally:
+            _set_cork(self._sock, False)
+
+    async def write_json(self, data_dict):
+        with self.send_lock:
+            frame = encode_json(data_dict, self.session, self.compression,
+                                self.codec)
+            self._write(frame)
+        await self._drain()
+
+    async def _read_frame(self):
+        try:
+            header = await self.reader.readexactly(4)
+            length = struct.unpack('>I', header)[0]
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"Кадр слишком большой: {length} байт")
+            frame = await self.reader.readexactly(length)
+            if metrics.enabled:
+                metrics.BYTES_IN.inc(length + 4, self._peer)
+            return frame
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def read_packet(self):
+        # Для рукопожатия, пока start_reading еще не запущен
+        try:
+            frame = await self._read_frame()
+            if frame is None:
+                return None
+            return decode_frame(frame, self.session, self.compression,
+                                self.codec)
+        except Exception as e:
+            print(f"Ошибка протокола (recv): {e}")
+            return None
+
+    async def start_handshake(self, username, **extra):
+        handshake, self._client_nonce = make_handshake(username, **extra)
+        await self.write_json(handshake)
+
+    async def wait_handshake(self):
+        data = await self.read_packet()
+        if not data or data.get('type') != 'handshake_ack':
+            raise ConnectionError("Сервер не подтвердил рукопожатие")
+        self._finish_handshake(data)
+
+    async def accept_handshake(self, handshake):
+        result = make_handshake_ack(handshake)
+        if not result:
+            return
+
+        ack, session, compressor, codec = result
+        await self.write_json(ack)
+        with self.send_lock:
+            self.session = session
+            self.compression = compressor
+            self.codec = codec
+
+    def _finish_handshake(self, ack):
+        with self.send_lock:
+            self.session, self.compression, self.codec = session_from_ack(
+                ack, self._client_nonce)
+        self._client_nonce = None
+
+    def start_reading(self, on_packet, on_close=None):
+        # Можно вызывать из любого потока
+        def start():
+            self._task = self.loop_thread.loop.create_task(
+                self._read_loop(on_packet, on_close))
+
+        if self.loop_thread.in_loop():
+            start()
+        else:
+            self.loop_thread.loop.call_soon_threadsafe(start)
+
+    async def _read_loop(self, on_packet, on_close):
+        # Расшифровка и обработчик - в очереди соединения на пуле: порядок
+        # кадров (и счетчик сессии) сохраняется, а цикл читает дальше.
+        # Больше PIPELINE_DEPTH кадров в очереди - чтение ждет.
+        try:
+            while not self._broken:
+                frame = await self._read_frame()
+                if frame is None:
+                    break
+                self.last_activity = time.monotonic()
+                self._posted += 1
+                self._lane.post(self._dispatch, frame, on_packet)
+                if self._posted - self._handled >= PIPELINE_DEPTH:
+                    await self._wait_lane(PIPELINE_DEPTH - 1)
+                if self._read_paused:
+                    await self._wait_resume()
+            # on_close - только после обработки всего принятого
+            await self._wait_lane(0)
+        except (ConnectionError, ValueError, OSError, RuntimeError) as e:
+            print(f"Ошибка протокола (recv): {e}")
+        finally:
+            self.close()
+            if on_close:
+                on_close()
+
+    async def _wait_lane(self, limit):
+        # Очередь будит цикл, только когда он ждет: на каждый кадр
+        # call_soon_threadsafe стоил бы дороже самой расшифровки
+        while self._posted - self._handled > limit:
+            self._lane_waiter = self.loop_thread.loop.create_future()
+            # Кадр мог обработаться до появления waiter
+            if self._posted - self._handled > limit:
+                await self._lane_waiter
+            self._lane_waiter = None
+
+    def pause_reading(self):
+        # Из любого потока, в том числе из обработчика в очереди: кадры,
+        # уже прочитанные из сокета, обработаются, новые - нет
+        self._read_paused = True
+
+    def resume_reading(self):
+        self._read_paused = False
+        try:
+            self.loop_thread.loop.call_soon_threadsafe(self._wake_reader)
+        except RuntimeError:  # Цикл уже остановлен
+            pass
+
+    def _wake_reader(self):
+        waiter = self._resume_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait_resume(self):
+        while self._read_paused and not self._broken:
+            self._resume_waiter = self.loop_thread.loop.create_future()
+            # resume_reading() мог успеть до появления waiter
+            if self._read_paused:
+                await self._resume_waiter
+            self._resume_waiter = None
+
+    def _dispatch(self, frame, on_packet):
+        # Следующие кадры после ошибки уже в очереди: их не разбираем
+        try:
+            if not self._broken and not self._handle_frame(frame, on_packet):
+                self._broken = True
+                self.close()
+        finally:
+            # Иначе _read_loop ждал бы этот кадр вечно
+            self._handled += 1
+            waiter = self._lane_waiter
+            if waiter is not None:
+                self.loop_thread.loop.call_soon_threadsafe(_wake, waiter)
+
+    def _lane_failed(self, error):
+        # Задача очереди упала: состояние соединения неизвестно, закрываем.
+        # Отправка узнает об ошибке через _send_error.
+        self._broken = True
+        if not self._send_error:
+            self._send_error = error
+        self.close()
+
+    def _handle_frame(self, frame, on_packet):
+        try:
+            data = decode_frame(frame, self.session, self.compression,
+                                self.codec)
+        except Exception as e:
+            print(f"Ошибка протокола (recv): {e}")
+            return False
+        if not isinstance(data, dict):
+            print(f"Ошибка протокола (recv): пакет "
+                  f"{type(data).__name__} вместо объекта")
+            return False
+
+        if data.get('type') == 'handshake_ack' and self._client_nonce:
+            self._finish_handshake(data)
+            return True
+        try:
+            on_packet(data)
+        except Exception as e:
+            print(f"Ошибка обработки пакета: {e}")
+            return False
+        return True
+
+    def close(self):
+        # Закрытие встает в очередь соединения, а из нее - в очередь цикла:
+        # кадры, отправленные до close(), успеют уйти
+        try:
+            self._lane.post(self._close_soon)
+        except RuntimeError:  # Пул уже остановлен
+            self._close_soon()
+
+    def _close_soon(self):
+        try:
+            self.loop_thread.loop.call_soon_threadsafe(self._close)
+        except RuntimeError:  # Цикл уже остановлен
+            pass
+
+    def _close(self):
+        self._take_outbox()
+        self._flush()
+        self.writer.close()
+        # Приостановленное чтение должно увидеть закрытие и вызвать on_close
+        self._read_paused = False
+        self._wake_reader()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _set_nodelay(sock):
+    # Задержку мелких кадров регулирует очередь записи, а не ядро
+    if sock is not None and sock.family in (socket.AF_INET,
+                                            socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def _set_cork(sock, enabled):
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6) \
+            and hasattr(socket, 'TCP_CORK'):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK,
+                            1 if enabled else 0)
+        except OSError:
+            pass
+
+
+def _keepalive(writer):
+    # Соединения из пула подолгу простаивают: обрыв должна заметить ОС
+    sock = writer.get_extra_info('socket')
+    if sock is None:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                        ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                        ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+async def open_connection(loop_thread, host, port, username, wait_ack=False,
+                          **extra):
+    reader, writer = await asyncio.open_connection(host, port,
+                                                   limit=READ_LIMIT)
+    _keepalive(writer)
+    conn = AsyncConnection(reader, writer, loop_thread)
+    try:
+        await conn.start_handshake(username, **extra)
+        # Старый собеседник не отвечает на рукопожатие, поэтому чат не
+        # ждет ack: его перехватит цикл чтения
+        if wait_ack:
+            await conn.wait_handshake()
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+class AsyncTCPServer:
+    def __init__(self, loop_thread, on_connection, host="", port=TCP_PORT,
+                 max_retries=3):
+        # on_connection(conn, address) - корутина, выполняется в цикле
+        self.loop_thread = loop_thread
+        self.on_connection = on_connection
+        self.host = host
+        self.port = port
+        self.server = None
+        loop_thread.call(self._start(max_retries))
+
+    async def _start(self, max_retries):
+        for attempt in range(max_retries):
+            try:
+                self.server = await asyncio.start_server(
+                    self._handle, self.host or None, self.port,
+                    backlog=TCP_BACKLOG, reuse_address=True,
+                    limit=READ_LIMIT)
+                if not self.port:
+                    self.port = self.server.sockets[0].getsockname()[1]
+                print(f"TCP Server successfully started on port {self.port}")
+                return
+            except OSError as e:
+                print(f"Attempt {attempt + 1} failed: {e}")
+
+                if attempt < max_retries - 1:
+                    self.port += 1
+                    print(f"Trying port {self.port}...")
+                    await asyncio.sleep(1)
+                else:
+                    raise Exception(
+                        f"Failed to start TCP server after {max_retries} attempts")
+
+    async def _handle(self, reader, writer):
+        _keepalive(writer)
+        conn = AsyncConnection(reader, writer, self.loop_thread)
+        try:
+            await self.on_connection(conn, writer.get_extra_info('peername'))
+        except Exception as e:
+            print(f"Ошибка входящего соединения: {e}")
+            conn.close()
+
+    async def _close(self):
+        # wait_closed не ждем: открытые чаты продолжают работать
+        self.server.close()
+
+    def close(self):
+        if self.server:
+            self.loop_thread.call(self._close(), timeout=5)
+            self.server = None
+        print("TCP Server closed")
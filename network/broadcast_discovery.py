@@ -1,20 +1,200 @@
 import socket
+import struct
+import random
 import threading
 import time
 import json
-from utils.constans import BROADCAST_PORT
+from utils import metrics
+from network.presence import PresenceRegistry, LEAVE, user_key
+from utils.constans import BROADCAST_PORT, ANNOUNCE_MIN_INTERVAL, \
+    ANNOUNCE_MAX_INTERVAL, ANNOUNCE_JITTER, PEER_TIMEOUT, MULTICAST_TTL, \
+    GOSSIP_INTERVAL, GOSSIP_FANOUT
+
+# Компактное объявление: magic, версия, флаги, эпоха (случайна при каждом
+# запуске), номер изменения, TCP-порт, интервал до следующего объявления
+# (с), IPv4; дальше имя в UTF-8.
+ANNOUNCE = struct.Struct('>2sBBIHHH4s')
+MAGIC = b'LC'
+VERSION = 1
+FLAG_LEAVING = 0x01
+MAX_USERNAME_BYTES = 64
+
+# Новый собеседник услышит нас не позже чем через столько секунд
+NEW_PEER_REPLY_WINDOW = 2.0
+# Сколько узлов в среднем отвечают новому собеседнику досрочно: в большой
+# сети остальных он услышит в их обычный интервал
+NEW_PEER_REPLY_FANOUT = 16
+# Собеседник считается ушедшим, если пропустил столько объявлений
+MISSED_ANNOUNCES = 3
+
+# Обмен списками с опорными узлами: заголовок (magic, версия, флаги,
+# эпоха отправителя) и записи (эпоха, номер изменения, TCP-порт, сколько
+# секунд запись еще действительна, IPv4, длина имени), за каждой - имя
+GOSSIP_HEADER = struct.Struct('>2sBBI')
+GOSSIP_ENTRY = struct.Struct('>IHHH4sB')
+GOSSIP_MAGIC = b'LG'
+# Ответ на список: на него самого не отвечают
+FLAG_REPLY = 0x01
+# Датаграмма меньше типичного MTU - без IP-фрагментации
+GOSSIP_MAX_PACKET = 1200
+
+
+def pack_announcement(username, ip, tcp_port, epoch, seq, interval,
+                      leaving=False):
+    try:
+        packed_ip = socket.inet_aton(ip)
+    except OSError:
+        packed_ip = bytes(4)
+    name = username.encode('utf-8')[:MAX_USERNAME_BYTES]
+    return ANNOUNCE.pack(MAGIC, VERSION, FLAG_LEAVING if leaving else 0,
+                         epoch, seq & 0xFFFF, tcp_port,
+                         min(int(interval + 1), 0xFFFF), packed_ip) + name
+
+
+def unpack_announcement(data):
+    # Возвращает dict или None для чужих/испорченных пакетов
+    if len(data) <= ANNOUNCE.size or data[:2] != MAGIC:
+        return None
+    magic, version, flags, epoch, seq, tcp_port, interval, packed_ip = \
+        ANNOUNCE.unpack_from(data)
+    if version != VERSION:
+        return None
+    return {
+        'username': data[ANNOUNCE.size:].decode('utf-8', 'replace'),
+        'ip': socket.inet_ntoa(packed_ip),
+        'tcp_port': tcp_port,
+        'epoch': epoch,
+        'seq': seq,
+        'interval': interval,
+        'leaving': bool(flags & FLAG_LEAVING)
+    }
+
+
+def pack_gossip(entries, epoch, now, reply=False):
+    # entries - записи Peer из PresenceRegistry; возвращает список датаграмм
+    header = GOSSIP_HEADER.pack(GOSSIP_MAGIC, VERSION,
+                                FLAG_REPLY if reply else 0, epoch)
+    packets = []
+    packet = bytearray(header)
+    for peer in entries:
+        ttl = int(peer.expires - now)
+        username, packed_ip = peer.key
+        if ttl <= 1 or not isinstance(packed_ip, int):
+            continue
+        peer_epoch, seq = peer.version or (None, None)
+        name = username.encode('utf-8')[:MAX_USERNAME_BYTES]
+        record = GOSSIP_ENTRY.pack(peer_epoch or 0, (seq or 0) & 0xFFFF,
+                                   peer.tcp_port, min(ttl, 0xFFFF),
+                                   packed_ip.to_bytes(4, 'big'),
+                                   len(name)) + name
+        if len(packet) + len(record) > GOSSIP_MAX_PACKET:
+            packets.append(bytes(packet))
+            packet = bytearray(header)
+        packet += record
+    if len(packet) > len(header) or not packets:
+        packets.append(bytes(packet))
+    return packets
+
+
+def unpack_gossip(data):
+    # (эпоха отправителя, ответ ли это, [dict]) или None
+    if len(data) < GOSSIP_HEADER.size or data[:2] != GOSSIP_MAGIC:
+        return None
+    magic, version, flags, epoch = GOSSIP_HEADER.unpack_from(data)
+    if version != VERSION:
+        return None
+    entries = []
+    pos = GOSSIP_HEADER.size
+    while pos + GOSSIP_ENTRY.size <= len(data):
+        peer_epoch, seq, tcp_port, ttl, packed_ip, name_len = \
+            GOSSIP_ENTRY.unpack_from(data, pos)
+        pos += GOSSIP_ENTRY.size
+        name = data[pos:pos + name_len]
+        pos += name_len
+        entries.append({
+            'username': name.decode('utf-8', 'replace'),
+            'ip': socket.inet_ntoa(packed_ip),
+            'tcp_port': tcp_port,
+            # Эпоха 0 - узел со старым JSON-протоколом
+            'epoch': peer_epoch or None,
+            'seq': seq if peer_epoch else None,
+            'ttl': ttl
+        })
+    return epoch, bool(flags & FLAG_REPLY), entries
+
+
+def parse_seed(seed, default_port=BROADCAST_PORT):
+    host, _, port = seed.rpartition(':')
+    if not host:
+        return seed, default_port
+    return host, int(port)
+
+
+class AnnounceSchedule:
+    # Интервал растет вдвое после каждого объявления: часто при запуске
+    # и после изменений, редко в стабильной сети. Разброс (jitter) не дает
+    # узлам, запущенным одновременно, объявляться синхронно.
+    def __init__(self, min_interval=ANNOUNCE_MIN_INTERVAL,
+                 max_interval=ANNOUNCE_MAX_INTERVAL, jitter=ANNOUNCE_JITTER,
+                 rand=random.random):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.rand = rand
+        self.interval = min_interval
+
+    def next_delay(self):
+        delay = self.interval * (1 + self.jitter * (2 * self.rand() - 1))
+        self.interval = min(self.interval * 2, self.max_interval)
+        return delay
+
+    def reset(self):
+        self.interval = self.min_interval
+
+
+def _seq_before(a, b):
+    # Номер изменения 16-битный и переполняется
+    return a != b and (b - a) & 0xFFFF < 0x8000
 
 
 class BroadcastDiscovery:
-    def __init__(self, broadcast_port=BROADCAST_PORT):
+    # multicast_group - слать объявления в группу, а не широковещательно:
+    # их получают только подписанные узлы, а TTL позволяет пройти через
+    # маршрутизаторы. seeds - опорные узлы "хост[:порт]" в других подсетях:
+    # узел раз в GOSSIP_INTERVAL отправляет нескольким из них себя и
+    # собеседников, которых слышит сам, и получает в ответ их список.
+    def __init__(self, broadcast_port=BROADCAST_PORT, presence=None,
+                 multicast_group=None, ttl=MULTICAST_TTL, seeds=()):
         self.port = broadcast_port
-        self.known_users = {}
+        self.multicast_group = multicast_group
+        self.ttl = ttl
+        self.seeds = [parse_seed(seed, broadcast_port) for seed in seeds]
+        # События о собеседниках - через presence.subscribe()
+        # Пустой реестр ложен (__len__), поэтому проверка на None
+        self.presence = presence if presence is not None \
+            else PresenceRegistry()
+        self.presence.subscribe(self._on_presence)
         self.is_running = True
         self.username = ""
         self.local_ip = ""
         self.tcp_port = 0
 
-        self.users_lock = threading.Lock()
+        self.epoch = random.getrandbits(32)
+        self.seq = 0
+        self.schedule = AnnounceSchedule()
+        self._next_at = 0.0
+        self._wake = threading.Event()
+        # Последний пакет от каждого адреса: повтор не разбираем заново
+        self._last_packets = {}
+        # Старые клиенты понимают только JSON: шлем его, если слышали их
+        self._legacy_peers = False
+        self._last_expire = 0.0
+        # Сокет приема: с него же идут пакеты опорным узлам, чтобы ответы
+        # приходили на порт обнаружения
+        self._listen_sock = None
+        self._gossip_wake = threading.Event()
+        # Адреса известных по прошлым запускам собеседников (хост, порт)
+        self.probe_addrs = []
 
     def start_discovery(self, username, local_ip, tcp_port):
         self.username = username
@@ -25,32 +205,84 @@ class BroadcastDiscovery:
 
         threading.Thread(target=self._listen_worker, daemon=True).start()
 
+        if self.seeds:
+            threading.Thread(target=self._gossip_worker, daemon=True).start()
+
         print(f"Broadcast discovery started for {username}")
 
-    def _announce_worker(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    def update(self, username=None, local_ip=None, tcp_port=None):
+        # Изменение своих данных объявляется сразу и снова часто
+        if username is not None: self.username = username
+        if local_ip is not None: self.local_ip = local_ip
+        if tcp_port is not None: self.tcp_port = tcp_port
+        self.seq += 1
+        self.schedule.reset()
+        self._next_at = 0.0
+        self._wake.set()
+        self._gossip_wake.set()
 
-        announcement = {
+    def _announcement(self, interval, leaving=False):
+        return pack_announcement(self.username, self.local_ip,
+                                 self.tcp_port, self.epoch, self.seq,
+                                 interval, leaving)
+
+    def _legacy_announcement(self):
+        return json.dumps({
             'type': 'chat_user',
             'username': self.username,
             'ip': self.local_ip,
             'tcp_port': self.tcp_port,
             'timestamp': time.time()
-        }
+        }).encode('utf-8')
+
+    def _announce_worker(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if self.multicast_group:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                            self.ttl)
 
         while self.is_running:
-            try:
-                message = json.dumps(announcement).encode('utf-8')
-                sock.sendto(message, ('255.255.255.255', self.port))
-            except Exception as e:
-                print(f"Broadcast send error: {e}")
+            now = time.monotonic()
+            if now < self._next_at:
+                self._wake.wait(self._next_at - now)
+                self._wake.clear()
+                continue
 
-            time.sleep(3)
-            announcement['timestamp'] = time.time()
+            delay = self.schedule.next_delay()
+            self._next_at = time.monotonic() + delay
+            self._send(sock, self._announcement(delay))
 
+        # Прощальный пакет: собеседники убирают нас сразу, а не по таймауту
+        leaving = self._announcement(0, leaving=True)
+        self._send(sock, leaving)
+        for seed in self.seeds:
+            self._send_to(seed, leaving)
         sock.close()
 
+    def _send(self, sock, message):
+        # JSON-клиенты слушают только широковещательный адрес
+        target = self.multicast_group or '255.255.255.255'
+        try:
+            sock.sendto(message, (target, self.port))
+            if metrics.enabled:
+                metrics.DISCOVERY_PACKETS.inc(1, 'out')
+            if self._legacy_peers:
+                sock.sendto(self._legacy_announcement(),
+                            ('255.255.255.255', self.port))
+        except Exception as e:
+            print(f"Broadcast send error: {e}")
+
+    def _reply_soon(self):
+        # Новый собеседник должен узнать о нас, не дожидаясь длинного
+        # интервала; случайная задержка не дает всем ответить разом
+        if random.random() * len(self.presence) > NEW_PEER_REPLY_FANOUT:
+            return
+        next_at = time.monotonic() + random.random() * NEW_PEER_REPLY_WINDOW
+        if next_at < self._next_at:
+            self._next_at = next_at
+            self._wake.set()
+
     def _listen_worker(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -61,56 +293,192 @@ class BroadcastDiscovery:
         except OSError:
             sock.bind(('0.0.0.0', self.port))
 
+        if self.multicast_group:
+            self._join_group(sock)
         sock.settimeout(1.0)
+        self._listen_sock = sock
         print(f"Broadcast listener started on port {self.port}")
+        self._probe()
 
         while self.is_running:
             try:
-                data, _ = sock.recvfrom(1024)
+                data, addr = sock.recvfrom(1024)
+                if metrics.enabled:
+                    metrics.DISCOVERY_PACKETS.inc(1, 'in')
+                self.handle_packet(data, addr, time.time())
+            except socket.timeout:
+                pass
+            except Exception as e:
+                if self.is_running:
+                    print(f"Broadcast receive error: {e}")
+            now = time.time()
+            if now - self._last_expire >= 1.0:
+                self._last_expire = now
+                self.expire(now)
 
-                try:
-                    message = json.loads(data.decode('utf-8'))
-                    if message.get('type') != 'chat_user':
-                        continue
-                    if message['username'] == self.username:
-                        continue
+        self._listen_sock = None
+        sock.close()
 
-                    user_key = f"{message['username']}_{message['ip']}"
+    def _probe(self):
+        # Как запрос опорному узлу: живой собеседник ответит собой и своим
+        # списком, даже если он за маршрутизатором
+        packets = [self._announcement(ANNOUNCE_MAX_INTERVAL)] + \
+            pack_gossip([], self.epoch, time.time())
+        for addr in self.probe_addrs:
+            for packet in packets:
+                self._send_to(addr, packet)
 
-                    with self.users_lock:
-                        self.known_users[user_key] = {
-                            'username': message['username'],
-                            'ip': message['ip'],
-                            'tcp_port': message['tcp_port'],
-                            'last_seen': message['timestamp']
-                        }
+    def _join_group(self, sock):
+        mreq = struct.pack('4s4s', socket.inet_aton(self.multicast_group),
+                           socket.inet_aton('0.0.0.0'))
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        except OSError as e:
+            print(f"Multicast join error: {e}")
 
-                except (json.JSONDecodeError, KeyError):
-                    continue
+    def _gossip_worker(self):
+        # Каждый опорный узел слышит нас в среднем раз в столько секунд
+        interval = GOSSIP_INTERVAL * max(1, len(self.seeds) / GOSSIP_FANOUT)
+        while self.is_running:
+            if self._listen_sock:
+                now = time.time()
+                # Отдаем только тех, кого слышим сами: остальных опорный
+                # узел знает от их соседей
+                direct = [p for p in self.presence.entries()
+                          if not p.gossip]
+                packets = [self._announcement(interval)] + \
+                    pack_gossip(direct, self.epoch, now)
+                for seed in random.sample(self.seeds,
+                                          min(GOSSIP_FANOUT, len(self.seeds))):
+                    for packet in packets:
+                        self._send_to(seed, packet)
+            self._gossip_wake.wait(GOSSIP_INTERVAL)
+            self._gossip_wake.clear()
 
-            except socket.timeout:
+    def _send_to(self, addr, message):
+        sock = self._listen_sock
+        if sock is None:
+            return
+        try:
+            sock.sendto(message, addr)
+            if metrics.enabled:
+                metrics.DISCOVERY_PACKETS.inc(1, 'out')
+        except Exception as e:
+            print(f"Gossip send error to {addr[0]}: {e}")
+
+    def handle_gossip(self, data, addr, now):
+        parsed = unpack_gossip(data)
+        if parsed is None:
+            return
+        epoch, reply, entries = parsed
+        if epoch == self.epoch:
+            return
+        for message in entries:
+            if message['epoch'] == self.epoch:
                 continue
-            except Exception as e:
-                if self.is_running:
-                    print(f"Broadcast receive error: {e}")
+            key = user_key(message['username'], message['ip'])
+            version = (message['epoch'], message['seq'])
+            peer = self.presence.get(key)
+            if peer and peer.version and (
+                    peer.version == version or (
+                    version[0] is not None
+                    and peer.version[0] == version[0]
+                    and _seq_before(version[1], peer.version[1]))):
+                # Те же или устаревшие данные: только продлеваем срок
+                peer.expires = max(peer.expires, now + message['ttl'])
+                continue
+            known = peer is not None
+            peer = self.presence.update(key, message['tcp_port'], now,
+                                        message['ttl'], version)
+            if not known:
+                peer.gossip = True
+        if not reply:
+            # Ответ: мы сами и все, кого знаем
+            self._send_to(addr, self._announcement(ANNOUNCE_MAX_INTERVAL))
+            for packet in pack_gossip(self.presence.entries(), self.epoch,
+                                      now, reply=True):
+                self._send_to(addr, packet)
 
-        sock.close()
+    def handle_packet(self, data, addr, now):
+        if data[:2] == GOSSIP_MAGIC:
+            self.handle_gossip(data, addr, now)
+            return
 
-    def get_online_users(self):
-        with self.users_lock:
-            current_time = time.time()
-            expired_users = []
+        # Повтор того же объявления: только продлеваем срок
+        cached = self._last_packets.get(addr)
+        if cached and cached[0] == data and \
+                self.presence.get(cached[1].key) is cached[1]:
+            self.presence.touch(cached[1], now)
+            return
+
+        message = unpack_announcement(data)
+        if message is None:
+            message = self._parse_legacy(data)
+            if message is None:
+                return
+            self._legacy_peers = True
+        # Свои объявления узнаем по эпохе (у JSON ее нет - по имени)
+        if message['epoch'] == self.epoch or (
+                message['epoch'] is None
+                and message['username'] == self.username):
+            return
+        if message['ip'] == '0.0.0.0':
+            message['ip'] = addr[0]
 
-            for key, user in self.known_users.items():
-                if current_time - user['last_seen'] > 120:
-                    expired_users.append(key)
-                    print(f"User {user['username']} expired")
+        key = user_key(message['username'], message['ip'])
+        # Тот же узел сменил имя: старая запись уходит сразу
+        if cached and cached[1].key != key:
+            self.presence.remove(cached[1].key)
+        if message['leaving']:
+            self._last_packets.pop(addr, None)
+            self.presence.remove(key)
+            return
 
-            for key in expired_users:
-                if key in self.known_users:
-                    del self.known_users[key]
+        timeout = min(PEER_TIMEOUT,
+                      message['interval'] * MISSED_ANNOUNCES + 2)
+        known = self.presence.get(key) is not None
+        peer = self.presence.update(key, message['tcp_port'], now, timeout,
+                                    (message['epoch'], message['seq']))
+        peer.source = addr
+        peer.gossip = False
+        self._last_packets[addr] = (data, peer)
+        if not known:
+            self._reply_soon()
 
-            return list(self.known_users.values())
+    def _on_presence(self, event, peer):
+        # Ушедший собеседник: забываем его последний пакет
+        if event == LEAVE:
+            addr = peer.source
+            cached = self._last_packets.get(addr)
+            if cached and cached[1] is peer:
+                del self._last_packets[addr]
+
+    @staticmethod
+    def _parse_legacy(data):
+        try:
+            message = json.loads(data.decode('utf-8'))
+            if message.get('type') != 'chat_user':
+                return None
+            return {
+                'username': message['username'],
+                'ip': message['ip'],
+                'tcp_port': message['tcp_port'],
+                # У JSON нет номера изменения: смена порта - это изменение
+                'epoch': None,
+                'seq': None,
+                'interval': PEER_TIMEOUT,
+                'leaving': False
+            }
+        except (ValueError, KeyError, AttributeError):
+            return None
+
+    def expire(self, now):
+        # Стоимость пропорциональна числу истекших записей (куча в presence)
+        return self.presence.expire(now)
+
+    def get_online_users(self):
+        return self.presence.users()
 
     def stop(self):
-        self.is_running = False
\ No newline at end of file
+        self.is_running = False
+        self._wake.set()
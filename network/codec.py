@@ -0,0 +1,87 @@
+import json
+import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _default(value):
+    # bytes в JSON уходят base64-строкой; msgpack передает их как есть
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется")
+
+
+def as_bytes(value):
+    # bytes из пакета: через JSON они приходят base64-строкой
+    if isinstance(value, str):
+        return base64.b64decode(value)
+    return bytes(value)
+
+
+class JsonCodec:
+    name = 'json'
+
+    def dumps(self, data):
+        # Кириллица без \uXXXX и без пробелов: вдвое короче, а прочитает
+        # такой JSON и старый клиент
+        return json.dumps(data, default=_default, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    # Тот же JSON на проводе, поэтому согласовывать нечего: собеседник
+    # со стандартным json его прочитает
+    def dumps(self, data):
+        return orjson.dumps(data, default=_default,
+                            option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# Кодеки без состояния: один экземпляр на все соединения
+_CODECS = {'json': OrjsonCodec() if orjson else JsonCodec()}
+if msgpack:
+    _CODECS['msgpack'] = MsgpackCodec()
+
+# JSON понимает любой собеседник: им кодируются рукопожатие, кадры без
+# сессии и пакеты старых клиентов
+JSON = _CODECS['json']
+
+# Порядок предпочтения: msgpack короче и не раздувает bytes в base64
+PREFERRED_CODECS = [name for name in ('msgpack', 'json') if name in _CODECS]
+
+
+def choose_codec(offered):
+    for name in PREFERRED_CODECS:
+        if name in offered:
+            return name
+    return None
+
+
+def get_codec(name):
+    # Собеседник без поля codec (старый клиент) говорит на JSON
+    return _CODECS.get(name, JSON)
@@ -0,0 +1,130 @@
+import os
+import zlib
+
+from utils.constans import MAX_FRAME_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+# Кадры меньше этого размера не сжимаются: выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 512
+# Сколько байт пробно сжимать, чтобы оценить, стоит ли сжимать кадр
+SAMPLE_SIZE = 4096
+# Если пробный фрагмент сжался хуже этого, данные считаются несжимаемыми
+MAX_SAMPLE_RATIO = 0.9
+
+# Форматы, которые уже сжаты: их куски даже не проверяем
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.lz4',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.aac', '.ogg', '.opus', '.flac', '.m4a',
+    '.mp4', '.mkv', '.avi', '.mov', '.webm',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.jar', '.apk', '.pdf',
+}
+
+
+class ZlibCompressor:
+    name = 'zlib'
+
+    def compress(self, data):
+        return zlib.compress(data, 1)
+
+    def decompress(self, data, max_size=MAX_FRAME_SIZE):
+        d = zlib.decompressobj()
+        result = d.decompress(data, max_size)
+        if d.unconsumed_tail:
+            raise ValueError("Распакованный кадр больше лимита")
+        return result
+
+
+class ZstdCompressor:
+    name = 'zstd'
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=1)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data, max_size=MAX_FRAME_SIZE):
+        if zstandard.frame_content_size(data) > max_size:
+            raise ValueError("Распакованный кадр больше лимита")
+        return self._decompressor.decompress(data, max_output_size=max_size)
+
+
+class Lz4Compressor:
+    name = 'lz4'
+
+    def compress(self, data):
+        return lz4.block.compress(data, store_size=True)
+
+    def decompress(self, data, max_size=MAX_FRAME_SIZE):
+        # Первые 4 байта - размер исходных данных (little-endian)
+        if int.from_bytes(bytes(data[:4]), 'little') > max_size:
+            raise ValueError("Распакованный кадр больше лимита")
+        return lz4.block.decompress(data)
+
+
+_COMPRESSORS = {'zlib': ZlibCompressor}
+if zstandard:
+    _COMPRESSORS['zstd'] = ZstdCompressor
+if lz4:
+    _COMPRESSORS['lz4'] = Lz4Compressor
+
+# Порядок предпочтения: чем быстрее, тем лучше для локальной сети
+PREFERRED_COMPRESSION = [name for name in ('lz4', 'zstd', 'zlib')
+                         if name in _COMPRESSORS]
+
+
+def choose_compression(offered):
+    for name in PREFERRED_COMPRESSION:
+        if name in offered:
+            return name
+    return None
+
+
+def get_compressor(name):
+    if name not in _COMPRESSORS:
+        return None
+    return _COMPRESSORS[name]()
+
+
+def should_compress_file(path):
+    return os.path.splitext(path)[1].lower() not in INCOMPRESSIBLE_EXTENSIONS
+
+
+def is_compressible(data):
+    # Пробно сжимаем начало, середину и конец данных самым быстрым zlib:
+    # этого хватает, чтобы отличить текст от случайных/сжатых данных.
+    size = len(data)
+    if size < MIN_COMPRESS_SIZE:
+        return False
+
+    if size <= SAMPLE_SIZE:
+        sample = bytes(data)
+    else:
+        part = SAMPLE_SIZE // 3
+        middle = size // 2
+        with memoryview(data) as view:
+            sample = b''.join((view[:part], view[middle:middle + part],
+                               view[size - part:]))
+
+    return len(zlib.compress(sample, 1)) < len(sample) * MAX_SAMPLE_RATIO
+
+
+def compress(compressor, data):
+    # Возвращает сжатые данные или None, если сжатие не окупается
+    if not compressor or not is_compressible(data):
+        return None
+    packed = compressor.compress(data)
+    if len(packed) >= len(data):
+        return None
+    return packed
@@ -0,0 +1,148 @@
+import base64
+import threading
+
+from network.protocol import send_json, recv_json, send_file_chunk, \
+    FrameReader
+from network.session import AeadSession, PREFERRED_CIPHERS, choose_cipher, \
+    new_nonce
+from network.compression import PREFERRED_COMPRESSION, choose_compression, \
+    get_compressor
+from network.codec import PREFERRED_CODECS, choose_codec, get_codec
+
+
+def make_handshake(username, **extra):
+    # Клиент предлагает сессионные шифры; старый сервер просто
+    # проигнорирует лишние поля, и останется Fernet.
+    client_nonce = new_nonce()
+    handshake = {
+        'type': 'handshake',
+        'username': username,
+        'ciphers': PREFERRED_CIPHERS,
+        'compression': PREFERRED_COMPRESSION,
+        'codecs': PREFERRED_CODECS,
+        'nonce': base64.b64encode(client_nonce).decode('utf-8')
+    }
+    handshake.update(extra)
+    return handshake, client_nonce
+
+
+def make_handshake_ack(handshake):
+    # Возвращает (ack, session, compressor, codec) или None, если клиент
+    # не умеет сессионное шифрование
+    cipher_name = choose_cipher(handshake.get('ciphers', []))
+    if not cipher_name or 'nonce' not in handshake:
+        return None
+
+    client_nonce = base64.b64decode(handshake['nonce'])
+    server_nonce = new_nonce()
+    ack = {
+        'type': 'handshake_ack',
+        'cipher': cipher_name,
+        'nonce': base64.b64encode(server_nonce).decode('utf-8')
+    }
+    # Сжатие работает только поверх сессии
+    compression = choose_compression(handshake.get('compression', []))
+    if compression:
+        ack['compression'] = compression
+    # Кодек тоже: без поля codec обе стороны остаются на JSON
+    codec = choose_codec(handshake.get('codecs', []))
+    if codec:
+        ack['codec'] = codec
+
+    session = AeadSession(cipher_name, client_nonce, server_nonce,
+                          is_client=False)
+    return ack, session, get_compressor(compression), get_codec(codec)
+
+
+def session_from_ack(ack, client_nonce):
+    server_nonce = base64.b64decode(ack['nonce'])
+    session = AeadSession(ack['cipher'], client_nonce, server_nonce,
+                          is_client=True)
+    return (session, get_compressor(ack.get('compression')),
+            get_codec(ack.get('codec')))
+
+
+class Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.session = None
+        self.compression = None
+        self.codec = None
+        self.send_lock = threading.Lock()
+        self.reader = FrameReader(sock)
+        self._client_nonce = None
+
+    def start_handshake(self, username, **extra):
+        handshake, self._client_nonce = make_handshake(username, **extra)
+        self.send_json(handshake)
+
+    def wait_handshake(self):
+        # Для соединений, которые сами ничего не читают (потоки данных):
+        # дожидаемся handshake_ack, чтобы сразу перейти на сессию.
+        data = recv_json(self.sock, self.session, self.reader)
+        if not data or data.get('type') != 'handshake_ack':
+            raise ConnectionError("Сервер не подтвердил рукопожатие")
+        self._finish_handshake(data)
+
+    def accept_handshake(self, handshake):
+        result = make_handshake_ack(handshake)
+        if not result:
+            return
+
+        ack, session, compressor, codec = result
+        with self.send_lock:
+            send_json(self.sock, ack)
+            self.session = session
+            self.compression = compressor
+            self.codec = codec
+
+    def _finish_handshake(self, ack):
+        with self.send_lock:
+            self.session, self.compression, self.codec = session_from_ack(
+                ack, self._client_nonce)
+        self._client_nonce = None
+
+    def send_json(self, data_dict):
+        with self.send_lock:
+            send_json(self.sock, data_dict, self.session, self.compression,
+                      self.codec)
+
+    def send_file_chunk(self, binary_data, transfer_id=0, offset=0,
+                        compress=True):
+        with self.send_lock:
+            send_file_chunk(self.sock, binary_data, self.session,
+                            transfer_id, offset,
+                            self.compression if compress else None)
+
+    def recv_json(self):
+        while True:
+            data = recv_json(self.sock, self.session, self.reader,
+                             self.compression, self.codec)
+            if (data and data.get('type') == 'handshake_ack'
+                    and self._client_nonce):
+                self._finish_handshake(data)
+                continue
+            return data
+
+    def start_reading(self, on_packet, on_close=None):
+        # Тот же интерфейс, что у AsyncConnection, но на отдельном потоке
+        def loop():
+            try:
+                while True:
+                    data = self.recv_json()
+                    if data is None:
+                        break
+                    on_packet(data)
+            except Exception:
+                pass
+            finally:
+                if on_close:
+                    on_close()
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
@@ -0,0 +1,597 @@
+import os
+import mmap
+import errno
+import json
+import time
+import hmac
+import queue
+import base64
+import hashlib
+import threading
+
+from network.protocol import decode_file_data
+from network.compression import should_compress_file
+from network.tcp_client import connect_peer
+from utils.constans import FILE_CHUNK_SIZE, MIN_FILE_CHUNK_SIZE, \
+    MAX_FILE_CHUNK_SIZE, FILE_WINDOW_SIZE, FILE_ACK_TIMEOUT, MAX_FILE_STREAMS
+
+# Сколько кусков может ждать записи на диск, прежде чем чтение из
+# соединения остановится (и TCP притормозит отправителя).
+WRITE_QUEUE_SIZE = 64
+# Как часто получатель сбрасывает на диск состояние для докачки (секунды)
+RESUME_SAVE_INTERVAL = 2.0
+# Ошибки posix_fallocate, означающие, что ФС его не поддерживает
+_NO_FALLOCATE = (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS)
+
+
+def transfer_id_for(path):
+    # Один и тот же неизмененный файл получает тот же ID, что позволяет
+    # получателю узнать незаконченную передачу и продолжить ее.
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def clamp_chunk_size(size):
+    return max(MIN_FILE_CHUNK_SIZE, min(size, MAX_FILE_CHUNK_SIZE))
+
+
+def chunk_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_transfers_dir():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    transfers_dir = os.path.join(project_root, 'data', 'transfers')
+
+    if not os.path.exists(transfers_dir):
+        os.makedirs(transfers_dir)
+
+    return transfers_dir
+
+
+def _state_path(transfer_id):
+    return os.path.join(get_transfers_dir(), f"{transfer_id:08x}.json")
+
+
+def load_resume_state(transfer_id, size, chunk_size):
+    try:
+        with open(_state_path(transfer_id), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (state.get('size') != size or state.get('chunk_size') != chunk_size
+            or not os.path.exists(state.get('path', ''))):
+        return None
+    return state
+
+
+class _Progress:
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self._last_percent = -1
+
+    def update(self, done):
+        if not self.callback:
+            return
+        percent = done * 100 // self.total if self.total else 100
+        if percent != self._last_percent:
+            self._last_percent = percent
+            self.callback(done, self.total)
+
+
+class FileSender:
+    def __init__(self, conn, transfer_id, path, chunk_size=FILE_CHUNK_SIZE,
+                 manifest=None, streams=None, window=FILE_WINDOW_SIZE,
+                 on_progress=None):
+        self.conn = conn
+        self.transfer_id = transfer_id
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.chunk_size = clamp_chunk_size(chunk_size)
+        self.manifest = manifest or []
+        self.compress = should_compress_file(path)
+        # Если есть отдельные соединения для данных, куски идут только
+        # по ним, а основное соединение остается свободным для чата.
+        self.streams = streams or []
+        self.window = max(window,
+                          self.chunk_size * 4 * max(1, len(self.streams)))
+        self.progress = _Progress(self.size, on_progress)
+
+        self._acked = 0
+        self._next_offset = 0
+        self._error = None
+        self._cancelled = False
+        self._started = threading.Event()
+        self._cond = threading.Condition()
+
+    def run(self):
+        if self.size == 0:
+            return
+
+        with open(self.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+
+            with memoryview(mm) as view:
+                offset = self._verified_offset(view)
+                with self._cond:
+                    self._acked = offset
+                    self._next_offset = offset
+                self.conn.send_json({'type': 'file_start',
+                                     'id': self.transfer_id,
+                                     'offset': offset})
+                # Получатель подтверждает file_start, после чего куски
+                # можно слать по любому соединению.
+                if not self._started.wait(FILE_ACK_TIMEOUT):
+                    raise TimeoutError("Получатель не начал прием")
+
+                conns = self.streams or [self.conn]
+                threads = [threading.Thread(target=self._send_loop,
+                                            args=(conn, view), daemon=True)
+                           for conn in conns[1:]]
+                for t in threads:
+                    t.start()
+                self._send_loop(conns[0], view)
+                for t in threads:
+                    t.join()
+
+        if self._error:
+            raise self._error
+        self._wait_acked(self.size)
+
+    def _send_loop(self, conn, view):
+        # Каждое соединение забирает следующий свободный кусок, так что
+        # быстрые потоки передают больше. Шифрование тоже идет в этих
+        # потоках параллельно: cryptography отпускает GIL.
+        try:
+            while True:
+                with self._cond:
+                    offset = self._next_offset
+                    if offset >= self.size or self._error:
+                        return
+                    end = min(offset + self.chunk_size, self.size)
+                    self._next_offset = end
+
+                # Окно: в пути не больше self.window неподтвержденных байт
+                self._wait_acked(end - self.window)
+                with view[offset:end] as chunk:
+                    conn.send_file_chunk(chunk, self.transfer_id, offset,
+                                         self.compress)
+        except Exception as e:
+            with self._cond:
+                if not self._error:
+                    self._error = e
+                self._cond.notify_all()
+
+    def _verified_offset(self, view):
+        # Продолжаем с первого куска, хэш которого у получателя
+        # не совпал с исходным файлом.
+        offset = 0
+        for expected in self.manifest:
+            end = min(offset + self.chunk_size, self.size)
+            if offset >= end:
+                break
+            with view[offset:end] as chunk:
+                if chunk_digest(chunk) != expected:
+                    break
+            offset = end
+        return offset
+
+    def on_ack(self, offset):
+        self._started.set()
+        with self._cond:
+            if offset > self._acked:
+                self._acked = offset
+                self._cond.notify_all()
+
+    def cancel(self):
+        self._started.set()
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def _wait_acked(self, offset):
+        with self._cond:
+            while (self._acked < offset and not self._cancelled
+                   and not self._error):
+                if not self._cond.wait(FILE_ACK_TIMEOUT):
+                    raise TimeoutError("Нет подтверждения от получателя")
+            if self._cancelled or self._error:
+                raise ConnectionError("Передача отменена")
+            acked = self._acked
+        self.progress.update(acked)
+
+
+class FileReceiver:
+    def __init__(self, conn, transfer_id, path, size, chunk_size=None,
+                 resume_state=None, streams=0, on_progress=None,
+                 on_done=None, on_error=None):
+        self.conn = conn
+        self.transfer_id = transfer_id
+        self.path = path
+        self.size = size
+        # Старый клиент не сообщает размер куска: без него нет ни хэшей,
+        # ни докачки, ни дополнительных соединений.
+        self.chunk_size = chunk_size
+        self.streams = min(streams, MAX_FILE_STREAMS) if chunk_size else 0
+        self.token = base64.b64encode(os.urandom(16)).decode('utf-8')
+        self._lock = threading.Lock()
+        self.progress = _Progress(size, on_progress)
+        self.on_done = on_done
+        self.on_error = on_error
+
+        self._hashes = {}
+        if resume_state:
+            self._hashes = dict(enumerate(resume_state['hashes']))
+            self._file = open(path, 'r+b', buffering=0)
+        else:
+            self._file = open(path, 'wb', buffering=0)
+        # Место под файл выделяет поток записи: posix_fallocate без
+        # поддержки в ФС пишет нули, а вызывать нас может поток GUI
+        self._preallocate = not resume_state
+
+        self._written = self._manifest_offset()
+        self.received = self._written
+        self._pending = {}
+        self._failed = False
+        self._last_save = time.monotonic()
+        # Очередь без ограничения: куски приходят из очереди соединения на
+        # общем пуле, и ждать места там нельзя. Переполнение останавливает
+        # чтение сокета (pause_reading), а поток записи его возобновляет.
+        self._queue = queue.Queue()
+        self._space = threading.Condition(self._lock)
+        self._paused = set()
+
+    def start(self):
+        threading.Thread(target=self._writer_loop, daemon=True).start()
+
+    def on_start(self, offset):
+        with self._lock:
+            self.received = offset
+        self._queue.put((offset, None, None))
+
+    def on_chunk(self, offset, data, conn=None):
+        # conn - соединение, из которого пришел кусок
+        if self._failed:
+            return
+        if offset is None:  # Старый клиент не передает смещение
+            with self._lock:
+                offset = self.received
+                self.received += len(data)
+        # Хэш считается в потоке приема, а не в потоке записи: при
+        # нескольких соединениях хэширование идет параллельно.
+        digest = chunk_digest(data) if self.chunk_size else None
+        self._queue.put((offset, data, digest))
+        if self._queue.qsize() >= WRITE_QUEUE_SIZE:
+            self._throttle(conn)
+
+    def _throttle(self, conn):
+        pause = getattr(conn, 'pause_reading', None)
+        with self._space:
+            if pause is None:
+                # Блокирующее соединение читает в своем потоке: он и ждет
+                while self._queue.qsize() >= WRITE_QUEUE_SIZE and \
+                        not self._failed:
+                    self._space.wait()
+            elif self._queue.qsize() >= WRITE_QUEUE_SIZE:
+                # Под блокировкой: поток записи увидит паузу и снимет ее
+                self._paused.add(conn)
+                pause()
+
+    def _release_readers(self, force=False):
+        # Из потока записи: очередь разгружена наполовину (или передача
+        # закончилась) - чтение продолжается
+        with self._space:
+            if not force and self._queue.qsize() > WRITE_QUEUE_SIZE // 2:
+                return
+            self._space.notify_all()
+            paused, self._paused = self._paused, set()
+        for conn in paused:
+            conn.resume_reading()
+
+    def close(self):
+        # Недописанные куски из очереди отбрасываются: при докачке
+        # отправитель пришлет их снова.
+        self._failed = True
+        self._queue.put(None)
+        self._release_readers(force=True)
+
+    def manifest(self):
+        count = 0
+        while count in self._hashes:
+            count += 1
+        return [self._hashes[i] for i in range(count)]
+
+    def _manifest_offset(self):
+        if not self.chunk_size:
+            return 0
+        return min(len(self.manifest()) * self.chunk_size, self.size)
+
+    def _writer_loop(self):
+        try:
+            if self._preallocate:
+                try:
+                    _preallocate(self._file, self.size)
+                except OSError:
+                    # Места нет: отправитель не будет ждать подтверждений
+                    self.conn.send_json({'type': 'file_resp', 'status': 'no',
+                                         'id': self.transfer_id})
+                    raise
+            resp = {'type': 'file_resp', 'status': 'ok',
+                    'id': self.transfer_id, 'offset': self._written,
+                    'manifest': self.manifest()}
+            if self.streams:
+                resp.update({'streams': self.streams, 'token': self.token})
+            self.conn.send_json(resp)
+
+            while self._written < self.size:
+                item = self._queue.get()
+                if item is None or self._failed:
+                    break
+                self._release_readers()
+
+                offset, data, digest = item
+                if data is None:
+                    self._restart(offset)
+                else:
+                    _write_at(self._file, data, offset)
+                    if digest:
+                        self._hashes[offset // self.chunk_size] = digest
+                    self._advance(offset, len(data))
+
+                self.conn.send_json({'type': 'file_ack',
+                                     'id': self.transfer_id,
+                                     'offset': self._written})
+                self.progress.update(self._written)
+
+                if time.monotonic() - self._last_save > RESUME_SAVE_INTERVAL:
+                    self._save_state()
+        except Exception as e:
+            self._failed = True
+            self._finish()
+            self._drain()
+            self._release_readers(force=True)
+            if self.on_error:
+                self.on_error(e)
+            return
+
+        self._finish()
+        self._release_readers(force=True)
+        if self._written >= self.size and self.on_done:
+            self.on_done(self.path)
+
+    def _finish(self):
+        if self._written >= self.size:
+            self._file.close()
+            try:
+                os.remove(_state_path(self.transfer_id))
+            except OSError:
+                pass
+        else:
+            self._save_state()
+            self._file.close()
+
+    def _save_state(self):
+        self._last_save = time.monotonic()
+        if not self.chunk_size or self._file.closed:
+            return
+
+        # Хэши попадают в состояние только после того, как данные
+        # гарантированно записаны на диск.
+        os.fsync(self._file.fileno())
+        state = {'id': self.transfer_id, 'path': self.path,
+                 'size': self.size, 'chunk_size': self.chunk_size,
+                 'hashes': self.manifest()}
+        path = _state_path(self.transfer_id)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def _restart(self, offset):
+        # Отправитель продолжает с offset: все, что дальше, перезапишется
+        self._written = offset
+        self._pending.clear()
+        if self.chunk_size:
+            first = offset // self.chunk_size
+            self._hashes = {i: h for i, h in self._hashes.items()
+                            if i < first}
+
+    def _drain(self):
+        # Недописанные куски больше не нужны: освобождаем память
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _advance(self, offset, length):
+        # Подтверждаем только непрерывный префикс файла
+        self._pending[offset] = length
+        while self._written in self._pending:
+            self._written += self._pending.pop(self._written)
+
+
+class TransferManager:
+    def __init__(self, conn, peer_addr=None, username='',
+                 connect=connect_peer):
+        self.conn = conn
+        # Адрес TCP-сервера собеседника для дополнительных соединений
+        self.peer_addr = peer_addr
+        self.username = username
+        # connect(host, port, username, **extra) -> соединение с сессией
+        self.connect = connect
+        self._senders = {}
+        self._receivers = {}
+        self._streams = []
+        self._lock = threading.Lock()
+
+    def send_file(self, transfer_id, path, chunk_size=FILE_CHUNK_SIZE,
+                  manifest=None, streams=0, token=None, on_progress=None,
+                  on_done=None, on_error=None):
+        def worker():
+            data_conns = []
+            try:
+                if streams and token:
+                    data_conns = self._open_streams(streams, transfer_id,
+                                                    token)
+                sender = FileSender(self.conn, transfer_id, path, chunk_size,
+                                    manifest, data_conns,
+                                    on_progress=on_progress)
+                with self._lock:
+                    self._senders[transfer_id] = sender
+
+                sender.run()
+                if on_done:
+                    on_done(path)
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+            finally:
+                with self._lock:
+                    self._senders.pop(transfer_id, None)
+                for conn in data_conns:
+                    conn.close()
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _open_streams(self, count, transfer_id, token):
+        data_conns = []
+        if not self.peer_addr:
+            return data_conns
+
+        for _ in range(min(count, MAX_FILE_STREAMS)):
+            try:
+                data_conns.append(self.connect(
+                    *self.peer_addr, self.username,
+                    stream={'id': transfer_id, 'token': token}))
+            except Exception as e:
+                # Передадим по тем соединениям, что удалось открыть
+                print(f"Не удалось открыть поток данных: {e}")
+                break
+        return data_conns
+
+    def attach_stream(self, conn, stream):
+        # Входящее соединение с полем 'stream' в рукопожатии: проверяем,
+        # что это наша передача, и читаем из него куски.
+        receiver = self._get_receiver(stream.get('id'))
+        if not receiver or not receiver.streams or not hmac.compare_digest(
+                receiver.token, str(stream.get('token', ''))):
+            return False
+
+        with self._lock:
+            self._streams.append(conn)
+
+        def on_packet(data):
+            if not self.handle_packet(data, conn):
+                raise ValueError("Неожиданный пакет в потоке данных")
+
+        def on_close():
+            with self._lock:
+                if conn in self._streams:
+                    self._streams.remove(conn)
+
+        conn.start_reading(on_packet, on_close)
+        return True
+
+    def find_resumable(self, transfer_id, size, chunk_size):
+        if not chunk_size:
+            return None
+        return load_resume_state(transfer_id, size, chunk_size)
+
+    def receive_file(self, transfer_id, path, size, chunk_size=None,
+                     resume_state=None, streams=0, on_progress=None,
+                     on_done=None, on_error=None):
+        # Ответ file_resp со смещением и манифестом отправляет сам
+        # получатель, когда файл уже открыт.
+        def finished(callback):
+            def wrapper(result):
+                with self._lock:
+                    self._receivers.pop(transfer_id, None)
+                if callback:
+                    callback(result)
+            return wrapper
+
+        receiver = FileReceiver(self.conn, transfer_id, path, size,
+                                chunk_size, resume_state, streams,
+                                on_progress, finished(on_done),
+                                finished(on_error))
+        with self._lock:
+            self._receivers[transfer_id] = receiver
+        receiver.start()
+
+    def handle_packet(self, pkg, conn=None):
+        # Возвращает True, если пакет относится к передаче файлов.
+        # conn - соединение, из которого пришел пакет (по умолчанию основное)
+        ptype = pkg.get('type')
+        if ptype == 'file_chunk':
+            receiver = self._get_receiver(pkg.get('id', 0))
+            if receiver:
+                data = pkg['data']
+                if isinstance(data, str):  # Старый клиент присылает base64
+                    data = decode_file_data(data)
+                receiver.on_chunk(pkg.get('offset'), data, conn or self.conn)
+            return True
+
+        if ptype == 'file_start':
+            receiver = self._get_receiver(pkg.get('id'))
+            if receiver:
+                receiver.on_start(pkg['offset'])
+            return True
+
+        if ptype == 'file_ack':
+            with self._lock:
+                sender = self._senders.get(pkg.get('id'))
+            if sender:
+                sender.on_ack(pkg['offset'])
+            return True
+
+        return False
+
+    def _get_receiver(self, transfer_id):
+        with self._lock:
+            return self._receivers.get(transfer_id)
+
+    def close(self):
+        with self._lock:
+            senders = list(self._senders.values())
+            receivers = list(self._receivers.values())
+            streams = list(self._streams)
+            self._senders.clear()
+            self._receivers.clear()
+            self._streams.clear()
+        for sender in senders:
+            sender.cancel()
+        for receiver in receivers:
+            receiver.close()
+        for conn in streams:
+            conn.close()
+
+
+def _preallocate(f, size):
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as e:
+            # Без поддержки fallocate - разреженный файл; нехватка места
+            # (ENOSPC, EFBIG) - отказ от передачи сразу
+            if e.errno not in _NO_FALLOCATE:
+                raise
+    f.truncate(size)
+
+
+def _write_at(f, data, offset):
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(f.fileno(), view[written:], offset + written)
+    else:
+        f.seek(offset)
+        f.write(data)
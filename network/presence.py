@@ -0,0 +1,182 @@
+import heapq
+import itertools
+import threading
+
+from models.peer import Peer, peer_key, pack_ip, addr_key
+from utils.constans import PEER_TIMEOUT
+
+JOIN = 'join'
+LEAVE = 'leave'
+CHANGE = 'change'
+
+# Ключ записи: (интернированное имя, упакованный IP)
+user_key = peer_key
+
+
+class PresenceRegistry:
+    # Кто в сети. Записи (models.peer.Peer) индексируются по ключу
+    # (имя, IP), по имени и по адресу TCP-сервера. Сроки хранятся в куче
+    # с ленивым продлением: повторное объявление только меняет expires у
+    # записи, а куча перекладывает запись, когда до нее доходит очередь.
+    # Поэтому expire() тратит время только на записи, у которых подошел
+    # срок. Если срок стал раньше (узел объявил меньший таймаут), в кучу
+    # кладется новая запись, а старая пропускается по heap_id.
+    def __init__(self):
+        self._by_key = {}
+        # имя -> Peer, или list, если под этим именем несколько узлов
+        self._by_name = {}
+        self._by_addr = {}
+        # (срок, номер, ключ): у каждой записи Peer одна действующая
+        # запись в куче с ее heap_id. Записи удаленного узла и прежние
+        # записи с более поздним сроком остаются до своего срока и
+        # пропускаются, даже если ключ уже занят новым Peer.
+        self._heap = []
+        self._heap_ids = itertools.count()
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        # callback(event, peer) из потока обнаружения; event - JOIN/LEAVE/
+        # CHANGE, peer - сама запись (только для чтения). Возвращает
+        # функцию отписки.
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _publish(self, event, peer):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event, peer)
+            except Exception as e:
+                print(f"Ошибка подписчика присутствия: {e}")
+
+    def update(self, key, tcp_port, now, timeout=PEER_TIMEOUT, version=None):
+        # Возвращает запись; событие публикуется только при изменении.
+        # version - любой сравнимый признак версии данных узла.
+        event = None
+        with self._lock:
+            peer = self._by_key.get(key)
+            if peer is None:
+                peer = Peer(key, tcp_port, version)
+                self._by_key[key] = peer
+                self._add_name(peer)
+                self._by_addr[peer.addr_key] = peer
+                event = JOIN
+            elif (peer.tcp_port, peer.version) != (tcp_port, version):
+                if self._by_addr.get(peer.addr_key) is peer:
+                    del self._by_addr[peer.addr_key]
+                peer.tcp_port = tcp_port
+                peer.version = version
+                self._by_addr[peer.addr_key] = peer
+                event = CHANGE
+
+            peer.last_seen = now
+            peer.timeout = timeout
+            peer.expires = now + timeout
+            if event == JOIN or peer.expires < peer.queued:
+                self._schedule(peer)
+        if event:
+            self._publish(event, peer)
+        return peer
+
+    def _schedule(self, peer):
+        # Под self._lock
+        peer.heap_id = next(self._heap_ids)
+        peer.queued = peer.expires
+        heapq.heappush(self._heap, (peer.expires, peer.heap_id, peer.key))
+
+    def _add_name(self, peer):
+        name = peer.key[0]
+        other = self._by_name.get(name)
+        if other is None:
+            self._by_name[name] = peer
+        elif isinstance(other, list):
+            other.append(peer)
+        else:
+            self._by_name[name] = [other, peer]
+
+    def _remove_name(self, peer):
+        name = peer.key[0]
+        other = self._by_name.get(name)
+        if other is peer:
+            del self._by_name[name]
+        elif isinstance(other, list) and peer in other:
+            other.remove(peer)
+            if len(other) == 1:
+                self._by_name[name] = other[0]
+
+    @staticmethod
+    def touch(peer, now):
+        # Повтор объявления: O(1), без блокировки и без кучи
+        peer.last_seen = now
+        peer.expires = now + peer.timeout
+
+    def remove(self, key):
+        with self._lock:
+            peer = self._remove_locked(key)
+        if peer:
+            self._publish(LEAVE, peer)
+        return peer
+
+    def _remove_locked(self, key):
+        # Запись в куче остается и будет пропущена при expire()
+        peer = self._by_key.pop(key, None)
+        if peer is None:
+            return None
+        self._remove_name(peer)
+        if self._by_addr.get(peer.addr_key) is peer:
+            del self._by_addr[peer.addr_key]
+        return peer
+
+    def expire(self, now):
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, heap_id, key = heapq.heappop(self._heap)
+                peer = self._by_key.get(key)
+                if peer is None or peer.heap_id != heap_id:
+                    continue  # Удалена (и, может быть, вернулась заново)
+                if peer.expires > now:
+                    # Продлена с момента постановки в кучу
+                    peer.queued = peer.expires
+                    heapq.heappush(self._heap, (peer.expires, heap_id, key))
+                    continue
+                self._remove_locked(key)
+                expired.append(peer)
+        for peer in expired:
+            print(f"User {peer.username} expired")
+            self._publish(LEAVE, peer)
+        return len(expired)
+
+    def get(self, key):
+        return self._by_key.get(key)
+
+    def find(self, username, ip=None):
+        # O(1): по имени (и IP, если известен)
+        if ip is not None:
+            return self._by_key.get(user_key(username, ip))
+        with self._lock:
+            peer = self._by_name.get(username)
+            if isinstance(peer, list):
+                peer = max(peer, key=lambda p: p.last_seen)
+        return peer
+
+    def find_by_addr(self, ip, tcp_port):
+        return self._by_addr.get(addr_key(pack_ip(ip), tcp_port))
+
+    def users(self):
+        # Снимок списка: сами записи, без копирования полей
+        with self._lock:
+            return list(self._by_key.values())
+
+    entries = users
+
+    def __len__(self):
+        return len(self._by_key)
@@ -1,52 +1,280 @@
 import struct
-import json
 import base64
+import os
+import time
 from cryptography.fernet import Fernet
-from utils.constans import ENCRYPTION_KEY
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.hmac import HMAC
+from network.session import HEADER_SIZE as SEALED_HEADER_SIZE, FRAME_GROUP, \
+    ROOM_ID_SIZE
+from network.compression import compress
+from network.codec import JSON
+from utils.constans import ENCRYPTION_KEY, BUFFER_SIZE, MAX_FRAME_SIZE
+from utils import metrics
 
 cipher = Fernet(ENCRYPTION_KEY)
 
+# Бинарные кадры: [Length][Type (1 byte)][Payload].
+# Токен Fernet всегда начинается с 'g' (0x67), поэтому типы < 0x20
+# не пересекаются со старыми JSON-пакетами.
+FRAME_FILE_CHUNK = 0x01
+# Кадры сессионного AEAD-шифра (см. network/session.py). Пакет в
+# FRAME_SEALED_JSON - в согласованном кодеке (network/codec.py).
+FRAME_SEALED_JSON = 0x02
+FRAME_SEALED_CHUNK = 0x03
+# FRAME_GROUP = 0x04 (network/session.py) - кадр группового чата
 
-def send_json(sock, data_dict):
-    try:
-        json_bytes = json.dumps(data_dict).encode('utf-8')
-        encrypted_data = cipher.encrypt(json_bytes)
-        length_prefix = struct.pack('>I', len(encrypted_data))
+# Флаг в типе сессионного кадра: данные сжаты согласованным алгоритмом
+FLAG_COMPRESSED = 0x10
+
+# Заголовок куска файла: [Transfer ID (4 bytes)] + [Offset (8 bytes)]
+CHUNK_HEADER = struct.Struct('>IQ')
+
+_raw_key = base64.urlsafe_b64decode(ENCRYPTION_KEY)
+_signing_key = _raw_key[:16]
+_encryption_key = _raw_key[16:]
 
-        sock.sendall(length_prefix + encrypted_data)
+_IV_SIZE = 16
+_TAG_SIZE = 32
+
+
+def send_json(sock, data_dict, session=None, compression=None, codec=None):
+    try:
+        frame = encode_json(data_dict, session, compression, codec)
+        sock.sendall(frame)
+        if metrics.enabled:
+            metrics.BYTES_OUT.inc(len(frame), metrics.peer_label(sock))
     except Exception as e:
         print(f"Ошибка протокола (send): {e}")
         raise e
 
 
-def recv_json(sock):
+def send_file_chunk(sock, binary_data, session=None, transfer_id=0,
+                    offset=0, compression=None):
     try:
-        length_data = _recv_all(sock, 4)
-        if not length_data:
-            return None
+        frame = encode_file_chunk(binary_data, session, transfer_id, offset,
+                                  compression)
+        sock.sendall(frame)
+        if metrics.enabled:
+            metrics.BYTES_OUT.inc(len(frame), metrics.peer_label(sock))
+    except Exception as e:
+        print(f"Ошибка протокола (send chunk): {e}")
+        raise e
 
-        msg_length = struct.unpack('>I', length_data)[0]
 
-        encrypted_data = _recv_all(sock, msg_length)
-        if not encrypted_data:
-            return None
+def recv_json(sock, session=None, reader=None, compression=None,
+              codec=None):
+    try:
+        if reader is None:
+            reader = FrameReader(sock)
 
-        decrypted_data = cipher.decrypt(encrypted_data)
+        encrypted_data = reader.read_frame()
+        if encrypted_data is None:
+            return None
 
-        return json.loads(decrypted_data.decode('utf-8'))
+        return decode_frame(encrypted_data, session, compression, codec)
     except Exception as e:
         print(f"Ошибка протокола (recv): {e}")
         return None
 
 
-def _recv_all(sock, n):
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
+# encode_*/decode_frame не трогают сокет: их используют и потоковые
+# соединения, и asyncio (network/async_transport.py).
+# Кадр сессии - memoryview на внутренний буфер, действительный только до
+# следующего encode_* с той же сессией.
+
+def encode_json(data_dict, session=None, compression=None, codec=None):
+    # Согласованный кодек - только внутри сессии, как и сжатие
+    start = metrics.enabled and time.perf_counter()
+    payload = ((session and codec) or JSON).dumps(data_dict)
+    if start:
+        start = _lap('encode', start)
+    if session:
+        frame_type, payload = _pack(FRAME_SEALED_JSON, payload, compression)
+        frame = session.seal(frame_type, payload)
+    else:
+        encrypted_data = cipher.encrypt(payload)
+        frame = struct.pack('>I', len(encrypted_data)) + encrypted_data
+    if start:
+        _lap('encrypt', start)
+    return frame
+
+
+def encode_file_chunk(binary_data, session=None, transfer_id=0, offset=0,
+                      compression=None):
+    start = metrics.enabled and time.perf_counter()
+    header = CHUNK_HEADER.pack(transfer_id, offset)
+    if session:
+        frame_type, payload = _pack(FRAME_SEALED_CHUNK, binary_data,
+                                    compression)
+        frame = session.seal(frame_type, payload, header)
+    else:
+        frame = _encrypt_raw(FRAME_FILE_CHUNK, binary_data, header)
+        frame = struct.pack('>I', len(frame)) + frame
+    if start:
+        _lap('encrypt', start)
+    return frame
+
+
+def decode_frame(encrypted_data, session=None, compression=None,
+                 codec=None):
+    # encrypted_data - кадр без префикса длины
+    start = metrics.enabled and time.perf_counter()
+    frame_type = encrypted_data[0]
+    base_type = frame_type & ~FLAG_COMPRESSED
+    if base_type in (FRAME_SEALED_JSON, FRAME_SEALED_CHUNK):
+        if not session:
+            raise ValueError("Зашифрованный кадр без сессии")
+        extra_size = CHUNK_HEADER.size \
+            if base_type == FRAME_SEALED_CHUNK else 0
+        plain = session.open(encrypted_data, extra_size)
+        if frame_type & FLAG_COMPRESSED:
+            if not compression:
+                raise ValueError("Сжатый кадр без согласованного сжатия")
+            plain = compression.decompress(plain)
+        if start:
+            start = _lap('decrypt', start)
+
+        if base_type == FRAME_SEALED_CHUNK:
+            return _chunk_packet(encrypted_data,
+                                 SEALED_HEADER_SIZE - 4, plain)
+        return _loads(codec or JSON, plain, start)
+
+    if frame_type == FRAME_GROUP:
+        # Расшифровывает группа (core/group.py): ключ есть только у нее.
+        # Групповые кадры принимаются только внутри сессии.
+        if not session:
+            raise ValueError("Групповой кадр без сессии")
+        return {'type': 'group_frame',
+                'room': bytes(encrypted_data[1:1 + ROOM_ID_SIZE]),
+                'frame': bytes(encrypted_data)}
+
+    # После перехода на сессию старые кадры больше не принимаются
+    if session and session.has_received:
+        raise ValueError("Незашифрованный сессией кадр")
+
+    if frame_type == FRAME_FILE_CHUNK:
+        plain = _decrypt_raw(encrypted_data, CHUNK_HEADER.size)
+        if start:
+            _lap('decrypt', start)
+        return _chunk_packet(encrypted_data, 1, plain)
+
+    decrypted_data = cipher.decrypt(bytes(encrypted_data))
+    if start:
+        start = _lap('decrypt', start)
+
+    return _loads(JSON, decrypted_data, start)
+
+
+def _loads(codec, data, start):
+    result = codec.loads(data)
+    if start:
+        _lap('decode', start)
+    return result
+
+
+def _lap(op, start):
+    # Замер участка кадра; возвращает начало следующего участка
+    now = time.perf_counter()
+    metrics.FRAME_TIME.observe(now - start, op)
+    return now
+
+
+def _pack(frame_type, data, compression):
+    packed = compress(compression, data)
+    if packed is None:
+        return frame_type, data
+    return frame_type | FLAG_COMPRESSED, packed
+
+
+def _chunk_packet(frame, header_pos, data):
+    transfer_id, offset = CHUNK_HEADER.unpack_from(frame, header_pos)
+    return {'type': 'file_chunk', 'id': transfer_id, 'offset': offset,
+            'data': data}
+
+
+class FrameReader:
+    # Читает кадры через recv_into в один переиспользуемый буфер.
+    # read_frame() возвращает memoryview, который действителен только
+    # до следующего вызова.
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self._header = bytearray(4)
+        self._header_view = memoryview(self._header)
+        self._buf = bytearray(BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+        self._peer = None
+
+    def read_frame(self):
+        if not self._fill(self._header_view):
             return None
-        data += packet
-    return data
+
+        length = struct.unpack('>I', self._header)[0]
+        if length == 0:
+            raise ValueError("Пустой кадр")
+        if length > self.max_frame_size:
+            raise ValueError(
+                f"Кадр {length} байт больше лимита {self.max_frame_size}")
+
+        if length > len(self._buf):
+            size = min(max(length, len(self._buf) * 2), self.max_frame_size)
+            self._buf = bytearray(size)
+            self._view = memoryview(self._buf)
+
+        frame = self._view[:length]
+        if not self._fill(frame):
+            return None
+        if metrics.enabled:
+            if self._peer is None:
+                self._peer = metrics.peer_label(self.sock)
+            metrics.BYTES_IN.inc(length + 4, self._peer)
+        return frame
+
+    def _fill(self, view):
+        total = len(view)
+        received = 0
+        while received < total:
+            n = self.sock.recv_into(view[received:] if received else view)
+            if not n:
+                return False
+            received += n
+        return True
+
+
+def _encrypt_raw(frame_type, binary_data, extra=b''):
+    # Та же схема, что и у Fernet (AES-128-CBC + HMAC-SHA256 тем же ключом),
+    # но без base64 и метки времени.
+    iv = os.urandom(_IV_SIZE)
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    encryptor = Cipher(algorithms.AES(_encryption_key),
+                       modes.CBC(iv)).encryptor()
+    body = (bytes([frame_type]) + extra + iv
+            + encryptor.update(padder.update(binary_data))
+            + encryptor.update(padder.finalize()) + encryptor.finalize())
+
+    h = HMAC(_signing_key, hashes.SHA256())
+    h.update(body)
+    return body + h.finalize()
+
+
+def _decrypt_raw(frame, extra_size=0):
+    iv_pos = 1 + extra_size
+    if len(frame) < iv_pos + _IV_SIZE + _TAG_SIZE:
+        raise ValueError("Слишком короткий бинарный кадр")
+
+    body, tag = frame[:-_TAG_SIZE], frame[-_TAG_SIZE:]
+    h = HMAC(_signing_key, hashes.SHA256())
+    h.update(body)
+    h.verify(bytes(tag))
+
+    iv = bytes(body[iv_pos:iv_pos + _IV_SIZE])
+    decryptor = Cipher(algorithms.AES(_encryption_key),
+                       modes.CBC(iv)).decryptor()
+    padded = decryptor.update(body[iv_pos + _IV_SIZE:]) + decryptor.finalize()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    return unpadder.update(padded) + unpadder.finalize()
 
 
 def encode_file_data(binary_data):
@@ -54,4 +282,4 @@ def encode_file_data(binary_data):
 
 
 def decode_file_data(base64_string):
-    return base64.b64decode(base64_string)
\ No newline at end of file
+    return base64.b64decode(base64_string)
@@ -0,0 +1,191 @@
+import os
+import struct
+import base64
+import threading
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, \
+    ChaCha20Poly1305
+from utils.constans import ENCRYPTION_KEY
+
+CIPHERS = {
+    'aes-256-gcm': AESGCM,
+    'chacha20-poly1305': ChaCha20Poly1305,
+}
+# AES-GCM быстрее на процессорах с AES-NI, ChaCha20 - на остальных
+PREFERRED_CIPHERS = ['aes-256-gcm', 'chacha20-poly1305']
+
+NONCE_SIZE = 16
+TAG_SIZE = 16
+# [Length (4)] + [Type (1)] + [Counter (8)]
+HEADER_SIZE = 13
+# Кадр группы: зашифрован ключом группы, а не сессией соединения
+FRAME_GROUP = 0x04
+
+_master_key = base64.urlsafe_b64decode(ENCRYPTION_KEY)
+
+
+def new_nonce():
+    return os.urandom(NONCE_SIZE)
+
+
+def choose_cipher(offered):
+    for name in PREFERRED_CIPHERS:
+        if name in offered:
+            return name
+    return None
+
+
+class AeadSession:
+    def __init__(self, cipher_name, client_nonce, server_nonce, is_client):
+        if cipher_name not in CIPHERS:
+            raise ValueError(f"Неизвестный шифр: {cipher_name}")
+        self.cipher_name = cipher_name
+
+        # Отдельный ключ на каждое направление, чтобы счетчики nonce
+        # двух сторон никогда не совпадали.
+        key_material = HKDF(algorithm=hashes.SHA256(), length=64,
+                            salt=client_nonce + server_nonce,
+                            info=b'chat-session ' + cipher_name.encode()
+                            ).derive(_master_key)
+        client_key, server_key = key_material[:32], key_material[32:]
+        aead = CIPHERS[cipher_name]
+        self._tx = aead(client_key if is_client else server_key)
+        self._rx = aead(server_key if is_client else client_key)
+
+        self._tx_counter = 0
+        self._rx_counter = -1
+        self._buf = bytearray(HEADER_SIZE + TAG_SIZE)
+        self._has_encrypt_into = hasattr(self._tx, 'encrypt_into')
+
+    @property
+    def has_received(self):
+        return self._rx_counter >= 0
+
+    def seal(self, frame_type, data, extra=b''):
+        # Возвращает готовый кадр (с префиксом длины) в виде memoryview
+        # на внутренний буфер: он действителен только до следующего вызова,
+        # поэтому seal() и отправка должны идти под одной блокировкой.
+        # extra - открытый, но подписанный заголовок после счетчика.
+        counter = self._tx_counter
+        self._tx_counter += 1
+
+        start = HEADER_SIZE + len(extra)
+        total = start + len(data) + TAG_SIZE
+        if len(self._buf) < total:
+            self._buf = bytearray(total)
+        view = memoryview(self._buf)
+
+        struct.pack_into('>IBQ', self._buf, 0, total - 4, frame_type, counter)
+        view[HEADER_SIZE:start] = extra
+        header = view[4:start]
+        nonce = _nonce(counter)
+        if self._has_encrypt_into:
+            self._tx.encrypt_into(nonce, data, header, view[start:total])
+        else:
+            view[start:total] = self._tx.encrypt(nonce, data, bytes(header))
+        return view[:total]
+
+    def open(self, frame, extra_size=0):
+        # frame - кадр без префикса длины:
+        # [Type][Counter][Extra][Ciphertext+Tag]
+        start = HEADER_SIZE - 4 + extra_size
+        if len(frame) < start + TAG_SIZE:
+            raise ValueError("Слишком короткий зашифрованный кадр")
+
+        counter = struct.unpack_from('>Q', frame, 1)[0]
+        if counter <= self._rx_counter:
+            raise ValueError("Повтор или нарушение порядка кадров")
+
+        plain = self._rx.decrypt(_nonce(counter), frame[start:],
+                                 frame[:start])
+        self._rx_counter = counter
+        return plain
+
+
+# Групповой кадр: [Length (4)] + [Type (1)] + [Room (8)] + [Epoch (4)] +
+# [Counter (8)]
+GROUP_HEADER = struct.Struct('>IB8sIQ')
+GROUP_KEY_SIZE = 32
+ROOM_ID_SIZE = 8
+# Сколько эпох одного отправителя помнить для защиты от повтора
+MAX_EPOCHS = 8
+
+
+class GroupSession:
+    # Общий ключ группы: сообщение шифруется один раз, и один и тот же
+    # кадр уходит всем участникам. У каждого отправителя свой ключ
+    # (HKDF от ключа группы и имени), поэтому счетчики nonce разных
+    # участников не пересекаются. Эпоха - случайное число на запуск:
+    # после перезапуска отправителя счетчик начинается заново.
+    def __init__(self, room_id, key, username):
+        self.room_id = room_id
+        self._key = key
+        self._epoch = struct.unpack('>I', os.urandom(4))[0]
+        self._tx = AESGCM(self._sender_key(username))
+        self._tx_counter = 0
+        self._rx = {}  # отправитель -> AESGCM
+        self._rx_counters = {}  # отправитель -> {эпоха: счетчик}
+        # отправитель -> вытесненные эпохи: их кадры уже не принимаются,
+        # иначе после вытеснения эпохи можно повторить все ее кадры
+        self._rx_retired = {}
+        self._lock = threading.Lock()
+
+    def _sender_key(self, username):
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=self.room_id,
+                    info=b'chat-group ' + username.encode('utf-8')
+                    ).derive(self._key)
+
+    def seal(self, data):
+        # Возвращает bytes, а не memoryview: кадр живет в очередях всех
+        # участников
+        with self._lock:
+            counter = self._tx_counter
+            self._tx_counter += 1
+        total = GROUP_HEADER.size + len(data) + TAG_SIZE
+        header = GROUP_HEADER.pack(total - 4, FRAME_GROUP, self.room_id,
+                                   self._epoch, counter)
+        return header + self._tx.encrypt(_group_nonce(self._epoch, counter),
+                                         data, header[4:])
+
+    def open(self, frame, sender):
+        # frame - кадр без префикса длины; sender - имя собеседника на
+        # том конце соединения, по которому кадр пришел
+        start = GROUP_HEADER.size - 4
+        if len(frame) < start + TAG_SIZE:
+            raise ValueError("Слишком короткий групповой кадр")
+        epoch, counter = struct.unpack_from('>IQ', frame, 1 + ROOM_ID_SIZE)
+        with self._lock:
+            aead = self._rx.get(sender)
+            if aead is None:
+                aead = self._rx[sender] = AESGCM(self._sender_key(sender))
+            counters = self._rx_counters.setdefault(sender, {})
+            retired = self._rx_retired.setdefault(sender, set())
+            _check_replay(counters, retired, epoch, counter)
+
+        plain = aead.decrypt(_group_nonce(epoch, counter), frame[start:],
+                             frame[:start])
+        with self._lock:
+            # Тот же кадр мог открыться параллельно
+            _check_replay(counters, retired, epoch, counter)
+            # Порядок - по последнему кадру: вытесняется самая старая эпоха
+            counters.pop(epoch, None)
+            counters[epoch] = counter
+            if len(counters) > MAX_EPOCHS:
+                oldest = next(iter(counters))
+                del counters[oldest]
+                retired.add(oldest)
+        return plain
+
+
+def _check_replay(counters, retired, epoch, counter):
+    if epoch in retired or counter <= counters.get(epoch, -1):
+        raise ValueError("Повтор группового кадра")
+
+
+def _group_nonce(epoch, counter):
+    return struct.pack('>IQ', epoch, counter)
+
+
+def _nonce(counter):
+    return b'\x00\x00\x00\x00' + struct.pack('>Q', counter)
@@ -1,20 +1,33 @@
 import socket
-from network.protocol import send_json, recv_json
+from network.connection import Connection
 
 class TCPClient:
     def __init__(self, host, port):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((host, port))
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.conn = Connection(self.sock)
+
+    def handshake(self, username):
+        self.conn.start_handshake(username)
 
     def send_data(self, payload):
-        send_json(self.sock, payload)
+        self.conn.send_json(payload)
 
     def recv_data(self):
-        return recv_json(self.sock)
+        return self.conn.recv_json()
 
     def close(self):
-        try:
-            self.sock.close()
-        except:
-            pass
\ No newline at end of file
+        self.conn.close()
+
+
+def connect_peer(host, port, username, **extra):
+    # Блокирующее подключение с завершенным рукопожатием
+    client = TCPClient(host, port)
+    try:
+        client.conn.start_handshake(username, **extra)
+        client.conn.wait_handshake()
+    except Exception:
+        client.close()
+        raise
+    return client.conn
\ No newline at end of file
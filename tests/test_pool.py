@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.node import ChatNode
+from models.user import User
+
+# Сколько ждать сообщения на loopback, с
+TIMEOUT = 5
+
+
+def make_node(name):
+    node = ChatNode(name, 0, '127.0.0.1', discovery=False, history=False,
+                    peers=False)
+    node.start()
+    return node
+
+
+class ReleasedConversationTest(unittest.TestCase):
+    def setUp(self):
+        self.alice = make_node('alice')
+        self.bob = make_node('bob')
+
+    def tearDown(self):
+        self.alice.stop()
+        self.bob.stop()
+
+    def test_woken_conversation_survives_sweep(self):
+        # Окно закрыто (release), собеседник пишет снова - переписка
+        # открывается заново и не должна закрываться по простою
+        messages = []
+        received = threading.Event()
+
+        def on_conversation(conversation):
+            conversation.on_message = lambda text: (messages.append(text),
+                                                    received.set())
+            conversation.start()
+
+        self.bob.on_conversation = on_conversation
+        user = User('127.0.0.1', self.bob.port, 'bob', 0)
+        outgoing = self.alice.connect(user).result(TIMEOUT)
+        outgoing.send_text('первое')
+        self.assertTrue(received.wait(TIMEOUT))
+
+        conversation, = self.bob.pool.conversations()
+        conversation.release()
+        received.clear()
+        outgoing.send_text('второе')
+        self.assertTrue(received.wait(TIMEOUT))
+
+        self.bob.pool.idle_timeout = -1
+        self.bob.pool.sweep()
+        self.assertTrue(conversation.is_alive)
+        self.assertEqual(messages, ['первое', 'второе'])
+
+    def test_unowned_incoming_conversation_is_swept(self):
+        # Соединение участника группы (group=True) не открывает чат, и
+        # владельца у переписки нет: пул закрывает ее по простою
+        user = User('127.0.0.1', self.bob.port, 'bob', 0)
+        outgoing = self.alice.connect(user, group=True).result(TIMEOUT)
+        conversation = self._incoming(self.bob)
+
+        self.bob.pool.sweep()
+        self.assertTrue(conversation.is_alive)
+        self.bob.pool.idle_timeout = -1
+        self.bob.pool.sweep()
+        self.assertFalse(conversation.is_alive)
+        self.alice.pool.idle_timeout = -1
+        self.alice.pool.sweep()
+        self.assertFalse(outgoing.is_alive)
+
+    def test_unowned_conversations_count_towards_max_idle(self):
+        # Сверх max_idle закрывается переписка с самым давним кадром
+        self.bob.pool.max_idle = 1
+        user = User('127.0.0.1', self.bob.port, 'bob', 0)
+        self.alice.connect(user, group=True).result(TIMEOUT)
+        first = self._incoming(self.bob)
+
+        carol = make_node('carol')
+        self.addCleanup(carol.stop)
+        carol.connect(user, group=True).result(TIMEOUT)
+        self.assertTrue(self._wait(lambda: [
+            c.user.username for c in self.bob.pool.conversations()] ==
+            ['carol']))
+        self.assertFalse(first.is_alive)
+
+    def test_started_group_holds_member_connections(self):
+        received = threading.Event()
+
+        def on_group(group):
+            group.on_message = lambda sender, text: received.set()
+            group.start()
+
+        self.bob.on_group = on_group
+        user = User('127.0.0.1', self.bob.port, 'bob', 0)
+        group = self.alice.create_group('g', [user])
+        group.start()
+        group.send_text('привет').result(TIMEOUT)
+        self.assertTrue(received.wait(TIMEOUT))
+
+        conversation, = self.alice.pool.conversations()
+        self.alice.pool.idle_timeout = -1
+        self.alice.pool.sweep()
+        self.assertTrue(conversation.is_alive)
+        group.release()
+        self.alice.pool.sweep()
+        self.assertFalse(conversation.is_alive)
+
+    def test_group_connections_beyond_max_idle_are_kept(self):
+        # Группа подключается ко всем участникам сразу: новые соединения
+        # не должны вытесняться до того, как группа их возьмет
+        carol = make_node('carol')
+        self.addCleanup(carol.stop)
+        received = []
+        done = threading.Event()
+
+        def on_group(group):
+            def on_message(sender, text):
+                received.append(text)
+                if len(received) == 2:
+                    done.set()
+            group.on_message = on_message
+            group.start()
+
+        self.bob.on_group = carol.on_group = on_group
+        self.alice.pool.max_idle = 0
+        users = [User('127.0.0.1', node.port, node.username, 0)
+                 for node in (self.bob, carol)]
+        group = self.alice.create_group('g', users)
+        group.start()
+        group.send_text('привет').result(TIMEOUT)
+        self.assertTrue(done.wait(TIMEOUT))
+        self.assertEqual(len(self.alice.pool.conversations()), 2)
+
+    def _incoming(self, node):
+        conversation, = self._wait(node.pool.conversations)
+        return conversation
+
+    @staticmethod
+    def _wait(condition):
+        # Входящие переписки появляются в пуле из сетевого цикла
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            result = condition()
+            if result:
+                return result
+            time.sleep(0.01)
+        return condition()
+
+
+if __name__ == '__main__':
+    unittest.main()
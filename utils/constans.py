@@ -1,6 +1,65 @@
 BROADCAST_PORT = 5007
+# Интервал объявлений растет от MIN до MAX (с), разброс +-JITTER
+ANNOUNCE_MIN_INTERVAL = 0.5
+ANNOUNCE_MAX_INTERVAL = 30
+ANNOUNCE_JITTER = 0.2
+# Собеседник без объявлений дольше этого считается ушедшим (для JSON)
+PEER_TIMEOUT = 120
+# Групповая рассылка вместо широковещательной: группа и TTL (1 - только
+# своя подсеть, больше - через маршрутизаторы с поддержкой multicast)
+USE_MULTICAST = False
+MULTICAST_GROUP = '239.255.70.7'
+MULTICAST_TTL = 1
+# Опорные узлы "хост[:порт]", с которыми узел обменивается списками
+# собеседников из других подсетей: раз в GOSSIP_INTERVAL с - с FANOUT из них
+DISCOVERY_SEEDS = []
+GOSSIP_INTERVAL = 10
+GOSSIP_FANOUT = 2
+# Известные собеседники из базы: скольким последним при запуске сразу
+# отправляется объявление (в том числе в другие подсети)
+DISCOVERY_PROBE_LIMIT = 64
+# Как часто замеченные собеседники сохраняются в базу, с
+PEER_SAVE_INTERVAL = 5
 TCP_PORT = 5005
 BUFFER_SIZE = 4096
+FILE_CHUNK_SIZE = 1024 * 1024
+MIN_FILE_CHUNK_SIZE = 256 * 1024
+MAX_FILE_CHUNK_SIZE = 4 * 1024 * 1024
+FILE_WINDOW_SIZE = 16 * 1024 * 1024
+FILE_ACK_TIMEOUT = 30
+# Дополнительные TCP-соединения для передачи одного файла (0 - только основное)
+FILE_STREAMS = 2
+MAX_FILE_STREAMS = 8
+MAX_FRAME_SIZE = 32 * 1024 * 1024
+# Очередь ожидающих accept соединений у TCP-сервера
+TCP_BACKLOG = 1024
+# Пул соединений: сколько закрытых чатов держать подключенными и как долго
+MAX_IDLE_CONNECTIONS = 32
+IDLE_TIMEOUT = 300
+# TCP keepalive: первая проверка после простоя, интервал и число попыток
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+# Сколько мелкие кадры могут ждать в очереди записи, чтобы уйти пачкой, с
+WRITE_COALESCE_DELAY = 0.001
+# Групповой чат: сколько кадров может ждать отправки одному участнику.
+# Дальше кадры для отстающего отбрасываются, а остальные его не ждут.
+GROUP_QUEUE_SIZE = 1024
+# Сколько сообщение группы ждет, пока отстающее большинство догонит, с
+GROUP_SEND_TIMEOUT = 10
+# Потоки для сериализации и шифрования кадров вне цикла asyncio и
+# потока GUI (None - по числу ядер, как у ThreadPoolExecutor)
+CRYPTO_WORKERS = None
+# История: сколько строк пишется одной транзакцией и сколько последних
+# сообщений показывает окно чата при открытии
+HISTORY_BATCH_SIZE = 5000
+HISTORY_PRELOAD = 500
+# Метрики (utils/metrics.py): выключенные стоят одной проверки на замер.
+# METRICS_PORT - HTTP для Prometheus у GUI (None - нет); в cli.py -
+# --metrics-port / --metrics-json, они же включают замеры
+METRICS_ENABLED = False
+METRICS_PORT = None
+METRICS_DUMP_INTERVAL = 10
 ENCRYPTION_KEY = b'wA8XhQ9X_4j-wZJ8yM5nKq3Lp7oRt1vE9sU2dF4gH6k='
 
 WINDOW_WIDTH = 400
@@ -0,0 +1,311 @@
+import sys
+import json
+import time
+import bisect
+import threading
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.constans import METRICS_ENABLED
+
+# Счетчики и гистограммы горячих путей. Каждое место замера проверяет
+# metrics.enabled до любой работы (даже до perf_counter), поэтому
+# выключенные метрики стоят одной проверки атрибута модуля.
+enabled = METRICS_ENABLED
+
+# Границы гистограмм времени, с: от 10 мкс до 1 с
+TIME_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+_registry = []
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+class Counter:
+    # Монотонный счетчик, по значению на метку (label=None - без метки)
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, value=1, label=None):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + value
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge:
+    # Текущее значение. Вместо set() можно отдать функцию: она вызывается
+    # только при выгрузке, и на горячем пути не стоит ничего.
+    kind = 'gauge'
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._functions = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set(self, value, label=None):
+        self._values[label] = value
+
+    def track(self, function, label=None):
+        # Возвращает функцию, которая снимает отслеживание
+        with self._lock:
+            self._functions[label] = function
+
+        def untrack():
+            with self._lock:
+                if self._functions.get(label) is function:
+                    del self._functions[label]
+        return untrack
+
+    def values(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for label, function in functions:
+            try:
+                values[label] = function()
+            except Exception as e:
+                print(f"Ошибка метрики {self.name}: {e}")
+        return values
+
+
+class Histogram:
+    # Распределение по фиксированным корзинам: observe() - bisect и три
+    # сложения
+    kind = 'histogram'
+
+    def __init__(self, name, help, label=None, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._values = {}  # метка -> [счетчики корзин..., сумма, число]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, label=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(label)
+            if row is None:
+                row = self._values[label] = [0] * (len(self.buckets) + 3)
+            row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def values(self):
+        # метка -> {'buckets': накопленные счетчики, 'sum', 'count'}
+        with self._lock:
+            rows = {label: list(row) for label, row in self._values.items()}
+        result = {}
+        for label, row in rows.items():
+            total, cumulative = 0, []
+            for count in row[:len(self.buckets) + 1]:
+                total += count
+                cumulative.append(total)
+            result[label] = {'buckets': cumulative, 'sum': row[-2],
+                             'count': row[-1]}
+        return result
+
+
+def peer_label(sock):
+    # Собеседник - по IP: у исходящих соединений порт случайный
+    try:
+        return sock.getpeername()[0]
+    except (OSError, AttributeError, IndexError):
+        return '?'
+
+
+# Горячие пути
+BYTES_IN = Counter('chat_bytes_received_total',
+                   "Байт кадров, принятых от собеседника", 'peer')
+BYTES_OUT = Counter('chat_bytes_sent_total',
+                    "Байт кадров, отправленных собеседнику", 'peer')
+FRAME_TIME = Histogram('chat_frame_seconds',
+                       "Время обработки кадра: encode/encrypt/decrypt/decode",
+                       'op')
+UI_QUEUE = Gauge('chat_ui_queue_depth',
+                 "Вызовы, ожидающие потока Tk (TkBridge)")
+UI_DRAIN = Histogram('chat_ui_drain_seconds',
+                     "Время одного прохода очереди TkBridge в потоке Tk")
+DISCOVERY_PACKETS = Counter('chat_discovery_packets_total',
+                            "Пакеты обнаружения", 'direction')
+CONNECTIONS = Gauge('chat_active_connections',
+                    "Открытые переписки узла", 'node')
+GROUP_DROPPED = Counter('chat_group_dropped_total',
+                        "Групповые кадры, отброшенные для отстающего "
+                        "участника", 'member')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(name, value, le=None):
+    # le - граница корзины гистограммы, идет последней меткой
+    pairs = [] if value is None else [f'{name}="{_escape(value)}"']
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return f"{{{','.join(pairs)}}}" if pairs else ''
+
+
+def render_prometheus():
+    # Текстовый формат Prometheus 0.0.4
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for label, value in metric.values().items():
+            if metric.kind != 'histogram':
+                labels = _format_labels(metric.label, label)
+                lines.append(f"{metric.name}{labels} {value}")
+                continue
+            for bound, count in zip(metric.buckets + ('+Inf',),
+                                    value['buckets']):
+                labels = _format_labels(metric.label, label, le=bound)
+                lines.append(f"{metric.name}_bucket{labels} {count}")
+            labels = _format_labels(metric.label, label)
+            lines.append(f"{metric.name}_sum{labels} {value['sum']}")
+            lines.append(f"{metric.name}_count{labels} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    # {имя: {метка: значение}} для JSON; метка None -> ""
+    result = {'time': time.time()}
+    for metric in _registry:
+        result[metric.name] = {
+            '' if label is None else str(label): value
+            for label, value in metric.values().items()}
+    if _sampler:
+        result['profile'] = _sampler.top()
+    return result
+
+
+def _rates(previous, current):
+    # Счетчики в секунду между двумя снимками (Prometheus считает сам)
+    elapsed = current['time'] - previous['time']
+    rates = {}
+    for metric in _registry:
+        if metric.kind != 'counter' or elapsed <= 0:
+            continue
+        old = previous.get(metric.name, {})
+        rates[metric.name] = {
+            label: (value - old.get(label, 0)) / elapsed
+            for label, value in current[metric.name].items()}
+    return rates
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    # /metrics - для Prometheus, /metrics.json - то же в JSON
+    enable()
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def start_json_dump(path, interval):
+    # Раз в interval секунд перезаписывает path снимком метрик.
+    # Возвращает функцию остановки.
+    enable()
+    stop = threading.Event()
+
+    def worker():
+        previous = None
+        while not stop.wait(interval):
+            current = snapshot()
+            if previous:
+                current['rates'] = _rates(previous, current)
+            previous = current
+            try:
+                with open(path, 'w') as f:
+                    json.dump(current, f)
+            except OSError as e:
+                print(f"Ошибка записи метрик: {e}")
+
+    threading.Thread(target=worker, daemon=True).start()
+    return stop.set
+
+
+class Sampler:
+    # Выборочный профилировщик: раз в interval снимает стеки всех потоков
+    # и считает, в какой функции каждый был. on_sample(thread_id, frame)
+    # - точка подключения внешнего профилировщика.
+    def __init__(self, interval=0.005, on_sample=None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.samples = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if self.on_sample:
+                    self.on_sample(thread_id, frame)
+                code = frame.f_code
+                self.samples[f"{code.co_name} "
+                             f"({code.co_filename}:{frame.f_lineno})"] += 1
+
+    def top(self, count=20):
+        return self.samples.most_common(count)
+
+    def stop(self):
+        self._stop.set()
+
+
+_sampler = None
+
+
+def start_sampler(interval=0.005, on_sample=None):
+    global _sampler
+    _sampler = Sampler(interval, on_sample).start()
+    return _sampler